@@ -3,6 +3,8 @@ ASGI config for Inventory project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the site with an ASGI server, such as uvicorn, for open BOM pages to receive live checklist updates.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -0,0 +1,18 @@
+from .settings import *
+
+# The concurrency tests need select_for_update, which SQLite doesn't have, so CI also runs the tests against
+# PostgreSQL. The database is configured by the SQL_* variables, as in settings.py
+
+DEBUG = True
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'unique-snowflake',
+    }
+}
+
+# Use a different password hasher for faster tests
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
@@ -20,7 +20,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.environ.get("SECRET_KEY", default='insecure')
 
-DEBUG = bool(os.environ.get("DEBUG", default=1))
+# Production mode, set by PRODUCTION=1, is served by gunicorn (see gunicorn.conf.py) rather than runserver. It keeps
+# database connections open between requests and serves hashed, precompressed static files with WhiteNoise
+PRODUCTION = os.environ.get("PRODUCTION") == "1"
+
+DEBUG = bool(os.environ.get("DEBUG", default='' if PRODUCTION else 1))
 
 ALLOWED_HOSTS = ['*']
 
@@ -33,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_tables2',
     'app',
 ]
@@ -45,6 +50,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.CatalogueLookupMiddleware',
 ]
 
 ROOT_URLCONF = 'Inventory.urls'
@@ -79,6 +85,10 @@ DATABASES = {
         "PASSWORD": os.environ.get("SQL_PASSWORD", "123"),
         "HOST": os.environ.get("SQL_HOST", "localhost"),
         "PORT": os.environ.get("SQL_PORT", "5432"),
+        # Seconds to reuse a connection for. runserver starts a thread per request, so could never reuse one
+        "CONN_MAX_AGE": int(os.environ.get("SQL_CONN_MAX_AGE", 60 if PRODUCTION else 0)),
+        # Check a reused connection still works before each request, rather than failing the request
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -115,11 +125,35 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+if PRODUCTION:
+    # Served before the rest of the middleware runs, so static files don't touch the session or the database
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'whitenoise.middleware.WhiteNoiseMiddleware')
+    # collectstatic adds a hash of its contents to each file's name and writes gzip and Brotli copies of it.
+    # WhiteNoise serves the hashed names with a far-future, immutable Cache-Control header
+    STORAGES = {
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+    }
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-MEDIA_ROOT = ''
-MEDIA_URL = ''
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", BASE_DIR / 'media')
+MEDIA_URL = '/media/'
+# Uploaded files are only served to logged in users. runserver serves them itself when DEBUG is on. Otherwise set this
+# to an internal location of the proxy in front of the site that serves MEDIA_ROOT, such as /protected-media/, and
+# the site answers each request for a file with an X-Accel-Redirect header telling the proxy to send it
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT", "")
+
+# How live updates reach open pages (see app/live.py): memory, which only reaches pages served by the same process, or
+# postgres, which reaches pages served by every process through PostgreSQL's NOTIFY
+LIVE_LAYER = os.environ.get("LIVE_LAYER", "memory")
+
+# Seconds to keep catalogue entries in the cache between requests, or None to only look them up once per request.
+# Only set this when CACHES points at a cache shared by every server process
+CATALOGUE_CACHE_TIMEOUT = None
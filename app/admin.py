@@ -2,5 +2,22 @@ from django.contrib import admin
 
 from app.models import *
 
+
+@admin.register(Stock)
+class StockAdmin(admin.ModelAdmin):
+    """Stock is the balance of the StockMovement ledger, so it is only changed through app.services, which records
+    each change as a movement. The admin only shows it."""
+    list_display = ('stock_id', 'part_number', 'location', 'quantity', 'reserved', 'last_modified')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # Register your models here.
-admin.site.register([Catalogue, Stock, Bom, BomItems, Location])
+admin.site.register([Catalogue, Bom, BomItems, Location])
@@ -0,0 +1,289 @@
+"""JSON endpoints for handheld scanners.
+
+Each scan is a single POST that returns just the row it changed, rather than redirecting to a page that re-renders every
+table. Requests are authenticated with the same session as the rest of the site, and take the same fields as the
+forms on the stock and BOM pages, either as JSON or form encoded.
+"""
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+
+from app import services
+from app.forms import StockScanForm, CheckoutForm, BomChecklistForm, StockScanLineForm, TransferForm
+from app.models import Stock, Catalogue, Location, ProcessedScan
+
+# Largest number of scans accepted in one batch, which keeps the lookups for a batch within SQLite's parameter limit
+MAX_BATCH_SCANS = 400
+
+
+def api_login_required(view):
+    """Like login_required, but answers with a 401 rather than redirecting to the login page."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def request_data(request):
+    """The fields posted with the request. Raises ValueError if a JSON body can't be decoded."""
+    if request.content_type == 'application/json':
+        data = json.loads(request.body or '{}')
+        if not isinstance(data, dict):
+            raise ValueError('Expected a JSON object')
+        return data
+    return request.POST
+
+
+def request_scans(request):
+    """The list of scans posted to a batch endpoint. Raises ValueError if there isn't one."""
+    scans = request_data(request).get('scans')
+    if not isinstance(scans, list) or not all(isinstance(scan, dict) for scan in scans):
+        raise ValueError('Expected a list of scans')
+    if len(scans) > MAX_BATCH_SCANS:
+        raise ValueError(f'At most {MAX_BATCH_SCANS} scans can be sent at once')
+    return scans
+
+
+def error_response(errors, status=400):
+    return JsonResponse({'errors': errors}, status=status)
+
+
+def form_errors(form):
+    return {field: [error['message'] for error in errors] for field, errors in form.errors.get_json_data().items()}
+
+
+def stock_json(entry: Stock):
+    return {
+        'stock_id': entry.stock_id,
+        'part_number': entry.part_number_id,
+        'location': entry.location_id,
+        'quantity': entry.quantity,
+        'comment': entry.comment,
+        'last_modified': entry.last_modified,
+    }
+
+
+@require_POST
+@api_login_required
+def receive_stock(request):
+    """Scan stock into a location. Responds with the stock entry after the scan."""
+    try:
+        form = StockScanForm(request_data(request))
+    except ValueError as e:
+        return error_response({'__all__': [str(e)]})
+    if not form.is_valid():
+        return error_response(form_errors(form))
+    entry = services.receive_stock(
+        form.cleaned_data['part_number'],
+        form.cleaned_data['location'],
+        form.cleaned_data['quantity'],
+        username=request.user.username,
+        comment=form.cleaned_data['comment'],
+    )
+    return JsonResponse({'stock': stock_json(entry)}, status=201)
+
+
+def receive_scans(scans, username):
+    """Validate and apply a batch of stock scans. Returns a result for each scan, in order."""
+    lines = [StockScanLineForm(scan) for scan in scans]
+    valid = [form for form in lines if form.is_valid()]
+    part_numbers = set(Catalogue.objects.filter(part_number__in={form.cleaned_data['part_number'] for form in valid})
+                       .values_list('part_number', flat=True))
+    locations = set(Location.objects.filter(id__in={form.cleaned_data['location'] for form in valid})
+                    .values_list('id', flat=True))
+    quantities = {}
+    for form in valid:
+        key = (form.cleaned_data['part_number'], form.cleaned_data['location'])
+        if key[0] not in part_numbers:
+            form.add_error('part_number', 'Part number not found in catalogue')
+        if key[1] not in locations:
+            form.add_error('location', 'Location not found')
+        if not form.errors:
+            quantities[key] = quantities.get(key, 0) + form.cleaned_data['quantity']
+
+    entries = services.receive_many(quantities, username=username) if quantities else {}
+    results = []
+    for form in lines:
+        if form.errors:
+            results.append({'errors': form_errors(form)})
+        else:
+            results.append({'stock': stock_json(entries[form.cleaned_data['part_number'],
+                                                          form.cleaned_data['location']])})
+    return results
+
+
+@require_POST
+@api_login_required
+def receive_stock_batch(request):
+    """Scan a batch of stock, such as a pallet, in one request and one transaction.
+    Takes {"scans": [{"part_number": ..., "location": ..., "quantity": ...}, ...]} and responds with a result for each
+    scan in the same order: either the stock entry after the whole batch, or the scan's errors.
+    Scans with errors are skipped and the rest are still applied."""
+    try:
+        scans = request_scans(request)
+    except ValueError as e:
+        return error_response({'scans': [str(e)]})
+    return JsonResponse({'results': receive_scans(scans, request.user.username)})
+
+
+@require_POST
+@api_login_required
+def replay_scans(request):
+    """Apply the scans a scanner queued while it was offline.
+    Takes {"scans": [{"key": ..., "kind": "stock" or "checklist", ...}, ...]}, where the key is unique to the scan and
+    the other fields are those of the receive and checklist endpoints, plus "bom" for checklist scans.
+    Responds with a result for each scan, in order. A scan whose key has been replayed before is not applied again, and
+    gets the result it was given the first time."""
+    try:
+        scans = request_scans(request)
+    except ValueError as e:
+        return error_response({'scans': [str(e)]})
+    try:
+        results = apply_queued_scans(scans, request.user.username)
+    except IntegrityError:
+        # The same queue was being replayed in another request, which has now recorded its scans as processed
+        results = apply_queued_scans(scans, request.user.username)
+    return JsonResponse({'results': results})
+
+
+@transaction.atomic
+def apply_queued_scans(scans, username):
+    """Apply the scans that haven't been processed yet, and record them as processed in the same transaction."""
+    results = [None] * len(scans)
+    keys = {scan.get('key') for scan in scans if isinstance(scan.get('key'), str)}
+    processed = dict(ProcessedScan.objects.filter(key__in=keys).values_list('key', 'result'))
+    new = {}
+    for i, scan in enumerate(scans):
+        key = scan.get('key')
+        if not isinstance(key, str) or not key or len(key) > ProcessedScan._meta.get_field('key').max_length:
+            results[i] = {'errors': {'key': ['Every scan needs a key of up to 64 characters']}}
+        elif scan.get('kind') not in ('stock', 'checklist'):
+            results[i] = {'errors': {'kind': ['Expected "stock" or "checklist"']}}
+        elif key not in processed:
+            # A key that appears twice in the queue is only applied once
+            new.setdefault(key, scan)
+
+    stock_keys = [key for key, scan in new.items() if scan['kind'] == 'stock']
+    new_results = dict(zip(stock_keys, receive_scans([new[key] for key in stock_keys], username)))
+    for key, scan in new.items():
+        if scan['kind'] == 'checklist':
+            bom_id = scan.get('bom')
+            if isinstance(bom_id, int) and bom_id > 0:
+                new_results[key], _ = tick_off_checklist(BomChecklistForm(scan, bom_id=bom_id))
+            else:
+                new_results[key] = {'errors': {'bom': ['Expected a BOM id']}}
+    # Results go through JSON now, so replays get exactly what was stored
+    new_results = json.loads(json.dumps(new_results, cls=DjangoJSONEncoder))
+    ProcessedScan.objects.bulk_create(ProcessedScan(key=key, result=result, modified_by=username)
+                                      for key, result in new_results.items())
+    processed.update(new_results)
+
+    for i, scan in enumerate(scans):
+        if results[i] is None:
+            results[i] = processed[scan['key']]
+    return results
+
+
+def apply_once(key, username, apply):
+    """Apply a scan posted by a page, unless a scan with the same key has been processed, here or by replay_scans.
+    `apply` applies the scan and returns its result. Returns that result, or the one the key was given before.
+    Without a key, the scan is always applied."""
+    if key is None:
+        return apply()
+    try:
+        with transaction.atomic():
+            processed = ProcessedScan.objects.filter(key=key).values_list('result', flat=True).first()
+            if processed is not None:
+                return processed
+            result = json.loads(json.dumps(apply(), cls=DjangoJSONEncoder))
+            ProcessedScan.objects.create(key=key, result=result, modified_by=username)
+            return result
+    except IntegrityError:
+        # Applied by another request with the same key while this one was, so this one was rolled back
+        processed = ProcessedScan.objects.filter(key=key).values_list('result', flat=True).first()
+        if processed is None:
+            raise
+        return processed
+
+
+def tick_off_checklist(form: BomChecklistForm):
+    """Validate and apply one checklist scan, returning its result and the status to respond with."""
+    if not form.is_valid():
+        return {'errors': form_errors(form)}, 400
+    part_number = form.cleaned_data['part_number']
+    remaining = services.scan_checklist(form.bom_id, part_number)
+    if remaining is None:
+        # The last one was scanned at another station since the form was validated
+        return {'errors': {'part_number': [BomChecklistForm.ALL_SCANNED]}}, 409
+    return {'checklist': {'bom': form.bom_id, 'part_number': part_number, 'quantity_remaining': remaining}}, 200
+
+
+@require_POST
+@api_login_required
+def checkout_stock(request, stock_id):
+    """Check out some or all of a stock entry.
+    Responds with what was checked out, and the entry afterwards, which is null if none is left."""
+    try:
+        form = CheckoutForm(request_data(request))
+    except ValueError as e:
+        return error_response({'__all__': [str(e)]})
+    if not form.is_valid():
+        return error_response(form_errors(form))
+    try:
+        checked_out = services.checkout_stock(stock_id, form.cleaned_data['quantity'],
+                                              username=request.user.username)
+    except Stock.DoesNotExist:
+        return error_response({'__all__': ['Stock entry not found']}, status=404)
+    remaining = Stock.objects.filter(stock_id=stock_id).first()
+    return JsonResponse({
+        'checked_out': {
+            'checked_out_id': checked_out.checked_out_id,
+            'part_number': checked_out.part_number_id,
+            'location': checked_out.location_id,
+            'quantity': checked_out.quantity,
+        },
+        'stock': stock_json(remaining) if remaining is not None else None,
+    })
+
+
+@require_POST
+@api_login_required
+def transfer_stock(request, stock_id):
+    """Move some or all of a stock entry to another location.
+    Responds with the entry at the new location, and the entry moved from, which is null if none is left."""
+    try:
+        form = TransferForm(request_data(request))
+    except ValueError as e:
+        return error_response({'__all__': [str(e)]})
+    if not form.is_valid():
+        return error_response(form_errors(form))
+    if Stock.objects.filter(stock_id=stock_id, location=form.cleaned_data['location']).exists():
+        return error_response({'location': ['The stock is already in this location']})
+    try:
+        moved = services.transfer_stock(stock_id, form.cleaned_data['location'], form.cleaned_data['quantity'],
+                                        username=request.user.username)
+    except Stock.DoesNotExist:
+        return error_response({'__all__': ['Stock entry not found']}, status=404)
+    remaining = Stock.objects.filter(stock_id=stock_id).first()
+    return JsonResponse({
+        'stock': stock_json(moved),
+        'from': stock_json(remaining) if remaining is not None else None,
+    })
+
+
+@require_POST
+@api_login_required
+def scan_checklist(request, bom_id):
+    """Tick off one scanned item on a BOM's checklist. Responds with the quantity of the part still to be scanned."""
+    try:
+        data = request_data(request)
+    except ValueError as e:
+        return error_response({'__all__': [str(e)]})
+    result, status = tick_off_checklist(BomChecklistForm(data, bom_id=bom_id))
+    return JsonResponse(result, status=status)
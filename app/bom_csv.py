@@ -0,0 +1,113 @@
+"""Import and export BOMs as CSV, the format engineering's spreadsheets are saved in."""
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from app import lookups
+from app.models import BomItems
+
+# Columns written by export_rows. Imports only read the part number and quantity, so exported files can be re-imported
+EXPORT_COLUMNS = ['Part Number', 'Quantity', 'Brand', 'Description']
+# Number of lines fetched per query while exporting
+EXPORT_CHUNK_SIZE = 2000
+# The largest quantity BomItems.quantity, a PositiveIntegerField, can hold in every database
+MAX_QUANTITY = 2147483647
+
+
+class BomImport:
+    """The outcome of importing a file into a BOM."""
+
+    def __init__(self):
+        self.inserted = self.updated = self.unchanged = self.deleted = 0
+        # (row number, part number) of lines whose part number isn't in the catalogue
+        self.unknown = []
+        # (row number, message) of lines that couldn't be read
+        self.errors = []
+
+
+def parse_quantity(value: str) -> int:
+    try:
+        quantity = Decimal(value.strip())
+        # Spreadsheets may save whole numbers as "2.0". Infinities and NaNs aren't finite, and sNaN can't be compared
+        if not quantity.is_finite() or quantity != quantity.to_integral_value() or not 1 <= quantity <= MAX_QUANTITY:
+            raise ValueError(f'Invalid quantity: {value}')
+    except InvalidOperation:
+        raise ValueError(f'Invalid quantity: {value}')
+    return int(quantity)
+
+
+def read_bom(file, result: BomImport) -> dict:
+    """Read the lines of a CSV file with Part Number and Quantity columns, in one pass.
+    Returns {cleaned part number: (first row number, total quantity)}, adding the quantities of repeated part numbers.
+    Lines that can't be read are added to the result's errors."""
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    if not reader.fieldnames or not {'Part Number', 'Quantity'}.issubset(reader.fieldnames):
+        raise ValueError('The file needs Part Number and Quantity columns')
+    lines = {}
+    # Rows are numbered as in a spreadsheet, where the header is row 1
+    for number, row in enumerate(reader, start=2):
+        part_number = lookups.clean_part_number(row['Part Number'] or '')
+        if not part_number:
+            result.errors.append((number, 'Missing part number'))
+            continue
+        try:
+            quantity = parse_quantity(row['Quantity'] or '')
+        except ValueError as e:
+            result.errors.append((number, str(e)))
+            continue
+        first_row, total = lines.get(part_number, (number, 0))
+        if total + quantity > MAX_QUANTITY:
+            result.errors.append((number, f'Total quantity of {part_number} is too large'))
+            continue
+        lines[part_number] = (first_row, total + quantity)
+    return lines
+
+
+@transaction.atomic
+def import_bom(bom, file, replace=False) -> BomImport:
+    """Set the quantities of a BOM's lines from a CSV file, adding lines for part numbers not yet in the BOM.
+    With `replace`, lines for part numbers missing from the file are removed.
+    Part numbers that aren't in the catalogue are skipped and reported."""
+    result = BomImport()
+    lines = read_bom(file, result)
+    entries = lookups.get_many(lines)
+    for part_number, (number, _) in lines.items():
+        if entries[part_number] is None:
+            result.unknown.append((number, part_number))
+    quantities = {part_number: quantity for part_number, (_, quantity) in lines.items()
+                  if entries[part_number] is not None}
+
+    now = timezone.now()
+    changed = []
+    removed = []
+    for item in BomItems.objects.filter(bom=bom):
+        quantity = quantities.pop(item.part_number_id, None)
+        if quantity is None:
+            if replace:
+                removed.append(item.id)
+        elif quantity != item.quantity:
+            item.quantity = quantity
+            item.last_modified = now
+            changed.append(item)
+        else:
+            result.unchanged += 1
+    BomItems.objects.filter(id__in=removed).delete()
+    BomItems.objects.bulk_update(changed, ['quantity', 'last_modified'])
+    BomItems.objects.bulk_create(BomItems(bom=bom, part_number=entries[part_number], quantity=quantity)
+                                 for part_number, quantity in quantities.items())
+    result.deleted = len(removed)
+    result.updated = len(changed)
+    result.inserted = len(quantities)
+    result.unknown.sort()
+    return result
+
+
+def export_rows(bom):
+    """The CSV rows of a BOM, header first, fetched a chunk at a time."""
+    yield EXPORT_COLUMNS
+    items = (BomItems.objects.filter(bom=bom).order_by('part_number')
+             .values_list('part_number', 'quantity', 'part_number__brand__name', 'part_number__description'))
+    yield from items.iterator(chunk_size=EXPORT_CHUNK_SIZE)
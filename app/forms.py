@@ -1,38 +1,34 @@
-import re
-
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import NON_FIELD_ERRORS
 from django.core.validators import MinValueValidator, ValidationError
+from django.db import transaction
+from django.db.models.fields import BLANK_CHOICE_DASH
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.html import format_html
 
+from app import lookups
 from app.models import Stock, Catalogue, BomItems, Location, Bom, BomChecklist
 
 
 class Util:
-    @staticmethod
-    def clean_part_number(part_number: str):
-        part_number = part_number.strip()
-        # Account for Siemens barcodes
-        if part_number.startswith('1p'):
-            part_number = part_number[2:]
-        # Replace whitespace and slashes with underscores
-        part_number = re.sub(r'\s|/', '_', part_number)
-        return part_number
-
     @staticmethod
     def validate_part_number(part_number: str):
-        part_number = Util.clean_part_number(part_number)
-        try:
-            entry = Catalogue.objects.get(part_number=part_number)
-        except Catalogue.DoesNotExist:
+        entry = lookups.get(lookups.clean_part_number(part_number))
+        if entry is None:
             raise forms.ValidationError('Part number not found in catalogue')
         return entry
 
 
+class BomAvailabilityForm(forms.Form):
+    builds = forms.IntegerField(label='Number of builds', initial=1, min_value=1, max_value=10 ** 6)
+
+
 class BomChecklistForm(forms.Form):
+    # Also reported when the last item is scanned at another station after the form was validated
+    ALL_SCANNED = 'All required items of this P/N have already been scanned'
     part_number = forms.CharField()
     bom_id = forms.HiddenInput()
 
@@ -43,12 +39,13 @@ class BomChecklistForm(forms.Form):
         super(BomChecklistForm, self).__init__(*args, **kwargs)
 
     def clean_part_number(self):
-        part_number = Util.clean_part_number(self.cleaned_data['part_number'])
-        if not BomChecklist.objects.filter(bom_id=self.bom_id, part_number=part_number).exists():
+        part_number = lookups.clean_part_number(self.cleaned_data['part_number'])
+        quantity_remaining = (BomChecklist.objects.filter(bom_id=self.bom_id, part_number=part_number)
+                              .values_list('quantity_remaining', flat=True).first())
+        if quantity_remaining is None:
             raise forms.ValidationError('Part number not found in BOM')
-        quantity_remaining = BomChecklist.objects.get(bom_id=self.bom_id, part_number=part_number).quantity_remaining
         if quantity_remaining <= 0:
-            raise forms.ValidationError('All required items of this P/N have already been scanned')
+            raise forms.ValidationError(self.ALL_SCANNED)
         return part_number
 
 
@@ -58,6 +55,11 @@ class BomForm(forms.ModelForm):
         fields = ['bom_id', 'name']
 
 
+class BomImportForm(forms.Form):
+    file = forms.FileField(label='CSV file', help_text='With Part Number and Quantity columns')
+    replace = forms.BooleanField(label='Remove lines missing from the file', required=False)
+
+
 class BomItemsForm(forms.ModelForm):
     part_number = forms.CharField(label='Part Number')
 
@@ -69,6 +71,14 @@ class BomItemsForm(forms.ModelForm):
         pn = Util.validate_part_number(self.cleaned_data['part_number'])
         return pn
 
+    def validate_unique(self):
+        # BomItemsFormset checks for repeated part numbers across the whole BOM at once
+        pass
+
+    def _get_validation_exclusions(self):
+        # The part number was fetched while cleaning the form, so the model needn't check it exists again
+        return super()._get_validation_exclusions() | {'part_number'}
+
     def save(self, commit=True):
         instance = super(BomItemsForm, self).save(commit=False)
         instance.bom_id = self.bom_id
@@ -86,7 +96,46 @@ class BomItemsForm(forms.ModelForm):
         }
 
 
+class FormsetObjectField(forms.ModelChoiceField):
+    """The id field of a model formset's forms.
+    Finds the object among those the formset has already fetched, rather than querying for each form."""
+
+    def __init__(self, formset, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.formset = formset
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            # noinspection PyProtectedMember,PyUnresolvedReferences
+            obj = self.formset._existing_object(self.formset._pk_field.to_python(value))
+        except ValidationError:
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice',
+                                  params={'value': value})
+        return obj
+
+
 class BomItemsFormset(forms.BaseInlineFormSet):
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        # noinspection PyUnresolvedReferences
+        name = self._pk_field.name
+        field = form.fields[name]
+        form.fields[name] = FormsetObjectField(self, field.queryset, required=False, initial=field.initial,
+                                               widget=field.widget)
+
+    def full_clean(self):
+        # Look up the part numbers of every form with one query, rather than one query per form
+        with lookups.memoise():
+            if self.is_bound:
+                part_numbers = (self.data.get(form.add_prefix('part_number')) for form in self.forms)
+                lookups.get_many({lookups.clean_part_number(part_number)
+                                  for part_number in part_numbers if part_number})
+            super().full_clean()
+
     def clean(self):
         super(BomItemsFormset, self).clean()
         if any(self.errors):
@@ -105,11 +154,37 @@ class BomItemsFormset(forms.BaseInlineFormSet):
                 raise ValidationError(f"Part Number already exists in BOM: {part_number}")
             part_numbers.add(part_number)
 
+    @transaction.atomic
+    def save(self, commit=True):
+        """Save the lines that changed, with one bulk query each for the deletes, updates and inserts."""
+        if not commit:
+            return super().save(commit=False)
+        self.new_objects, self.changed_objects, self.deleted_objects = [], [], []
+        now = timezone.now()
+        for form in self.forms:
+            # noinspection PyUnresolvedReferences
+            deleted = self.can_delete and self._should_delete_form(form)
+            if form.instance.pk is not None and deleted:
+                self.deleted_objects.append(form.instance)
+            elif deleted or not form.has_changed():
+                continue
+            elif form.instance.pk is not None:
+                instance = form.save(commit=False)
+                instance.last_modified = now
+                self.changed_objects.append((instance, form.changed_data))
+            else:
+                self.new_objects.append(form.save(commit=False))
+        BomItems.objects.filter(pk__in=[obj.pk for obj in self.deleted_objects]).delete()
+        BomItems.objects.bulk_update([obj for obj, _ in self.changed_objects],
+                                     ['part_number', 'quantity', 'last_modified'])
+        BomItems.objects.bulk_create(self.new_objects)
+        return self.new_objects + [obj for obj, _ in self.changed_objects]
+
 
 class CatalogueEditForm(forms.ModelForm):
     class Meta:
         model = Catalogue
-        exclude = ['part_number', 'modified_by', 'image']
+        exclude = ['part_number', 'modified_by']
 
 
 class CatalogueForm(forms.ModelForm):
@@ -120,11 +195,15 @@ class CatalogueForm(forms.ModelForm):
     )
 
     def clean_part_number(self):
-        return Util.clean_part_number(self.cleaned_data['part_number'])
+        return lookups.clean_part_number(self.cleaned_data['part_number'])
 
     class Meta:
         model = Catalogue
-        exclude = ['modified_by', 'image']
+        exclude = ['modified_by']
+
+
+class CatalogueSearchForm(forms.Form):
+    q = forms.CharField(label='Search', max_length=255, required=False)
 
 
 class CheckoutForm(forms.Form):
@@ -144,8 +223,26 @@ class LoginForm(forms.ModelForm):
 
 
 class StockFilterForm(forms.Form):
-    part_number = forms.ModelChoiceField(queryset=Catalogue.objects.filter(stock__isnull=False), required=False)
-    location = forms.ModelChoiceField(queryset=Location.objects.filter(stock__isnull=False), required=False)
+    part_number = forms.ChoiceField(
+        choices=lambda: BLANK_CHOICE_DASH + lookups.stock_filter_choices()['part_number'], required=False)
+    location = forms.TypedChoiceField(
+        choices=lambda: BLANK_CHOICE_DASH + lookups.stock_filter_choices()['location'], coerce=int, empty_value=None,
+        required=False)
+
+
+class StockBalanceForm(forms.Form):
+    at = forms.DateTimeField(label='Stock on hand at', widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}))
+    location = forms.ModelChoiceField(Location.objects.order_by('location_name'), required=False)
+    part_number = forms.CharField(required=False)
+
+    def clean_part_number(self):
+        return lookups.clean_part_number(self.cleaned_data['part_number'])
+
+
+class TransferForm(forms.Form):
+    location = forms.ModelChoiceField(Location.objects.all())
+    # All of the entry is moved if no quantity is given
+    quantity = forms.IntegerField(required=False, validators=[MinValueValidator(1)])
 
 
 class StockForm(forms.ModelForm):
@@ -154,23 +251,54 @@ class StockForm(forms.ModelForm):
 
     def clean_part_number(self):
         part_number = self.cleaned_data.get('part_number')
-        if not Catalogue.objects.filter(part_number=part_number).exists():
-            url = reverse('catalogue_new') + f"?part_number={part_number}"
+        try:
+            return Util.validate_part_number(part_number)
+        except ValidationError:
+            url = reverse('catalogue_new') + f"?part_number={lookups.clean_part_number(part_number)}"
             raise ValidationError(
                 format_html(
                     'Part number does not exist. <a href="{}" style="text-decoration: underline">Create</a>',
                     url)
             )
-        return Util.validate_part_number(part_number)
 
     # def clean_part_number(self):
     #     return Util.validate_part_number(self.cleaned_data['part_number'])
 
+    def validate_unique(self):
+        # Scanning a part into a location it is already stocked in adds to the existing entry
+        pass
+
+    def _get_validation_exclusions(self):
+        # Both were fetched from the database while cleaning the form, so the model needn't check they exist again
+        return super()._get_validation_exclusions() | {'part_number', 'location'}
+
     class Meta:
         model = Stock
         exclude = ['modified_by']
 
 
+class StockScanForm(StockForm):
+    """StockForm for the scan API, which reports errors as plain text rather than HTML."""
+
+    def clean_part_number(self):
+        return Util.validate_part_number(self.cleaned_data['part_number'])
+
+
+class StockScanLineForm(forms.Form):
+    """One line of a batch of scans. Part numbers and locations are looked up for the whole batch at once."""
+    part_number = forms.CharField(max_length=255)
+    location = forms.IntegerField()
+    # Each barcode scanned is one item unless a quantity is given
+    quantity = forms.IntegerField(required=False, validators=[MinValueValidator(1)])
+
+    def clean_part_number(self):
+        return lookups.clean_part_number(self.cleaned_data['part_number'])
+
+    def clean_quantity(self):
+        quantity = self.cleaned_data['quantity']
+        return 1 if quantity is None else quantity
+
+
 class UserCreateForm(UserCreationForm):
     first_name = forms.CharField(max_length=10)
 
@@ -0,0 +1,83 @@
+"""Catalogue images.
+
+Each image is stored once, named after the SHA-256 hash of its contents, however many parts it is uploaded for. A
+thumbnail of a fixed size is made when it is first stored, named after the same hash. As a name always refers to the
+same contents, images and thumbnails are served with immutable cache headers, and pages only load the thumbnails.
+"""
+import hashlib
+import io
+import os
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import models
+from PIL import Image, ImageOps
+
+IMAGE_DIR = 'images/parts'
+THUMBNAIL_DIR = 'images/thumbnails'
+THUMBNAIL_SIZE = (160, 160)
+# Matches the names of stored images and thumbnails, whose contents never change
+CONTENT_ADDRESSED = re.compile(rf'^({IMAGE_DIR}|{THUMBNAIL_DIR})/[0-9a-f]{{64}}[-.]')
+
+
+def content_name(file) -> str:
+    """The name an image is stored under: the hash of its contents, with its original extension."""
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        digest.update(chunk)
+    file.seek(0)
+    extension = os.path.splitext(getattr(file, 'name', None) or '')[1].lower()
+    return f'{IMAGE_DIR}/{digest.hexdigest()}{extension}'
+
+
+def thumbnail_name(name) -> str:
+    """The name of a stored image's thumbnail. The size is part of it, so changing the size makes new thumbnails."""
+    digest = os.path.splitext(os.path.basename(name))[0]
+    width, height = THUMBNAIL_SIZE
+    return f'{THUMBNAIL_DIR}/{digest}-{width}x{height}.jpg'
+
+
+def store(file) -> str:
+    """Store an image, unless the same image is stored already, and make its thumbnail. Returns its name."""
+    name = content_name(file)
+    if not default_storage.exists(name):
+        saved = default_storage.save(name, file)
+        if saved != name:
+            # The same image was stored by another upload since checking, and this copy was given another name
+            default_storage.delete(saved)
+    make_thumbnail(name)
+    return name
+
+
+def make_thumbnail(name):
+    """Make the thumbnail of a stored image, if it doesn't have one: the image scaled to fit THUMBNAIL_SIZE and padded
+    with white."""
+    thumbnail = thumbnail_name(name)
+    if default_storage.exists(thumbnail):
+        return thumbnail
+    with default_storage.open(name) as file, Image.open(file) as image:
+        # Photos from phones are often stored sideways, with the rotation in their EXIF data
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+        image = ImageOps.pad(image.convert('RGB'), THUMBNAIL_SIZE, color='white')
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=85, optimize=True)
+    saved = default_storage.save(thumbnail, ContentFile(output.getvalue()))
+    if saved != thumbnail:
+        default_storage.delete(saved)
+    return thumbnail
+
+
+class ContentAddressedImageField(models.ImageField):
+    """An image field that stores uploads with store(), so identical images share one file and one thumbnail."""
+
+    def pre_save(self, model_instance, add):
+        file = getattr(model_instance, self.attname)
+        if file and not file._committed:
+            setattr(model_instance, self.attname, store(file.file))
+        return super().pre_save(model_instance, add)
@@ -0,0 +1,282 @@
+"""Live updates pushed to open pages as Server-Sent Events.
+
+Changes are sent to groups of subscribers: `bom_group(bom_id)` for a BOM's checklist, and STOCK_GROUP for the stock of
+every part. Each page that is open subscribes to the groups it shows, so that a scan costs one small message to each
+page rather than each page reloading.
+
+The LIVE_LAYER setting chooses how messages reach subscribers. `memory`, the default, holds subscribers in memory, so
+they only receive changes made by the same server process: serve live updates from a single ASGI process with it.
+`postgres` also sends each message through PostgreSQL's NOTIFY, which every server process listens for, so any number
+of processes can serve live updates. Each process holds an advisory lock for each group it has subscribers for, so that
+a change nobody is watching isn't read or sent.
+"""
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+from contextlib import asynccontextmanager
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.models import Sum
+
+from app.models import Stock
+
+STOCK_GROUP = 'stock'
+# Messages waiting to be sent to a page before it is told to reload instead
+SUBSCRIPTION_SIZE = 100
+# Seconds between comments sent to idle pages, so that proxies keep the connection open
+HEARTBEAT_INTERVAL = 15
+# Seconds to wait before listening again after losing the connection, and for a process to start listening
+LISTEN_RETRY_INTERVAL = 5
+# Parts in each stock message, which keeps it well under PostgreSQL's limit of 8000 bytes for a NOTIFY
+STOCK_MESSAGE_PARTS = 50
+
+
+def bom_group(bom_id) -> str:
+    return f'bom.{bom_id}'
+
+
+class Subscription:
+    """The messages sent to one page, read from the event loop serving it."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(SUBSCRIPTION_SIZE)
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A page that can't keep up reloads, rather than showing a checklist with changes missing
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'reload'})
+
+    async def get(self, timeout=None):
+        """The next message, or None if there isn't one within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InMemoryLayer:
+    """Groups of subscriptions in this process. Messages can be sent from any thread."""
+
+    def __init__(self):
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    @asynccontextmanager
+    async def subscribe(self, *groups):
+        subscription = Subscription(asyncio.get_running_loop())
+        with self.lock:
+            for group in groups:
+                self.groups.setdefault(group, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self.lock:
+                for group in groups:
+                    self.groups[group].discard(subscription)
+                    if not self.groups[group]:
+                        del self.groups[group]
+
+    def has_subscribers(self, group) -> bool:
+        return group in self.groups
+
+    def send(self, group, message):
+        with self.lock:
+            subscriptions = list(self.groups.get(group, ()))
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+
+    def send_to_all(self, message):
+        with self.lock:
+            subscriptions = set().union(*self.groups.values())
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+
+
+class PostgresLayer(InMemoryLayer):
+    """Groups of subscriptions in every server process, sharing messages through PostgreSQL's LISTEN and NOTIFY.
+
+    Messages are sent with NOTIFY on the sending thread's database connection. Each process listens on a connection of
+    its own, from a thread started by its first subscription, and delivers the messages to its own subscriptions.
+
+    The listening connection also holds a shared advisory lock for each group with subscribers in this process, keyed
+    by PRESENCE_LOCK and the hash of the group's name, which has_subscribers() looks for in pg_locks. The locks are
+    released when the connection closes, so a process that stops doesn't leave its groups watched."""
+    CHANNEL = 'inventory_live'
+    PRESENCE_LOCK = 0x4c495645
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+        self.listening = threading.Event()
+        self.stopping = threading.Event()
+        # The groups whose presence locks the listener holds
+        self.held = set()
+        self.presence_changed = threading.Condition(self.lock)
+        # Written to by wake(), to wake the listener
+        self.wake_reader, self.wake_writer = os.pipe()
+        os.set_blocking(self.wake_writer, False)
+
+    @asynccontextmanager
+    async def subscribe(self, *groups):
+        # Wait until this process is listening, so that the subscription doesn't miss messages sent once it exists
+        await sync_to_async(self.listen, thread_sensitive=False)()
+        try:
+            async with super().subscribe(*groups) as subscription:
+                # And until other processes can see it, so that they don't skip sending it changes
+                await sync_to_async(self.announce, thread_sensitive=False)(groups)
+                yield subscription
+        finally:
+            self.wake()
+
+    def has_subscribers(self, group) -> bool:
+        if super().has_subscribers(group):
+            return True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND classid = %s "
+                           "AND objid = hashtext(%s)::oid AND objsubid = 2)", [self.PRESENCE_LOCK, group])
+            return cursor.fetchone()[0]
+
+    def send(self, group, message):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.CHANNEL, json.dumps({'group': group, 'message': message})])
+
+    def listen(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.run, name='live-listener', daemon=True)
+                self.listener.start()
+        if not self.listening.wait(LISTEN_RETRY_INTERVAL):
+            raise ConnectionError('Could not listen for live updates')
+
+    def announce(self, groups):
+        """Wait until the listener holds the presence locks of `groups`."""
+        self.wake()
+        with self.presence_changed:
+            if not self.presence_changed.wait_for(lambda: self.held.issuperset(groups), LISTEN_RETRY_INTERVAL):
+                raise ConnectionError('Could not announce subscribers of live updates')
+
+    def wake(self):
+        """Have the listener stop, if closing, or update its presence locks to the groups subscribed to."""
+        try:
+            os.write(self.wake_writer, b'\0')
+        except BlockingIOError:
+            # The listener already has wake-ups waiting
+            pass
+
+    def close(self):
+        """Stop listening, and close the listener's connection. The layer can't subscribe again afterwards."""
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            self.stopping.set()
+            self.wake()
+            listener.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.receive()
+            except Exception:
+                self.listening.clear()
+                # Messages may have been missed while not listening, so every page reloads
+                self.send_to_all({'type': 'reload'})
+                self.stopping.wait(LISTEN_RETRY_INTERVAL)
+
+    def receive(self):
+        # A connection of its own, which Django doesn't close at the end of each request
+        listener = connection.get_new_connection(connection.get_connection_params())
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.CHANNEL}')
+            self.hold_presence_locks(listener)
+            self.listening.set()
+            while True:
+                ready = select.select([listener, self.wake_reader], [], [], HEARTBEAT_INTERVAL)[0]
+                if self.wake_reader in ready:
+                    os.read(self.wake_reader, 4096)
+                    if self.stopping.is_set():
+                        return
+                    self.hold_presence_locks(listener)
+                if not ready:
+                    # Nothing has been sent for a while, so check the connection is still open
+                    with listener.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                listener.poll()
+                while listener.notifies:
+                    notification = json.loads(listener.notifies.pop(0).payload)
+                    super().send(notification['group'], notification['message'])
+        finally:
+            self.listening.clear()
+            with self.presence_changed:
+                self.held = set()
+            listener.close()
+
+    def hold_presence_locks(self, listener):
+        """Lock the groups newly subscribed to in this process, and unlock those with no subscribers left."""
+        with self.lock:
+            subscribed = set(self.groups)
+        with listener.cursor() as cursor:
+            for function, groups in (('pg_advisory_lock_shared', subscribed - self.held),
+                                     ('pg_advisory_unlock_shared', self.held - subscribed)):
+                if groups:
+                    cursor.execute(f'SELECT {function}(%s, hashtext(g)) FROM unnest(%s::text[]) AS g',
+                                   [self.PRESENCE_LOCK, sorted(groups)])
+        with self.presence_changed:
+            self.held = subscribed
+            self.presence_changed.notify_all()
+
+
+LAYERS = {'memory': InMemoryLayer, 'postgres': PostgresLayer}
+_layer_name = getattr(settings, 'LIVE_LAYER', 'memory')
+if _layer_name not in LAYERS:
+    raise ImproperlyConfigured(f'LIVE_LAYER must be one of {", ".join(LAYERS)}, not {_layer_name}')
+layer = LAYERS[_layer_name]()
+
+
+def checklist_changed(bom_id, part_number, quantity_remaining):
+    layer.send(bom_group(bom_id), {'type': 'checklist', 'part_number': part_number,
+                                   'quantity_remaining': quantity_remaining})
+
+
+def checklist_replaced(bom_id):
+    layer.send(bom_group(bom_id), {'type': 'reload'})
+
+
+def stock_changed(part_numbers):
+    """Send the stock of each part across every location, in one query and one message, if any page is watching."""
+    if not layer.has_subscribers(STOCK_GROUP):
+        return
+    totals = dict.fromkeys(part_numbers, 0)
+    totals.update(Stock.objects.filter(part_number__in=totals).values('part_number').annotate(total=Sum('quantity'))
+                  .order_by().values_list('part_number', 'total'))
+    totals = iter(totals.items())
+    while chunk := dict(islice(totals, STOCK_MESSAGE_PARTS)):
+        layer.send(STOCK_GROUP, {'type': 'stock', 'quantities_in_stock': chunk})
+
+
+def event(message) -> str:
+    """A message in the Server-Sent Events format, with its type as the event name."""
+    return f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+async def stream(*groups):
+    """The events sent to `groups`, as a Server-Sent Events stream that lasts until the page is closed."""
+    async with layer.subscribe(*groups) as subscription:
+        # Sent once subscribed, so the page knows no later change will be missed
+        yield event({'type': 'subscribed'})
+        while True:
+            message = await subscription.get(HEARTBEAT_INTERVAL)
+            yield ': heartbeat\n\n' if message is None else event(message)
@@ -0,0 +1,123 @@
+"""Catalogue lookups by cleaned part number.
+
+Lookups are memoised for the length of a request by CatalogueLookupMiddleware, so that validating a form or formset
+looks each part number up once. If CATALOGUE_CACHE_TIMEOUT is set, entries found are also kept in the default cache
+between requests. Only enable that with a cache shared by every server process, such as Redis or Memcached: entries
+are removed from the cache when they are saved or deleted, and other processes would keep serving their own copies.
+
+The part numbers and locations that have stock, offered as choices by the stock filter, are also cached here. Forms,
+services and imports all use this module, so it doesn't depend on any of them.
+"""
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from app.models import Catalogue, Stock, Location
+
+# Part number -> Catalogue entry, or None if there isn't one. None outside of memoise()
+_memo = ContextVar('catalogue_lookups', default=None)
+# Cache key for the part number and location choices of StockFilterForm
+STOCK_FILTER_CHOICES_KEY = 'stock_filter_choices'
+# Caches aren't shared between server processes unless configured to be, so bound how stale the choices can get
+STOCK_FILTER_CHOICES_TIMEOUT = 60
+
+
+def clean_part_number(part_number: str):
+    part_number = part_number.strip()
+    # Account for Siemens barcodes
+    if part_number.startswith('1p'):
+        part_number = part_number[2:]
+    # Replace whitespace and slashes with underscores
+    part_number = re.sub(r'\s|/', '_', part_number)
+    return part_number
+
+
+@contextmanager
+def memoise():
+    """Memoise lookups made inside the block. Nested blocks share the outermost memo."""
+    if _memo.get() is not None:
+        yield
+        return
+    token = _memo.set({})
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+def cache_key(part_number: str) -> str:
+    return f'catalogue:{part_number}'
+
+
+def cache_timeout():
+    return getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', None)
+
+
+def get(part_number: str):
+    """The catalogue entry for a cleaned part number, or None if there isn't one."""
+    return get_many([part_number])[part_number]
+
+
+def get_many(part_numbers) -> dict:
+    """Look up cleaned part numbers with at most one query.
+    Returns {part number: catalogue entry, or None if there isn't one}."""
+    memo = _memo.get()
+    found = {}
+    missing = set()
+    for part_number in part_numbers:
+        if memo is not None and part_number in memo:
+            found[part_number] = memo[part_number]
+        else:
+            missing.add(part_number)
+    timeout = cache_timeout()
+    if missing and timeout:
+        cached = cache.get_many([cache_key(part_number) for part_number in missing])
+        for entry in cached.values():
+            found[entry.part_number] = entry
+            missing.discard(entry.part_number)
+    if missing:
+        entries = {entry.part_number: entry for entry in Catalogue.objects.filter(part_number__in=missing)}
+        if entries and timeout:
+            cache.set_many({cache_key(part_number): entry for part_number, entry in entries.items()}, timeout)
+        for part_number in missing:
+            found[part_number] = entries.get(part_number)
+    if memo is not None:
+        memo.update(found)
+    return found
+
+
+def forget(*part_numbers):
+    """Drop entries that have been changed, so the next lookup reads them from the database."""
+    memo = _memo.get()
+    if memo is not None:
+        for part_number in part_numbers:
+            memo.pop(part_number, None)
+    if cache_timeout():
+        cache.delete_many([cache_key(part_number) for part_number in part_numbers])
+
+
+def stock_filter_choices():
+    """The part numbers and locations that have stock, as choices for StockFilterForm.
+    Cached until stock entries or locations are added or removed."""
+    choices = cache.get(STOCK_FILTER_CHOICES_KEY)
+    if choices is None:
+        part_numbers = Stock.objects.order_by('part_number').values_list('part_number', flat=True).distinct()
+        locations = (Location.objects.filter(stock__isnull=False).order_by('location_name')
+                     .values_list('id', 'location_name').distinct())
+        choices = {
+            'part_number': [(part_number, part_number) for part_number in part_numbers],
+            'location': list(locations),
+        }
+        cache.set(STOCK_FILTER_CHOICES_KEY, choices, STOCK_FILTER_CHOICES_TIMEOUT)
+    return choices
+
+
+def clear_stock_filter_choices():
+    """Clear the choices now, for the rest of this transaction, and again once it commits, as another request may cache
+    the choices from before the change in the meantime."""
+    cache.delete(STOCK_FILTER_CHOICES_KEY)
+    transaction.on_commit(lambda: cache.delete(STOCK_FILTER_CHOICES_KEY))
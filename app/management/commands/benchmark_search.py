@@ -0,0 +1,77 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from app.models import Brand, Catalogue
+from app.search import search_catalogue
+
+WORDS = ['sensor', 'photoelectric', 'proximity', 'inductive', 'relay', 'contactor', 'terminal', 'cable', 'valve',
+         'cylinder', 'pneumatic', 'fuse', 'breaker', 'motor', 'drive', 'encoder', 'switch', 'connector', 'gripper',
+         'bracket', 'bearing', 'pump', 'filter', 'regulator', 'controller', 'module', 'display', 'housing']
+BRANDS = ['Sick', 'Siemens', 'Festo', 'Omron', 'Phoenix Contact', 'Schneider', 'Balluff', 'Pilz', 'SMC', 'Keyence',
+          'Murrelektronik', 'Rittal', 'Weidmuller', 'Banner', 'IFM']
+CATEGORIES = ['Photoelectric sensors', 'Inductive sensors', 'Relays', 'Pneumatics', 'Drives', 'Cabling', 'Safety',
+              'Enclosures', 'Controllers']
+
+
+class Command(BaseCommand):
+    help = ('Time catalogue searches against a generated catalogue. '
+            'The generated rows are rolled back afterwards, so this is safe to run against a live database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100_000, help='Number of catalogue entries to generate')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times to run each query')
+        parser.add_argument('--page-size', type=int, default=50, help='Number of results fetched per query')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            self.stdout.write(f"Generating {options['rows']} catalogue entries on {connection.vendor}")
+            self.generate(rng, options['rows'])
+            queries = {
+                'part number prefix': 'WTB4',
+                'exact part number': 'WTB4SC-000500',
+                'fuzzy part number': 'WTB4CS-000500',
+                'description words': 'inductive sensor',
+                'partial word': 'photoelec',
+                'brand': 'Siemens',
+                'misspelt brand': 'Seimens',
+            }
+            self.stdout.write(f"{'query':<22}{'median ms':>12}{'p95 ms':>12}{'results':>10}")
+            for name, query in queries.items():
+                timings, results = self.time_query(query, options['repeat'], options['page_size'])
+                p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                self.stdout.write(f'{name:<22}{statistics.median(timings):>12.2f}{p95:>12.2f}{results:>10}')
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def generate(rng, rows):
+        brands = Brand.objects.bulk_create(Brand(name=name) for name in BRANDS)
+        prefixes = ['WTB4SC', 'GTE6P', 'IME12', 'NBN8', '3RT20', '6ES72', 'DSNU', 'MS6LR', 'E3Z', 'PSR']
+        Catalogue.objects.bulk_create(
+            (Catalogue(
+                part_number=f'{prefixes[i % len(prefixes)]}-{i:06}',
+                brand=rng.choice(brands),
+                category=rng.choice(CATEGORIES),
+                description=' '.join(rng.sample(WORDS, 3)),
+                vendor_description=' '.join(rng.choices(WORDS, k=12)),
+            ) for i in range(rows)),
+            batch_size=5000,
+        )
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE app_catalogue')
+                cursor.execute('ANALYZE app_brand')
+
+    @staticmethod
+    def time_query(query, repeat, page_size):
+        timings = []
+        results = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            results = len(search_catalogue(query)[:page_size])
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings, results
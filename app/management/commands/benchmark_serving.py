@@ -0,0 +1,93 @@
+import statistics
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from threading import local
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = ['/stock', '/catalogue', '/static/css/style.css', '/static/js/scan_queue.js']
+# Seconds to wait for the server to start accepting requests
+STARTUP_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = ('Load a running server with concurrent requests from logged in users, and report the throughput and '
+            'latency of each path. Run it against runserver and against production mode to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='The server to load')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--path', action='append', dest='paths',
+                            help=f'A path to request, which can be repeated. By default {DEFAULT_PATHS}')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests made to each path')
+        parser.add_argument('--concurrency', type=int, default=16, help='Number of requests in flight at once')
+
+    def handle(self, *args, **options):
+        self.url = options['url'].rstrip('/')
+        self.username = options['username']
+        self.password = options['password']
+        self.clients = local()
+        self.wait_for_server()
+        self.stdout.write(f"{options['requests']} requests to each path, {options['concurrency']} at a time")
+        self.stdout.write(f"{'path':<28}{'req/s':>10}{'median ms':>12}{'p95 ms':>10}{'KB':>8}{'errors':>8}  encoding")
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            for path in options['paths'] or DEFAULT_PATHS:
+                start = time.perf_counter()
+                results = list(executor.map(self.get, [path] * options['requests']))
+                elapsed = time.perf_counter() - start
+                timings = [timing for timing, _, _ in results]
+                errors = sum(1 for _, status, _ in results if status != 200)
+                size = statistics.mean(size for _, _, size in results) / 1024
+                p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                with self.opener().open(self.url + path) as response:
+                    encoding = response.headers.get('Content-Encoding', '-')
+                self.stdout.write(f'{path:<28}{len(results) / elapsed:>10.1f}{statistics.median(timings):>12.2f}'
+                                  f'{p95:>10.2f}{size:>8.1f}{errors:>8}  {encoding}')
+
+    def wait_for_server(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                urllib.request.urlopen(self.url + '/login/')
+                return
+            except urllib.error.HTTPError:
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise CommandError(f'{self.url} did not respond within {STARTUP_TIMEOUT} seconds')
+                time.sleep(0.5)
+
+    def opener(self):
+        """A client for this thread, logged in on its first use, which asks for compressed responses."""
+        opener = getattr(self.clients, 'opener', None)
+        if opener is None:
+            cookies = CookieJar()
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookies))
+            opener.addheaders = [('Accept-Encoding', 'br, gzip')]
+            opener.open(self.url + '/login/').read()
+            token = next(cookie.value for cookie in cookies if cookie.name == 'csrftoken')
+            data = urllib.parse.urlencode({'username': self.username, 'password': self.password,
+                                           'csrfmiddlewaretoken': token}).encode()
+            opener.open(self.url + '/login/', data).read()
+            if not any(cookie.name == 'sessionid' for cookie in cookies):
+                raise CommandError(f'Could not log in as {self.username}')
+            self.clients.opener = opener
+        return opener
+
+    def get(self, path):
+        """Returns the milliseconds taken, the status and the size of the response body."""
+        opener = self.opener()
+        start = time.perf_counter()
+        try:
+            with opener.open(self.url + path) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        return (time.perf_counter() - start) * 1000, status, len(body)
@@ -0,0 +1,156 @@
+import csv
+import hashlib
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app import lookups
+from app.models import Brand, Catalogue
+
+# CSV column -> Catalogue field
+COLUMNS = {
+    'Part Number': 'part_number',
+    'Category': 'category',
+    'Common description': 'description',
+    'Vendor Description': 'vendor_description',
+    'Purchasing Unit Price': 'purchase_unit_cost_eur',
+    'Sale Unit Price': 'sale_unit_cost_eur',
+    'Notes': 'notes',
+    'URL': 'url',
+    'Created': 'modified_by',
+}
+PRICE_FIELDS = ('purchase_unit_cost_eur', 'sale_unit_cost_eur')
+# Fields overwritten when a part number is already in the catalogue
+UPDATE_FIELDS = ['brand', 'category', 'description', 'vendor_description', 'purchase_unit_cost_eur',
+                 'sale_unit_cost_eur', 'notes', 'url', 'last_modified', 'modified_by']
+# Fields compared by --sync to decide whether an entry has changed
+SYNC_FIELDS = ['brand_id', 'category', 'description', 'vendor_description', 'purchase_unit_cost_eur',
+               'sale_unit_cost_eur', 'notes', 'url']
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_price(value: str):
+    """Prices such as "1,184.59". Anything else, like "Price on Request", is stored as no price."""
+    try:
+        price = Decimal(value.replace(',', '')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+    if price.is_nan() or abs(price) >= 10 ** 8:
+        raise RowError(f'Price out of range: {value}')
+    return price
+
+
+def content_hash(values) -> str:
+    """Hash the SYNC_FIELDS values of an entry.
+    Empty strings hash the same as no value, matching what the forms and importer store."""
+    normalised = []
+    for value in values:
+        if isinstance(value, Decimal):
+            value = value.quantize(Decimal('0.01'))
+        normalised.append('' if value is None else str(value))
+    return hashlib.sha1('\x1f'.join(normalised).encode()).hexdigest()
+
+
+def parse_row(row: dict) -> dict:
+    """Convert a CSV row into Catalogue field values.
+    The brand is returned by name under 'brand'."""
+    values = {'brand': (row.get('Brand') or '').strip()}
+    for column, field in COLUMNS.items():
+        value = (row.get(column) or '').strip()
+        if field in PRICE_FIELDS:
+            value = parse_price(value)
+        else:
+            max_length = Catalogue._meta.get_field(field).max_length
+            if len(value) > max_length:
+                raise RowError(f'{column} is longer than {max_length} characters')
+            value = value or None
+        values[field] = value
+    if not values['part_number']:
+        raise RowError('Missing part number')
+    if len(values['brand']) > Brand._meta.get_field('name').max_length:
+        raise RowError('Brand is longer than the maximum length')
+    return values
+
+
+class Command(BaseCommand):
+    help = ('Import a supplier price list into the catalogue. '
+            'New part numbers are added and existing ones are updated in place; nothing is deleted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', nargs='?', default='populate/catalogue.csv')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Number of rows written per query')
+        parser.add_argument('--sync', action='store_true',
+                            help='Only write entries whose contents differ from the catalogue, '
+                                 'and count catalogue entries missing from the file')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        self.sync = options['sync']
+        self.rows = self.inserted = self.updated = self.unchanged = self.failed = 0
+        # Part numbers from the file that were already in the catalogue
+        self.seen = set()
+        with open(options['csv_file'], newline='', encoding='utf-8-sig') as file, transaction.atomic():
+            catalogue_size = Catalogue.objects.count()
+            self.brands = {brand.name: brand for brand in Brand.objects.all()}
+            # Rows are numbered as in a spreadsheet, where the header is row 1
+            rows = enumerate(csv.DictReader(file), start=2)
+            while chunk := list(islice(rows, options['chunk_size'])):
+                self.import_chunk(chunk)
+        seconds = time.perf_counter() - start
+        summary = (f'Imported {self.rows} rows in {seconds:.2f}s ({self.rows / seconds:.0f} rows/s): '
+                   f'{self.inserted} inserted, {self.updated} updated, ')
+        if self.sync:
+            orphaned = catalogue_size - len(self.seen)
+            summary += f'{self.unchanged} unchanged, {orphaned} orphaned, '
+        self.stdout.write(summary + f'{self.failed} failed')
+
+    def import_chunk(self, chunk):
+        entries = {}
+        for number, row in chunk:
+            self.rows += 1
+            try:
+                values = parse_row(row)
+            except RowError as e:
+                self.failed += 1
+                self.stderr.write(f'Row {number}: {e}')
+                continue
+            # A part number can only be upserted once per statement, so the last row for it wins
+            entries[values['part_number']] = values
+        if not entries:
+            return
+        self.create_brands({values['brand'] for values in entries.values()})
+        for values in entries.values():
+            values['brand_id'] = self.brands[values.pop('brand')].brand_id
+        if self.sync:
+            stored = list(Catalogue.objects.filter(part_number__in=entries).values_list('part_number', *SYNC_FIELDS))
+            existing = {part_number for part_number, *_ in stored}
+            for part_number, *stored_values in stored:
+                incoming_values = [entries[part_number][field] for field in SYNC_FIELDS]
+                if content_hash(stored_values) == content_hash(incoming_values):
+                    del entries[part_number]
+                    self.unchanged += 1
+        else:
+            existing = set(Catalogue.objects.filter(part_number__in=entries).values_list('part_number', flat=True))
+        self.seen.update(existing)
+        Catalogue.objects.bulk_create(
+            [Catalogue(**values) for values in entries.values()],
+            update_conflicts=True,
+            unique_fields=['part_number'],
+            update_fields=UPDATE_FIELDS,
+        )
+        # Bulk writes don't send the signals that drop cached lookups
+        lookups.forget(*entries)
+        updated = len(existing.intersection(entries))
+        self.updated += updated
+        self.inserted += len(entries) - updated
+
+    def create_brands(self, names):
+        missing = [Brand(name=name) for name in names if name not in self.brands]
+        for brand in Brand.objects.bulk_create(missing):
+            self.brands[brand.name] = brand
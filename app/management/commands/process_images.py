@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from app import images
+from app.models import Catalogue
+
+
+class Command(BaseCommand):
+    help = ('Store catalogue images uploaded before images were named by their contents under their hash, and make '
+            'any missing thumbnails. Images shared by several parts are processed once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of images processed at once')
+
+    def handle(self, *args, **options):
+        names = set(Catalogue.objects.exclude(image='').exclude(image=None).values_list('image', flat=True))
+        # Pillow releases the GIL while decoding and resizing, so threads make thumbnails in parallel
+        with ThreadPoolExecutor(options['workers']) as executor:
+            stored = dict(zip(names, executor.map(self.process, names)))
+        renamed = 0
+        for old, new in stored.items():
+            if new is not None and new != old:
+                renamed += Catalogue.objects.filter(image=old).update(image=new)
+        missing = sorted(name for name, new in stored.items() if new is None)
+        for name in missing:
+            self.stderr.write(f'Missing image file: {name}')
+        self.stdout.write(f'Processed {len(names) - len(missing)} images, and renamed the images of {renamed} entries')
+
+    @staticmethod
+    def process(name):
+        """Returns the image's content-addressed name, or None if its file is missing."""
+        if not default_storage.exists(name):
+            return None
+        if images.CONTENT_ADDRESSED.match(name):
+            images.make_thumbnail(name)
+            return name
+        with default_storage.open(name) as file:
+            return images.store(file)
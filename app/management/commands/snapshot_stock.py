@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app import services
+
+
+class Command(BaseCommand):
+    help = ('Store the current stock balances, so that past balances can be found without reading the whole ledger. '
+            'Run this periodically, for example nightly from cron.')
+
+    def handle(self, *args, **options):
+        snapshot = services.take_snapshot()
+        self.stdout.write(f'Stored {snapshot.lines.count()} balances as of {snapshot.taken}')
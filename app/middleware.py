@@ -0,0 +1,12 @@
+from app import lookups
+
+
+class CatalogueLookupMiddleware:
+    """Memoise catalogue lookups for the length of each request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with lookups.memoise():
+            return self.get_response(request)
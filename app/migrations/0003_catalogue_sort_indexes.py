@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_remove_stock_project_remove_checkedoutstock_project_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogue',
+            index=models.Index(fields=['brand', 'part_number'], name='catalogue_brand_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogue',
+            index=models.Index(fields=['category', 'part_number'], name='catalogue_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogue',
+            index=models.Index(fields=['last_modified', 'part_number'], name='catalogue_last_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# The search indexes only exist on PostgreSQL. Other databases use the unindexed fallback in app.search.
+
+
+def search_indexes(apps):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    catalogue = apps.get_model('app', 'Catalogue')
+    brand = apps.get_model('app', 'Brand')
+    return [
+        (catalogue, GinIndex(SearchVector('part_number', 'description', 'vendor_description', 'category',
+                                          config='simple'), name='catalogue_search_idx')),
+        (catalogue, GinIndex(fields=['part_number'], opclasses=['gin_trgm_ops'], name='catalogue_pn_trgm_idx')),
+        (brand, GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='brand_name_trgm_idx')),
+    ]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for model, index in search_indexes(apps):
+        schema_editor.add_index(model, index)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model, index in search_indexes(apps):
+        schema_editor.remove_index(model, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_catalogue_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:32
+
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_stock(apps, schema_editor):
+    """Merge stock entries for the same part and location into the oldest one, so they can be made unique."""
+    Stock = apps.get_model('app', 'Stock')
+    duplicates = (Stock.objects.values('part_number', 'location')
+                  .annotate(entries=Count('stock_id'), first=Min('stock_id'), total=Sum('quantity'))
+                  .filter(entries__gt=1))
+    for duplicate in duplicates:
+        entries = Stock.objects.filter(part_number=duplicate['part_number'], location=duplicate['location'])
+        entries.filter(stock_id=duplicate['first']).update(quantity=duplicate['total'])
+        entries.exclude(stock_id=duplicate['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_catalogue_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stock, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='stock',
+            unique_together={('part_number', 'location')},
+        ),
+    ]
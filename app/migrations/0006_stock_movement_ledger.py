@@ -0,0 +1,62 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start the ledger with an adjustment for every existing stock entry, so it adds up to the current stock."""
+    Stock = apps.get_model('app', 'Stock')
+    StockMovement = apps.get_model('app', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        StockMovement(part_number_id=part_number, location_id=location, kind='adjustment', quantity=quantity,
+                      modified_by='migration')
+        for part_number, location, quantity in Stock.objects.values_list('part_number', 'location', 'quantity')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_stock_unique_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('snapshot_id', models.AutoField(primary_key=True, serialize=False)),
+                ('taken', models.DateTimeField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('movement_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('receipt', 'Receipt'), ('checkout', 'Checkout'), ('adjustment', 'Adjustment'), ('transfer', 'Transfer')], max_length=15)),
+                ('quantity', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified_by', models.CharField(max_length=20, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='app.location')),
+                ('part_number', models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.CASCADE, to='app.catalogue')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created'], name='movement_created_idx'), models.Index(fields=['location', 'created'], name='movement_location_idx'), models.Index(fields=['part_number', 'created'], name='movement_part_number_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshotLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='app.location')),
+                ('part_number', models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.CASCADE, to='app.catalogue')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='app.stocksnapshot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['snapshot', 'location'], name='snapshot_line_location_idx')],
+                'unique_together': {('snapshot', 'part_number', 'location')},
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_stock_movement_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedScan',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('result', models.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified_by', models.CharField(max_length=20, null=True)),
+            ],
+        ),
+    ]
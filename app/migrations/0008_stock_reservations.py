@@ -0,0 +1,57 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:01
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_processed_scans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('modified_by', models.CharField(max_length=20, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bom',
+            name='open',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='stock',
+            constraint=models.CheckConstraint(check=models.Q(('reserved__lte', models.F('quantity'))), name='stock_reserved_lte_quantity'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='bom',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='app.bom'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='part_number',
+            field=models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='app.catalogue'),
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='stock',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='app.stock'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='reservation',
+            unique_together={('bom', 'stock')},
+        ),
+    ]
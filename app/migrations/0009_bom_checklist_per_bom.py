@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bomchecklist',
+            name='part_number',
+            field=models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.CASCADE, to='app.catalogue'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='bomchecklist',
+            unique_together={('bom', 'part_number')},
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:18
+
+import app.images
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_bom_checklist_per_bom'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='catalogue',
+            name='image',
+            field=app.images.ContentAddressedImageField(blank=True, null=True, upload_to=''),
+        ),
+    ]
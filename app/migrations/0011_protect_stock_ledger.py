@@ -0,0 +1,24 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockmovement',
+            name='part_number',
+            field=models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.PROTECT, to='app.catalogue'),
+        ),
+        migrations.AlterField(
+            model_name='stocksnapshotline',
+            name='part_number',
+            field=models.ForeignKey(db_column='part_number', on_delete=django.db.models.deletion.PROTECT, to='app.catalogue'),
+        ),
+    ]
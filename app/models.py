@@ -1,15 +1,20 @@
 from decimal import Decimal
 
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from app.images import ContentAddressedImageField, thumbnail_name
+
 
 class Bom(models.Model):
     bom_id = models.AutoField(primary_key=True)
     name = models.CharField(unique=True, max_length=31)
     date_created = models.DateTimeField(auto_now=True)
     created_by = models.CharField(max_length=20, null=True)
+    # Open BOMs are still being built, so count towards the demand for parts and may hold reservations
+    open = models.BooleanField(default=True)
 
     def __str__(self):
         return f'BOM {self.bom_id} - {self.name}'
@@ -51,13 +56,25 @@ class Catalogue(models.Model):
                                              validators=[MinValueValidator(Decimal('0.01'))])
     notes = models.CharField(max_length=1023, blank=True, null=True)
     url = models.URLField(blank=True, null=True)
-    image = models.ImageField(blank=True, null=True, upload_to='images/parts')
+    image = ContentAddressedImageField(blank=True, null=True)
     last_modified = models.DateTimeField(auto_now=True)
     modified_by = models.CharField(max_length=20, null=True)
 
     def __str__(self):
         return str(self.part_number)
 
+    @property
+    def thumbnail_url(self):
+        return default_storage.url(thumbnail_name(self.image.name)) if self.image else None
+
+    class Meta:
+        # Back the sort orders offered by CatalogueTable
+        indexes = [
+            models.Index(fields=['brand', 'part_number'], name='catalogue_brand_idx'),
+            models.Index(fields=['category', 'part_number'], name='catalogue_category_idx'),
+            models.Index(fields=['last_modified', 'part_number'], name='catalogue_last_modified_idx'),
+        ]
+
 
 class Location(models.Model):
     location_name = models.CharField(max_length=63)
@@ -71,6 +88,8 @@ class Stock(models.Model):
     part_number = models.ForeignKey(Catalogue, models.CASCADE, db_column='part_number')
     location = models.ForeignKey(Location, models.DO_NOTHING, verbose_name='Location/Project')
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    # The total of this entry's reservations, kept up to date as they change, so quantity - reserved is available
+    reserved = models.PositiveIntegerField(default=0, editable=False)
     comment = models.TextField(blank=True, null=True)
     check_out = models.CharField(default='x', max_length=1, editable=False, auto_created=True)
     created = models.DateTimeField(auto_now_add=True)
@@ -80,6 +99,108 @@ class Stock(models.Model):
     def __str__(self):
         return f"Stock {self.stock_id} - {self.part_number}. Quantity: {self.quantity}"
 
+    @property
+    def available(self):
+        return self.quantity - self.reserved
+
+    class Meta:
+        unique_together = ('part_number', 'location')
+        constraints = [
+            models.CheckConstraint(check=models.Q(reserved__lte=models.F('quantity')),
+                                   name='stock_reserved_lte_quantity'),
+        ]
+
+
+class Reservation(models.Model):
+    """Stock set aside for an open BOM, so that other BOMs don't count on the same parts."""
+    bom = models.ForeignKey(Bom, models.CASCADE, related_name='reservations')
+    stock = models.ForeignKey(Stock, models.CASCADE, related_name='reservations')
+    # The stock's part number, so reservations can be totalled per part without joining Stock
+    part_number = models.ForeignKey(Catalogue, models.CASCADE, db_column='part_number', related_name='reservations')
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    created = models.DateTimeField(auto_now_add=True)
+    modified_by = models.CharField(max_length=20, null=True)
+
+    def __str__(self):
+        return f"Reservation {self.id} - {self.quantity} x {self.part_number_id} for BOM {self.bom_id}"
+
+    class Meta:
+        unique_together = ('bom', 'stock')
+
+
+class StockMovement(models.Model):
+    """An append-only ledger of every change to stock.
+    Stock holds the running balance for each part and location, updated in the same transaction as each movement."""
+    RECEIPT = 'receipt'
+    CHECKOUT = 'checkout'
+    ADJUSTMENT = 'adjustment'
+    TRANSFER = 'transfer'
+    KIND_CHOICES = [
+        (RECEIPT, 'Receipt'),
+        (CHECKOUT, 'Checkout'),
+        (ADJUSTMENT, 'Adjustment'),
+        (TRANSFER, 'Transfer'),
+    ]
+
+    movement_id = models.BigAutoField(primary_key=True)
+    part_number = models.ForeignKey(Catalogue, models.PROTECT, db_column='part_number')
+    location = models.ForeignKey(Location, models.DO_NOTHING)
+    kind = models.CharField(max_length=15, choices=KIND_CHOICES)
+    # Positive for stock added to the location, negative for stock taken from it
+    quantity = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    modified_by = models.CharField(max_length=20, null=True)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Stock movements cannot be changed once recorded')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"StockMovement {self.movement_id} - {self.kind} {self.quantity} x {self.part_number_id}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created'], name='movement_created_idx'),
+            models.Index(fields=['location', 'created'], name='movement_location_idx'),
+            models.Index(fields=['part_number', 'created'], name='movement_part_number_idx'),
+        ]
+
+
+class StockSnapshot(models.Model):
+    """The balance of every part and location at a point in time, so history queries only need the ledger since."""
+    snapshot_id = models.AutoField(primary_key=True)
+    taken = models.DateTimeField(unique=True)
+
+    def __str__(self):
+        return f"StockSnapshot {self.snapshot_id} - {self.taken}"
+
+
+class StockSnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockSnapshot, models.CASCADE, related_name='lines')
+    part_number = models.ForeignKey(Catalogue, models.PROTECT, db_column='part_number')
+    location = models.ForeignKey(Location, models.DO_NOTHING)
+    quantity = models.IntegerField()
+
+    class Meta:
+        unique_together = ('snapshot', 'part_number', 'location')
+        indexes = [
+            models.Index(fields=['snapshot', 'location'], name='snapshot_line_location_idx'),
+        ]
+
+
+class ProcessedScan(models.Model):
+    """A scan replayed from a scanner's offline queue, or posted by a page with a key, with the result it was given.
+    Scanners resend their queue until they get a reply, and queue scans whose post got no reply, so the key stops a scan
+    from being applied twice."""
+    key = models.CharField(primary_key=True, max_length=64)
+    result = models.JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+    modified_by = models.CharField(max_length=20, null=True)
+
+    def __str__(self):
+        return f"ProcessedScan {self.key}"
+
 
 class CheckedOutStock(models.Model):
     checked_out_id = models.AutoField(primary_key=True, verbose_name='ID')
@@ -93,8 +214,8 @@ class CheckedOutStock(models.Model):
     @staticmethod
     def from_stock(stock: Stock):
         return CheckedOutStock(
-            part_number=stock.part_number,
-            location=stock.location,
+            part_number_id=stock.part_number_id,
+            location_id=stock.location_id,
             quantity=stock.quantity,
             comment=stock.comment,
         )
@@ -104,9 +225,13 @@ class CheckedOutStock(models.Model):
 
 
 class BomChecklist(models.Model):
-    part_number = models.OneToOneField('Catalogue', models.CASCADE, db_column='part_number')
+    part_number = models.ForeignKey('Catalogue', models.CASCADE, db_column='part_number')
     quantity_remaining = models.PositiveIntegerField()
     bom = models.ForeignKey(Bom, models.CASCADE)
 
     def __str__(self):
         return f"P/N: {self.part_number} - Quantity Remaining: {self.quantity_remaining}"
+
+    class Meta:
+        # One line per part on each BOM's checklist, so BOMs that share parts can be kitted at the same time
+        unique_together = ('bom', 'part_number')
@@ -0,0 +1,69 @@
+"""Reports on whether BOMs can be built from the stock on hand."""
+from django.db.models import Sum, Count, F, Value, DecimalField, BigIntegerField, ExpressionWrapper, OuterRef, Subquery
+from django.db.models.functions import Cast, Coalesce, Greatest
+
+from app.models import BomItems, Catalogue, Stock
+
+
+def bom_availability(builds=1, boms=None):
+    """The lines of BOMs, by default of every BOM, with the stock of each part across every location.
+    Computed in one grouped query, with each line annotated with:
+    on_hand: the stock of the part in every location,
+    required: the quantity needed to build the BOM `builds` times,
+    shortfall: how many more are needed than are on hand,
+    shortfall_cost: the cost of buying the shortfall, or None if the part has no cost price."""
+    lines = BomItems.objects.all() if boms is None else BomItems.objects.filter(bom__in=boms)
+    return (lines.select_related('bom', 'part_number')
+            .annotate(on_hand=Coalesce(Sum('part_number__stock__quantity'), 0),
+                      # A line's quantity times the most builds BomAvailabilityForm allows overflows an integer
+                      required=ExpressionWrapper(Cast('quantity', BigIntegerField()) * builds,
+                                                 output_field=BigIntegerField()))
+            .annotate(shortfall=Greatest(F('required') - F('on_hand'), Value(0)))
+            .annotate(shortfall_cost=ExpressionWrapper(F('shortfall') * F('part_number__purchase_unit_cost_eur'),
+                                                       output_field=DecimalField(max_digits=28, decimal_places=2)))
+            .order_by('bom__name', 'part_number'))
+
+
+def summarise(lines) -> list:
+    """Total the lines of bom_availability() for each BOM. Returns a dict for each BOM, in the order of the lines, with:
+    lines: the number of lines,
+    short: the number of lines with a shortfall,
+    buildable: how many times the BOM can be built from the stock on hand,
+    shortfall_cost: the cost of every shortfall that has a cost price,
+    unpriced: the number of lines with a shortfall but no cost price."""
+    summaries = {}
+    for line in lines:
+        summary = summaries.setdefault(line.bom_id, {
+            'bom': line.bom, 'lines': 0, 'short': 0, 'buildable': None, 'shortfall_cost': 0, 'unpriced': 0,
+        })
+        summary['lines'] += 1
+        buildable = line.on_hand // line.quantity
+        if summary['buildable'] is None or buildable < summary['buildable']:
+            summary['buildable'] = buildable
+        if line.shortfall:
+            summary['short'] += 1
+            if line.shortfall_cost is None:
+                summary['unpriced'] += 1
+            else:
+                summary['shortfall_cost'] += line.shortfall_cost
+    return list(summaries.values())
+
+
+def demand_rollup():
+    """Every part needed by an open BOM, with the total demand for it against the stock of it, in one query.
+    Each part is annotated with:
+    demand: the quantity needed by every open BOM,
+    boms: the number of open BOMs that need it,
+    on_hand: the stock of it in every location,
+    reserved: how much of that is reserved for BOMs,
+    available: how much isn't,
+    shortfall: how many more are needed than are on hand."""
+    # Totalled in subqueries, so that the stock rows don't multiply the BOM lines being summed
+    stock = Stock.objects.filter(part_number=OuterRef('pk')).order_by().values('part_number')
+    return (Catalogue.objects.filter(bomitems__bom__open=True)
+            .annotate(demand=Sum('bomitems__quantity'),
+                      boms=Count('bomitems'),
+                      on_hand=Coalesce(Subquery(stock.annotate(total=Sum('quantity')).values('total')), 0),
+                      reserved=Coalesce(Subquery(stock.annotate(total=Sum('reserved')).values('total')), 0))
+            .annotate(available=F('on_hand') - F('reserved'),
+                      shortfall=Greatest(F('demand') - F('on_hand'), Value(0))))
@@ -0,0 +1,66 @@
+"""Ranked search over the catalogue.
+
+On PostgreSQL this uses full-text search over the text fields and trigram similarity over part numbers and brand
+names, backed by the GIN indexes created in migration 0004. Other databases, such as the SQLite database used by the
+tests, fall back to case-insensitive substring matching.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q, Case, When, Value, IntegerField, QuerySet
+
+from app.models import Catalogue, Brand
+
+SEARCH_FIELDS = ('part_number', 'description', 'vendor_description', 'category')
+SEARCH_CONFIG = 'simple'
+
+
+def search_vector():
+    """The full-text document for a catalogue entry.
+    This must stay identical to the expression indexed by catalogue_search_idx, or the index will not be used."""
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector(*SEARCH_FIELDS, config=SEARCH_CONFIG)
+
+
+def search_catalogue(query: str) -> QuerySet:
+    """Return the catalogue entries matching the query, best match first."""
+    query = query.strip()
+    if not query:
+        return Catalogue.objects.none()
+    if connection.vendor == 'postgresql':
+        return _postgres_search(query)
+    return _fallback_search(query)
+
+
+def _postgres_search(query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+
+    terms = re.findall(r'\w+', query)
+    # Every word must match the start of a word in the entry, so partially scanned or typed part numbers still match
+    text_query = SearchQuery(' & '.join(f'{term}:*' for term in terms) or "''", search_type='raw',
+                             config=SEARCH_CONFIG)
+    # The brand table is small, so resolving it first lets the catalogue query combine three index scans
+    brands = list(Brand.objects.filter(name__trigram_similar=query).values_list('brand_id', flat=True))
+    vector = search_vector()
+    return (Catalogue.objects
+            .annotate(search=vector,
+                      rank=SearchRank(vector, text_query) + TrigramSimilarity('part_number', query))
+            .filter(Q(search=text_query) | Q(part_number__trigram_similar=query) | Q(brand__in=brands))
+            .order_by('-rank', 'part_number'))
+
+
+def _fallback_search(query):
+    match = Q()
+    for term in query.split():
+        term_match = Q(brand__name__icontains=term)
+        for field in SEARCH_FIELDS:
+            term_match |= Q(**{f'{field}__icontains': term})
+        match &= term_match
+    rank = Case(
+        When(part_number__iexact=query, then=Value(3)),
+        When(part_number__istartswith=query, then=Value(2)),
+        When(part_number__icontains=query, then=Value(1)),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return Catalogue.objects.filter(match).annotate(rank=rank).order_by('-rank', 'part_number')
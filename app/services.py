@@ -0,0 +1,266 @@
+"""Stock movements.
+
+Every change to stock quantities goes through these functions so that concurrent scans of the same part and location
+cannot lose updates. Quantities are changed with F() expressions or on rows locked with select_for_update, inside a
+transaction, and Stock holds at most one row per part number and location.
+
+Each change is also appended to the StockMovement ledger in the same transaction. Stock is the materialised balance of
+that ledger, and StockSnapshot stores periodic copies of it so that past balances can be found without reading the
+whole ledger.
+
+Once a change is committed, the pages watching it are sent the new values by app.live.
+
+Reservations set stock aside for open BOMs. Stock.reserved holds the total reserved from each entry, and changes to
+reservations lock the entries they are held against, as changes to quantities do.
+"""
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from app import live, lookups
+from app.models import Stock, CheckedOutStock, StockMovement, StockSnapshot, StockSnapshotLine, BomChecklist, \
+    BomItems, Reservation
+
+# Snapshots stop this far in the past, so that transactions still in progress when a snapshot is taken
+# cannot add movements from before it
+SNAPSHOT_DELAY = timedelta(minutes=5)
+
+
+@transaction.atomic
+def receive_stock(part_number, location, quantity, username=None, comment=None,
+                  kind=StockMovement.RECEIPT) -> Stock:
+    """Add stock of a part to a location, creating the stock entry if there isn't one yet."""
+    entries = Stock.objects.filter(part_number=part_number, location=location)
+    StockMovement.objects.create(part_number=part_number, location=location, kind=kind, quantity=quantity,
+                                 modified_by=username)
+    if not _add_quantity(entries, quantity, username):
+        try:
+            # Savepoint, so that losing the race to create the entry doesn't break the outer transaction
+            with transaction.atomic():
+                entry = Stock.objects.create(part_number=part_number, location=location, quantity=quantity,
+                                             comment=comment, modified_by=username)
+                _stock_changed(entry.part_number_id)
+                return entry
+        except IntegrityError:
+            # Another scan created the entry first, so add to that one instead
+            _add_quantity(entries, quantity, username)
+    entry = entries.get()
+    _stock_changed(entry.part_number_id)
+    return entry
+
+
+def _add_quantity(entries, quantity, username):
+    return entries.update(quantity=F('quantity') + quantity, modified_by=username, last_modified=timezone.now())
+
+
+def _stock_changed(*part_numbers):
+    transaction.on_commit(lambda: live.stock_changed(part_numbers))
+
+
+@transaction.atomic
+def receive_many(quantities, username=None) -> dict:
+    """Add stock for a batch of scans in one transaction.
+    `quantities` maps (part number, location id) to the quantity received, so duplicate scans must already have been
+    added together. Returns the stock entries after the scans, keyed the same way."""
+    StockMovement.objects.bulk_create(
+        StockMovement(part_number_id=part_number, location_id=location, kind=StockMovement.RECEIPT, quantity=quantity,
+                      modified_by=username)
+        for (part_number, location), quantity in quantities.items()
+    )
+    try:
+        with transaction.atomic():
+            return _add_quantities(quantities, username)
+    except IntegrityError:
+        # Another scan created one of the new entries first. It is committed by now, so it will be locked and added to
+        return _add_quantities(quantities, username)
+
+
+def _add_quantities(quantities, username):
+    part_numbers = {part_number for part_number, _ in quantities}
+    locations = {location for _, location in quantities}
+    now = timezone.now()
+    entries = {}
+    # Rows are locked in a consistent order, so that two batches can't each hold a lock the other is waiting for
+    for entry in Stock.objects.select_for_update().filter(part_number__in=part_numbers, location__in=locations)\
+            .order_by('stock_id'):
+        key = (entry.part_number_id, entry.location_id)
+        if key in quantities:
+            entry.quantity += quantities[key]
+            entry.modified_by = username
+            entry.last_modified = now
+            entries[key] = entry
+    Stock.objects.bulk_update(entries.values(), ['quantity', 'modified_by', 'last_modified'])
+    created = Stock.objects.bulk_create(
+        Stock(part_number_id=part_number, location_id=location, quantity=quantity, modified_by=username)
+        for (part_number, location), quantity in quantities.items() if (part_number, location) not in entries
+    )
+    if created:
+        # Bulk inserts don't send the post_save signal that would do this
+        lookups.clear_stock_filter_choices()
+    for entry in created:
+        entries[entry.part_number_id, entry.location_id] = entry
+    _stock_changed(*part_numbers)
+    return entries
+
+
+@transaction.atomic
+def checkout_stock(stock_id, quantity=None, username=None) -> CheckedOutStock:
+    """Remove stock from an entry and record it as checked out.
+    Checking out the whole quantity, or passing no quantity, removes the entry.
+    Raises Stock.DoesNotExist if the entry has already been removed."""
+    entry, quantity = _remove_stock(stock_id, quantity, username, StockMovement.CHECKOUT)
+    checked_out = CheckedOutStock.from_stock(entry)
+    checked_out.quantity = quantity
+    checked_out.modified_by = username
+    checked_out.save()
+    return checked_out
+
+
+@transaction.atomic
+def transfer_stock(stock_id, location, quantity=None, username=None) -> Stock:
+    """Move stock from an entry to another location. Returns the entry at the new location."""
+    entry, quantity = _remove_stock(stock_id, quantity, username, StockMovement.TRANSFER)
+    return receive_stock(entry.part_number, location, quantity, username, comment=entry.comment,
+                         kind=StockMovement.TRANSFER)
+
+
+def _remove_stock(stock_id, quantity, username, kind):
+    """Take up to `quantity` from an entry, or all of it if no quantity is given.
+    Returns the entry as it was before and the quantity taken."""
+    # Only this entry is locked, so scans of other stock carry on while it is changed
+    entry = Stock.objects.select_for_update().get(stock_id=stock_id)
+    if quantity is None or quantity >= entry.quantity:
+        quantity = entry.quantity
+        entry.delete()
+    else:
+        remaining = entry.quantity - quantity
+        reserved = min(entry.reserved, remaining)
+        if reserved < entry.reserved:
+            _trim_reservations(entry, entry.reserved - reserved)
+        Stock.objects.filter(stock_id=stock_id).update(quantity=F('quantity') - quantity, reserved=reserved,
+                                                       modified_by=username, last_modified=timezone.now())
+    StockMovement.objects.create(part_number_id=entry.part_number_id, location_id=entry.location_id, kind=kind,
+                                 quantity=-quantity, modified_by=username)
+    _stock_changed(entry.part_number_id)
+    return entry, quantity
+
+
+def _trim_reservations(entry, excess):
+    """Give up `excess` of the stock reserved from a locked entry, from the newest reservations first."""
+    for reservation in entry.reservations.order_by('-created', '-id'):
+        taken = min(excess, reservation.quantity)
+        if taken == reservation.quantity:
+            reservation.delete()
+        else:
+            Reservation.objects.filter(id=reservation.id).update(quantity=F('quantity') - taken)
+        excess -= taken
+        if not excess:
+            break
+
+
+@transaction.atomic
+def allocate_bom(bom, username=None) -> dict:
+    """Reserve stock for every line of an open BOM, replacing the reservations it already has.
+    Only stock that isn't reserved for other BOMs is used, taken from the oldest entries first.
+    Returns {part number: quantity that couldn't be reserved} for the lines that are short."""
+    if not bom.open:
+        raise ValueError('Stock can only be reserved for open BOMs')
+    needed = dict(BomItems.objects.filter(bom=bom).values_list('part_number', 'quantity'))
+    entries = _lock_reserved_stock(bom, Q(part_number__in=needed))
+    _release(bom, entries)
+    reservations = []
+    for entry in entries.values():
+        taken = min(needed.get(entry.part_number_id, 0), entry.available)
+        if taken > 0:
+            needed[entry.part_number_id] -= taken
+            entry.reserved += taken
+            reservations.append(Reservation(bom=bom, stock=entry, part_number_id=entry.part_number_id,
+                                            quantity=taken, modified_by=username))
+    Stock.objects.bulk_update(entries.values(), ['reserved'])
+    Reservation.objects.bulk_create(reservations)
+    return {part_number: quantity for part_number, quantity in needed.items() if quantity}
+
+
+@transaction.atomic
+def release_bom(bom):
+    """Give up all of the stock reserved for a BOM."""
+    entries = _lock_reserved_stock(bom)
+    _release(bom, entries)
+    Stock.objects.bulk_update(entries.values(), ['reserved'])
+
+
+@transaction.atomic
+def close_bom(bom):
+    """Mark a BOM as built, releasing its reservations so the stock can be used by other BOMs."""
+    release_bom(bom)
+    bom.open = False
+    bom.save(update_fields=['open'])
+
+
+def _lock_reserved_stock(bom, others=None) -> dict:
+    """Lock the stock entries reserved for a BOM, and any others matching `others`, as {stock id: entry}.
+    Everything is locked in one query in stock id order, so that two allocations can't each wait on the other."""
+    condition = Q(stock_id__in=Reservation.objects.filter(bom=bom).values('stock'))
+    if others is not None:
+        condition |= others
+    entries = Stock.objects.select_for_update().filter(condition).order_by('stock_id')
+    return {entry.stock_id: entry for entry in entries}
+
+
+def _release(bom, entries):
+    """Take a BOM's reservations off its locked entries, and delete them. The entries still need saving."""
+    reservations = Reservation.objects.filter(bom=bom)
+    for stock_id, quantity in reservations.values_list('stock', 'quantity'):
+        entries[stock_id].reserved -= quantity
+    reservations.delete()
+
+
+@transaction.atomic
+def scan_checklist(bom_id, part_number, quantity=1):
+    """Tick off scanned items on a BOM's checklist.
+    Returns the quantity still remaining, or None if the part isn't on the checklist or is already fully scanned."""
+    lines = BomChecklist.objects.filter(bom_id=bom_id, part_number=part_number)
+    # A single conditional update, so concurrent scans can't take the remaining quantity below zero
+    if not lines.filter(quantity_remaining__gte=quantity).update(
+            quantity_remaining=F('quantity_remaining') - quantity):
+        return None
+    remaining = lines.values_list('quantity_remaining', flat=True).get()
+    transaction.on_commit(lambda: live.checklist_changed(bom_id, part_number, remaining))
+    return remaining
+
+
+def balances_at(when, **filters) -> dict:
+    """Return the stock on hand at a point in time, as {(part number, location id): quantity}.
+    Starts from the latest snapshot taken before then and adds the movements since.
+    Filters such as location=... or part_number=... apply to both."""
+    balances = {}
+    snapshot = StockSnapshot.objects.filter(taken__lte=when).order_by('-taken').first()
+    movements = StockMovement.objects.filter(created__lte=when, **filters)
+    if snapshot is not None:
+        lines = snapshot.lines.filter(**filters).values_list('part_number', 'location', 'quantity')
+        balances = {(part_number, location): quantity for part_number, location, quantity in lines}
+        movements = movements.filter(created__gt=snapshot.taken)
+    totals = movements.values('part_number', 'location').annotate(total=Sum('quantity')).order_by()
+    for total in totals:
+        key = (total['part_number'], total['location'])
+        balances[key] = balances.get(key, 0) + total['total']
+    return {key: quantity for key, quantity in balances.items() if quantity}
+
+
+@transaction.atomic
+def take_snapshot(taken=None) -> StockSnapshot:
+    """Store the balance of every part and location, by default as of SNAPSHOT_DELAY ago."""
+    if taken is None:
+        taken = timezone.now() - SNAPSHOT_DELAY
+    existing = StockSnapshot.objects.filter(taken=taken).first()
+    if existing is not None:
+        return existing
+    balances = balances_at(taken)
+    snapshot = StockSnapshot.objects.create(taken=taken)
+    StockSnapshotLine.objects.bulk_create(
+        StockSnapshotLine(snapshot=snapshot, part_number_id=part_number, location_id=location, quantity=quantity)
+        for (part_number, location), quantity in balances.items()
+    )
+    return snapshot
@@ -0,0 +1,31 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from app import lookups, services
+from app.models import Stock, Location, Catalogue, Bom
+
+
+@receiver(post_save, sender=Stock)
+def stock_saved(sender, instance, created, **kwargs):
+    # Quantity changes don't affect which parts and locations have stock
+    if created:
+        lookups.clear_stock_filter_choices()
+
+
+@receiver(post_delete, sender=Stock)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def stock_locations_changed(sender, **kwargs):
+    lookups.clear_stock_filter_choices()
+
+
+@receiver(post_save, sender=Catalogue)
+@receiver(post_delete, sender=Catalogue)
+def catalogue_changed(sender, instance, **kwargs):
+    lookups.forget(instance.part_number)
+
+
+@receiver(pre_delete, sender=Bom)
+def bom_deleted(sender, instance, **kwargs):
+    # Its reservations are deleted with it, so take them off the stock's reserved totals first
+    services.release_bom(instance)
@@ -0,0 +1,107 @@
+// Post scan forms from script, and swap in only the parts of the page the scan changed.
+//
+// Forms opt in with a data-fragment attribute. They are posted with an HX-Request header, and the server responds
+// with HTML fragments instead of redirecting to the whole page again. Each element of the response replaces the
+// element of the page with the same id. Table rows the page doesn't have yet are added to the start of the element
+// matching their data-prepend-to selector. Without script the form is posted normally. If the server can't be reached,
+// scan forms hand the scan to the scan queue, and other forms are posted normally. If the server fails, it may have
+// saved the form first: scan forms, whose key stops the server applying them twice, are posted again normally to show
+// the page's own error, and other pages are reloaded.
+(function () {
+    'use strict';
+
+    function swap(html) {
+        // A template parses table rows on their own, which other elements would drop
+        const template = document.createElement('template');
+        template.innerHTML = html;
+        for (const element of Array.from(template.content.children)) {
+            const existing = element.id && document.getElementById(element.id);
+            if (existing) {
+                existing.replaceWith(element);
+            } else if (element.dataset.prependTo) {
+                const container = document.querySelector(element.dataset.prependTo);
+                if (container) {
+                    container.prepend(element);
+                }
+            }
+        }
+    }
+
+    function focusNextScan(form) {
+        const swapped = form.id && document.getElementById(form.id);
+        const input = swapped && swapped.querySelector('input[type=text], input[type=number]');
+        if (input) {
+            input.focus();
+            input.select();
+        }
+    }
+
+    function submitNormally(form, submitter) {
+        // form.submit() doesn't send the button that was pressed, which the view may need
+        if (submitter && submitter.name) {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = submitter.name;
+            input.value = submitter.value;
+            form.appendChild(input);
+        }
+        form.submit();
+    }
+
+    function queueScan(form) {
+        // The scan queue cancels the event for the forms it queues
+        return !form.dispatchEvent(new CustomEvent('scan-queue', {bubbles: true, cancelable: true}));
+    }
+
+    document.addEventListener('submit', async event => {
+        const form = event.target;
+        // Scans queued while offline have already been taken by the scan queue
+        if (!form.hasAttribute('data-fragment') || event.defaultPrevented) {
+            return;
+        }
+        event.preventDefault();
+        const data = new FormData(form);
+        if (event.submitter && event.submitter.name) {
+            data.append(event.submitter.name, event.submitter.value);
+        }
+        let response;
+        try {
+            response = await fetch(form.action, {
+                method: 'POST',
+                headers: {'HX-Request': 'true'},
+                credentials: 'same-origin',
+                body: data,
+            });
+        } catch (e) {
+            // The server couldn't be reached, though the browser may still think it is online. It may have saved the
+            // scan before the connection dropped, so it is queued with the same key
+            if (!queueScan(form)) {
+                submitNormally(form, event.submitter);
+            }
+            return;
+        }
+        if (response.redirected) {
+            // Such as to the login page, once the session has expired
+            window.location.assign(response.url);
+            return;
+        }
+        if (!response.ok) {
+            if (form.querySelector('input[name=scan_key]')) {
+                submitNormally(form, event.submitter);
+            } else {
+                window.location.reload();
+            }
+            return;
+        }
+        let html;
+        try {
+            html = await response.text();
+        } catch (e) {
+            // The scan was saved but its fragments were lost, so show the whole page again
+            window.location.reload();
+            return;
+        }
+        swap(html);
+        focusNextScan(form);
+    });
+})();
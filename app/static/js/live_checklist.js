@@ -0,0 +1,49 @@
+// Update the BOM checklist in place as other stations scan it, from the server's live update stream.
+//
+// Rows of the checklist carry a data-part-number attribute and their cells a data-field attribute, named for the
+// fields of the messages sent by app.live. Stock messages carry the quantity in stock of several parts at once. Parts
+// that aren't on this checklist are ignored.
+(function () {
+    'use strict';
+
+    const script = document.currentScript;
+    const checklist = document.getElementById('checklist');
+    if (!checklist || !window.EventSource) {
+        return;
+    }
+
+    function update(partNumber, field, value) {
+        const row = checklist.querySelector('tr[data-part-number="' + CSS.escape(partNumber) + '"]');
+        const cell = row && row.querySelector('td[data-field="' + field + '"]');
+        if (cell) {
+            cell.textContent = value;
+        }
+    }
+
+    const events = new EventSource(script.dataset.eventsUrl);
+    events.addEventListener('checklist', function (event) {
+        const message = JSON.parse(event.data);
+        update(message.part_number, 'quantity_remaining', message.quantity_remaining);
+    });
+    events.addEventListener('stock', function (event) {
+        const quantities = JSON.parse(event.data).quantities_in_stock;
+        Object.keys(quantities).forEach(function (partNumber) {
+            update(partNumber, 'quantity_in_stock', quantities[partNumber]);
+        });
+    });
+
+    function reload() {
+        events.close();
+        window.location.reload();
+    }
+
+    let subscribed = false;
+    events.addEventListener('subscribed', function () {
+        // After reconnecting, changes made while the connection was down have been missed
+        if (subscribed) {
+            reload();
+        }
+        subscribed = true;
+    });
+    events.addEventListener('reload', reload);
+})();
@@ -0,0 +1,172 @@
+// Queue scans while the scanner is offline, and replay them once it is back online.
+//
+// Scan forms opt in with a data-scan-queue attribute of "stock" or "checklist". While the browser is offline, or while
+// earlier scans are still queued, submitting one stores the scan in localStorage instead of posting it. Each scan is
+// given a key when it is submitted, in the form's scan_key field, and the server applies each key at most once. So a
+// queue that is sent again after a dropped reply doesn't count anything twice, and nor does a posted scan that is
+// queued because its reply was lost, which fragments.js hands over with a scan-queue event. The queue is sent again
+// every RETRY_INTERVAL until the server is back.
+(function () {
+    'use strict';
+
+    const STORAGE_KEY = 'scan-queue';
+    // Matches MAX_BATCH_SCANS on the server
+    const BATCH_SIZE = 400;
+    // Milliseconds between attempts to send queued scans, for when the server is down but the browser is online
+    const RETRY_INTERVAL = 30000;
+    const script = document.currentScript;
+    const replayUrl = script.dataset.replayUrl;
+    let replaying = false;
+
+    function load() {
+        try {
+            return JSON.parse(localStorage.getItem(STORAGE_KEY)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function save(queue) {
+        localStorage.setItem(STORAGE_KEY, JSON.stringify(queue));
+        showStatus(queue);
+    }
+
+    function newKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    function csrfToken() {
+        const input = document.querySelector('input[name=csrfmiddlewaretoken]');
+        if (input) {
+            return input.value;
+        }
+        const cookie = document.cookie.split('; ').find(row => row.startsWith('csrftoken='));
+        return cookie ? cookie.split('=')[1] : '';
+    }
+
+    function statusElement() {
+        let status = document.getElementById('scan-queue-status');
+        if (!status) {
+            status = document.createElement('div');
+            status.id = 'scan-queue-status';
+            const form = document.querySelector('form[data-scan-queue]');
+            form.parentNode.insertBefore(status, form);
+        }
+        return status;
+    }
+
+    function showStatus(queue, errors) {
+        if (!document.querySelector('form[data-scan-queue]')) {
+            return;
+        }
+        const status = statusElement();
+        status.textContent = queue.length ? `${queue.length} scan(s) waiting to be sent` : '';
+        for (const error of errors || []) {
+            const line = document.createElement('p');
+            line.className = 'errorlist';
+            line.textContent = error;
+            status.appendChild(line);
+        }
+    }
+
+    function setKey(form) {
+        let input = form.querySelector('input[name=scan_key]');
+        if (!input) {
+            input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = 'scan_key';
+            form.appendChild(input);
+        }
+        input.value = newKey();
+    }
+
+    function enqueue(form) {
+        const data = new FormData(form);
+        const scan = {key: data.get('scan_key'), kind: form.dataset.scanQueue, part_number: data.get('part_number')};
+        if (scan.kind === 'stock') {
+            scan.location = parseInt(data.get('location'), 10);
+            scan.quantity = parseInt(data.get('quantity'), 10) || 1;
+        } else {
+            scan.bom = parseInt(form.dataset.bom, 10);
+        }
+        const queue = load();
+        queue.push(scan);
+        save(queue);
+        form.reset();
+    }
+
+    async function replay() {
+        if (replaying || !navigator.onLine) {
+            return;
+        }
+        replaying = true;
+        const errors = [];
+        let applied = false;
+        try {
+            let queue = load();
+            while (queue.length) {
+                const batch = queue.slice(0, BATCH_SIZE);
+                const response = await fetch(replayUrl, {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken()},
+                    credentials: 'same-origin',
+                    body: JSON.stringify({scans: batch}),
+                });
+                if (!response.ok) {
+                    break;
+                }
+                const {results} = await response.json();
+                results.forEach((result, i) => {
+                    if (result.errors) {
+                        const messages = Object.values(result.errors).flat().join(' ');
+                        errors.push(`${batch[i].part_number}: ${messages}`);
+                    } else {
+                        applied = true;
+                    }
+                });
+                // Scans queued while this batch was being sent are kept
+                const sent = new Set(batch.map(scan => scan.key));
+                queue = load().filter(scan => !sent.has(scan.key));
+                save(queue);
+            }
+        } catch (e) {
+            // Still offline; the queue is kept and sent again later
+        } finally {
+            replaying = false;
+        }
+        showStatus(load(), errors);
+        if (applied && !errors.length) {
+            window.location.reload();
+        }
+    }
+
+    document.addEventListener('submit', event => {
+        const form = event.target;
+        if (!form.dataset.scanQueue) {
+            return;
+        }
+        // Before fragments.js posts the scan, which is registered after this
+        setKey(form);
+        if (navigator.onLine && !load().length) {
+            return;
+        }
+        event.preventDefault();
+        enqueue(form);
+        replay();
+    });
+    document.addEventListener('scan-queue', event => {
+        const form = event.target;
+        if (!form.dataset.scanQueue) {
+            return;
+        }
+        event.preventDefault();
+        enqueue(form);
+    });
+    window.addEventListener('online', replay);
+    setInterval(() => load().length && replay(), RETRY_INTERVAL);
+    showStatus(load());
+    replay();
+})();
@@ -1,48 +1,167 @@
 import django_tables2 as tables
-from django.db.models import Sum
-from django_tables2 import Column
+from django.db.models import Sum, QuerySet, Q, F
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+from django.utils.html import format_html
 from django_tables2.utils import Accessor
 
-from .models import Catalogue, BomItems, Stock, BomChecklist
+from .images import THUMBNAIL_SIZE
+from .models import Catalogue, BomItems, Stock, BomChecklist, CheckedOutStock
 
 
-class BomItemsTable(tables.Table):
+class BaseTable(tables.Table):
+    """A table that adds the joins its columns need to any queryset it is given.
+    Subclasses list the foreign keys they render in `select_related`."""
+    select_related = ()
+
+    def __init__(self, data=None, *args, **kwargs):
+        if isinstance(data, QuerySet):
+            data = self.shape_queryset(data)
+        super().__init__(data, *args, **kwargs)
+
+    @classmethod
+    def shape_queryset(cls, queryset):
+        return queryset.select_related(*cls.select_related)
+
+
+class BomItemsTable(BaseTable):
+    reserved = tables.Column()
+    select_related = ('part_number',)
+
+    @classmethod
+    def shape_queryset(cls, queryset):
+        # Total the stock reserved for each line's BOM in the same query as the lines
+        queryset = super().shape_queryset(queryset)
+        return queryset.annotate(reserved=Coalesce(Sum('part_number__reservations__quantity',
+                                                       filter=Q(part_number__reservations__bom=F('bom'))), 0))
+
     class Meta:
         model = BomItems
         fields = ['id', 'part_number', 'quantity']
+        sequence = ['id', 'part_number', 'quantity', 'reserved']
+
 
+class BomAvailabilityTable(tables.Table):
+    """The lines of app.reports.bom_availability()."""
+    part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number_id")]})
+    description = tables.Column(accessor='part_number__description')
+    quantity = tables.Column(verbose_name='Per Build')
+    required = tables.Column()
+    on_hand = tables.Column(verbose_name='On Hand')
+    shortfall = tables.Column()
+    cost = tables.Column(accessor='part_number__purchase_unit_cost_eur', verbose_name='Cost Price')
+    shortfall_cost = tables.Column(verbose_name='Shortfall Cost')
 
-class TotalQuantityColumn(Column):
-    def render(self, record):
-        total_quantity = Stock.objects.filter(part_number=record.part_number).aggregate(total_quantity=Sum('quantity'))[
-                             'total_quantity'] or 0
-        return total_quantity
+    @staticmethod
+    def render_shortfall_cost(value):
+        return f'{value:.2f}'
+
+    class Meta:
+        orderable = False
+
+
+class BomAvailabilitySummaryTable(tables.Table):
+    """The per-BOM totals of app.reports.summarise()."""
+    bom = tables.Column(verbose_name='BOM', linkify=lambda record: reverse('bom_availability',
+                                                                            args=[record['bom'].bom_id]))
+    lines = tables.Column()
+    short = tables.Column(verbose_name='Lines Short')
+    buildable = tables.Column()
+    shortfall_cost = tables.Column(verbose_name='Shortfall Cost')
+    unpriced = tables.Column(verbose_name='Short Without Cost Price')
+
+    @staticmethod
+    def render_shortfall_cost(value):
+        return f'{value:.2f}'
+
+    class Meta:
+        orderable = False
 
 
-class BomChecklistTable(tables.Table):
+class BomChecklistTable(BaseTable):
     part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]})
-    quantity_in_stock = TotalQuantityColumn(accessor='part_number', verbose_name='In Stock')
+    # Cells named for app.live's messages, so pages can update them in place
+    quantity_remaining = tables.Column(attrs={'td': {'data-field': 'quantity_remaining'}})
+    quantity_in_stock = tables.Column(verbose_name='In Stock', attrs={'td': {'data-field': 'quantity_in_stock'}})
+    select_related = ('part_number',)
+
+    @classmethod
+    def shape_queryset(cls, queryset):
+        # Total every part's stock in the same grouped query as the checklist, rather than once per row
+        queryset = super().shape_queryset(queryset)
+        return queryset.annotate(quantity_in_stock=Coalesce(Sum('part_number__stock__quantity'), 0))
 
     class Meta:
         model = BomChecklist
         fields = ['part_number', 'quantity_remaining']
+        row_attrs = {'id': lambda record: f'checklist-{record.part_number_id}',
+                     'data-part-number': lambda record: record.part_number_id}
+
+
+class DemandTable(tables.Table):
+    """The parts of app.reports.demand_rollup()."""
+    part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]})
+    description = tables.Column()
+    demand = tables.Column(order_by=('demand', 'part_number'))
+    boms = tables.Column(verbose_name='Open BOMs', order_by=('boms', 'part_number'))
+    on_hand = tables.Column(verbose_name='On Hand', orderable=False)
+    reserved = tables.Column(orderable=False)
+    available = tables.Column(orderable=False)
+    shortfall = tables.Column(order_by=('shortfall', 'part_number'))
 
 
-class CatalogueTable(tables.Table):
+class StockBalanceTable(tables.Table):
+    """The balances of app.services.balances_at(), as rows of part_number, location and quantity."""
     part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]})
-    brand = tables.Column(linkify={"viewname": "brand", "args": [Accessor("brand__brand_id")]})
+    location = tables.Column(linkify={"viewname": "location", "args": [Accessor("location.id")]})
+    quantity = tables.Column()
+
+
+class CatalogueTable(BaseTable):
+    # Only the columns backed by an index on Catalogue can be sorted.
+    # Part number breaks ties so that pages stay stable.
+    part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]},
+                                orderable=True)
+    brand = tables.Column(linkify={"viewname": "brand", "args": [Accessor("brand__brand_id")]},
+                          order_by=('brand', 'part_number'), orderable=True)
+    category = tables.Column(order_by=('category', 'part_number'), orderable=True)
+    last_modified = tables.DateTimeColumn(order_by=('last_modified', 'part_number'), orderable=True)
+    image = tables.Column(verbose_name='', linkify=lambda record: record.image.url)
+    select_related = ('brand',)
+
+    @staticmethod
+    def render_image(record):
+        # Only the thumbnail is loaded; the full image is a click away
+        width, height = THUMBNAIL_SIZE
+        return format_html('<img src="{}" alt="{}" width="{}" height="{}" loading="lazy">',
+                           record.thumbnail_url, record.part_number, width // 2, height // 2)
 
     class Meta:
         model = Catalogue
-        exclude = ['image', 'last_modified', 'modified_by', 'url']
+        exclude = ['modified_by', 'url']
+        sequence = ('image', '...')
+        orderable = False
+
+
+class CheckedOutStockTable(BaseTable):
+    part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]})
+    location = tables.Column(linkify={"viewname": "location", "args": [Accessor("location__id")]})
+    select_related = ('part_number', 'location')
+
+    class Meta:
+        model = CheckedOutStock
+        # Rows are paged by id, so sorting by any other column would break the cursor
+        orderable = False
 
 
-class StockTable(tables.Table):
+class StockTable(BaseTable):
     part_number = tables.Column(linkify={"viewname": "catalogue_entry", "args": [Accessor("part_number")]})
     location = tables.Column(linkify={"viewname": "location", "args": [Accessor("location__id")]})
     check_out = tables.Column(linkify={"viewname": "checkout_stock", "args": [Accessor("stock_id")]})
+    select_related = ('part_number', 'location')
 
     class Meta:
         model = Stock
         exclude = ['image']
         sequence = ('...', 'check_out')
+        row_attrs = {'id': lambda record: f'stock-{record.stock_id}'}
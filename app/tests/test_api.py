@@ -0,0 +1,274 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, Client, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app.forms import BomChecklistForm
+from app.models import Stock, Catalogue, Bom, Location, Brand, BomChecklist, CheckedOutStock, StockMovement, \
+    ProcessedScan
+
+
+class ScanApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=self.brand)
+        self.siemens_part = Catalogue.objects.create(part_number="6ES7_1", brand=self.brand)
+        self.location = Location.objects.create(location_name="Test Location")
+        self.bom = Bom.objects.create(name="Bom 1")
+        BomChecklist.objects.create(bom=self.bom, part_number=self.part, quantity_remaining=1)
+        self.client.login(username='testuser', password='password')
+
+    def post(self, name, data, **kwargs):
+        return self.client.post(reverse(name, kwargs=kwargs), data, content_type='application/json')
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.post('api_receive_stock', {})
+        self.assertEqual(response.status_code, 401)
+
+    def test_requires_post(self):
+        response = self.client.get(reverse('api_receive_stock'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_receive_stock(self):
+        response = self.post('api_receive_stock', {'part_number': '123', 'location': self.location.id, 'quantity': 4})
+        self.assertEqual(response.status_code, 201)
+        self.post('api_receive_stock', {'part_number': '123', 'location': self.location.id, 'quantity': 1})
+        entry = Stock.objects.get()
+        self.assertEqual((entry.quantity, entry.modified_by), (5, 'testuser'))
+        self.assertEqual(response.json()['stock']['stock_id'], entry.stock_id)
+
+    def test_receive_cleans_part_number(self):
+        response = self.post('api_receive_stock', {'part_number': '1p6ES7/1', 'location': self.location.id,
+                                                   'quantity': 1})
+        self.assertEqual(response.json()['stock']['part_number'], '6ES7_1')
+
+    def test_receive_form_encoded(self):
+        response = self.client.post(reverse('api_receive_stock'),
+                                    {'part_number': '123', 'location': self.location.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 201)
+
+    def test_receive_errors(self):
+        response = self.post('api_receive_stock', {'part_number': 'NotReal', 'location': self.location.id,
+                                                   'quantity': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['part_number'], ['Part number not found in catalogue'])
+        self.assertIn('quantity', response.json()['errors'])
+        self.assertFalse(Stock.objects.exists())
+
+    def test_invalid_json(self):
+        response = self.client.post(reverse('api_receive_stock'), '[1', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_receive_query_count(self):
+        self.post('api_receive_stock', {'part_number': '123', 'location': self.location.id, 'quantity': 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.post('api_receive_stock', {'part_number': '123', 'location': self.location.id, 'quantity': 1})
+        # Session and user, part number and location, then the movement, update and updated entry
+        statements = [query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(statements), 7)
+
+    def test_checkout_stock(self):
+        entry = Stock.objects.create(part_number=self.part, location=self.location, quantity=3)
+        response = self.post('api_checkout_stock', {'quantity': 2}, stock_id=entry.stock_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stock']['quantity'], 1)
+        self.assertEqual(response.json()['checked_out']['quantity'], 2)
+
+        response = self.post('api_checkout_stock', {'quantity': 5}, stock_id=entry.stock_id)
+        self.assertIsNone(response.json()['stock'])
+        self.assertEqual(response.json()['checked_out']['quantity'], 1)
+        self.assertEqual(CheckedOutStock.objects.count(), 2)
+
+        response = self.post('api_checkout_stock', {'quantity': 1}, stock_id=entry.stock_id)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(StockMovement.objects.count(), 2)
+
+    def test_transfer_stock(self):
+        other = Location.objects.create(location_name="Other Location")
+        entry = Stock.objects.create(part_number=self.part, location=self.location, quantity=3)
+        response = self.post('api_transfer_stock', {'location': other.id, 'quantity': 2}, stock_id=entry.stock_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['stock']['location'], response.json()['stock']['quantity']), (other.id, 2))
+        self.assertEqual(response.json()['from']['quantity'], 1)
+
+        response = self.post('api_transfer_stock', {'location': other.id}, stock_id=entry.stock_id)
+        self.assertEqual(response.json()['stock']['quantity'], 3)
+        self.assertIsNone(response.json()['from'])
+        self.assertEqual(list(StockMovement.objects.values_list('kind', 'quantity').order_by('movement_id')),
+                         [('transfer', -2), ('transfer', 2), ('transfer', -1), ('transfer', 1)])
+
+        moved = Stock.objects.get()
+        response = self.post('api_transfer_stock', {'location': other.id}, stock_id=moved.stock_id)
+        self.assertEqual(response.status_code, 400)
+        response = self.post('api_transfer_stock', {'location': self.location.id}, stock_id=entry.stock_id)
+        self.assertEqual(response.status_code, 404)
+
+    def test_scan_checklist(self):
+        response = self.post('api_scan_checklist', {'part_number': '123'}, bom_id=self.bom.bom_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['checklist']['quantity_remaining'], 0)
+
+        response = self.post('api_scan_checklist', {'part_number': '123'}, bom_id=self.bom.bom_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BomChecklist.objects.get().quantity_remaining, 0)
+
+    def test_scan_checklist_conflict(self):
+        # The last item is scanned at another station between validating the scan and applying it
+        with patch('app.services.scan_checklist', return_value=None):
+            response = self.post('api_scan_checklist', {'part_number': '123'}, bom_id=self.bom.bom_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors']['part_number'], [BomChecklistForm.ALL_SCANNED])
+
+    def test_scan_part_not_on_checklist(self):
+        response = self.post('api_scan_checklist', {'part_number': '6ES7_1'}, bom_id=self.bom.bom_id)
+        self.assertEqual(response.json()['errors']['part_number'], ['Part number not found in BOM'])
+
+
+class BatchScanApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.location = Location.objects.create(location_name="Test Location")
+        self.other_location = Location.objects.create(location_name="Other Location")
+
+    def post_batch(self, scans):
+        return self.client.post(reverse('api_receive_stock_batch'), {'scans': scans}, content_type='application/json')
+
+    def test_batch_coalesces_duplicates(self):
+        Catalogue.objects.create(part_number="123", brand=self.brand)
+        Catalogue.objects.create(part_number="456", brand=self.brand)
+        existing = Stock.objects.create(part_number_id="123", location=self.location, quantity=10)
+        response = self.post_batch([
+            {'part_number': '123', 'location': self.location.id},
+            {'part_number': ' 123', 'location': self.location.id, 'quantity': 4},
+            {'part_number': '456', 'location': self.location.id},
+            {'part_number': '456', 'location': self.other_location.id, 'quantity': 2},
+        ])
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['stock']['quantity'] for result in results], [15, 15, 1, 2])
+        self.assertEqual(results[0]['stock']['stock_id'], existing.stock_id)
+        self.assertEqual(Stock.objects.count(), 3)
+        self.assertEqual(sorted(StockMovement.objects.values_list('part_number', 'quantity')),
+                         [('123', 5), ('456', 1), ('456', 2)])
+
+    def test_batch_reports_errors_per_scan(self):
+        Catalogue.objects.create(part_number="123", brand=self.brand)
+        response = self.post_batch([
+            {'part_number': 'NotReal', 'location': self.location.id},
+            {'part_number': '123', 'location': 0},
+            {'part_number': '123', 'location': self.location.id, 'quantity': 0},
+            {'part_number': '123', 'location': self.location.id, 'quantity': 3},
+        ])
+        results = response.json()['results']
+        self.assertEqual(results[0]['errors'], {'part_number': ['Part number not found in catalogue']})
+        self.assertEqual(results[1]['errors'], {'location': ['Location not found']})
+        self.assertIn('quantity', results[2]['errors'])
+        self.assertEqual(results[3]['stock']['quantity'], 3)
+        self.assertEqual(Stock.objects.get().quantity, 3)
+
+    def test_batch_must_be_a_list(self):
+        self.assertEqual(self.post_batch('123').status_code, 400)
+        self.assertEqual(self.post_batch(['123']).status_code, 400)
+
+    def batch_queries(self, size):
+        parts = Catalogue.objects.bulk_create(Catalogue(part_number=f'{size}-PN{i}', brand=self.brand)
+                                              for i in range(size))
+        # Half of the parts are already in stock
+        Stock.objects.bulk_create(Stock(part_number=part, location=self.location, quantity=1) for part in parts[::2])
+        scans = [{'part_number': part.part_number, 'location': self.location.id} for part in parts]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch(scans)
+        self.assertEqual(Stock.objects.filter(part_number__in=parts).count(), size)
+        self.assertNotIn('errors', response.json()['results'][-1])
+        return len(queries)
+
+    def test_batch_query_count_is_constant(self):
+        # Kept within one bulk update batch on SQLite, which limits the parameters per query
+        self.assertEqual(self.batch_queries(2), self.batch_queries(100))
+
+
+class ReplayScansApiTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=brand)
+        self.location = Location.objects.create(location_name="Test Location")
+        self.bom = Bom.objects.create(name="Bom 1")
+        BomChecklist.objects.create(bom=self.bom, part_number=self.part, quantity_remaining=2)
+
+    def replay(self, scans):
+        response = self.client.post(reverse('api_replay_scans'), {'scans': scans}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_replay_applies_each_key_once(self):
+        queue = [
+            {'key': 'a', 'kind': 'stock', 'part_number': '123', 'location': self.location.id, 'quantity': 2},
+            {'key': 'b', 'kind': 'checklist', 'part_number': '123', 'bom': self.bom.bom_id},
+            {'key': 'a', 'kind': 'stock', 'part_number': '123', 'location': self.location.id, 'quantity': 2},
+        ]
+        first = self.replay(queue)
+        self.assertEqual(first[0]['stock']['quantity'], 2)
+        self.assertEqual(first[1]['checklist']['quantity_remaining'], 1)
+        self.assertEqual(first[2], first[0])
+
+        # The reply was lost, so the scanner sends the same queue again with a new scan
+        second = self.replay(queue + [{'key': 'c', 'kind': 'stock', 'part_number': '123',
+                                       'location': self.location.id}])
+        self.assertEqual(second[:3], first)
+        self.assertEqual(second[3]['stock']['quantity'], 3)
+        self.assertEqual(Stock.objects.get().quantity, 3)
+        self.assertEqual(BomChecklist.objects.get().quantity_remaining, 1)
+        self.assertEqual(ProcessedScan.objects.count(), 3)
+
+    def test_replay_keeps_errors(self):
+        results = self.replay([
+            {'kind': 'stock', 'part_number': '123', 'location': self.location.id},
+            {'key': 'a', 'kind': 'return'},
+            {'key': 'b', 'kind': 'stock', 'part_number': 'NotReal', 'location': self.location.id},
+            {'key': 'c', 'kind': 'checklist', 'part_number': '123'},
+        ])
+        self.assertEqual([list(result['errors']) for result in results], [['key'], ['kind'], ['part_number'], ['bom']])
+        self.assertEqual(self.replay([{'key': 'b', 'kind': 'stock', 'part_number': '123',
+                                       'location': self.location.id}]), results[2:3])
+        self.assertFalse(Stock.objects.exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentReplayTests(TransactionTestCase):
+    """Replay the same queue from several requests at once, as a scanner retrying a slow upload would.
+    SQLite locks the whole database for writes, so this only runs against PostgreSQL."""
+    threads = 8
+
+    def test_concurrent_replays_apply_scans_once(self):
+        user = User.objects.create_user(username='testuser', password='password')
+        brand = Brand.objects.create(name="Test Brand")
+        Catalogue.objects.create(part_number="123", brand=brand)
+        location = Location.objects.create(location_name="Test Location")
+        queue = [{'key': str(i), 'kind': 'stock', 'part_number': '123', 'location': location.id} for i in range(20)]
+
+        def replay(_):
+            try:
+                client = Client()
+                client.force_login(user)
+                return client.post(reverse('api_replay_scans'), {'scans': queue},
+                                   content_type='application/json').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            self.assertEqual(set(executor.map(replay, range(self.threads))), {200})
+        self.assertEqual(Stock.objects.get().quantity, 20)
+        self.assertEqual(StockMovement.objects.count(), 1)
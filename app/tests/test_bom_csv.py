@@ -0,0 +1,101 @@
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app.models import Catalogue, Bom, Brand, BomItems
+
+
+class BomCsvTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i}', brand=self.brand, description=f'Part {i}')
+                                      for i in range(3))
+        self.bom = Bom.objects.create(name="Test BOM")
+        BomItems.objects.create(bom=self.bom, part_number_id='PN0', quantity=1)
+        BomItems.objects.create(bom=self.bom, part_number_id='PN1', quantity=1)
+
+    def import_csv(self, content, **data):
+        file = SimpleUploadedFile('bom.csv', content.encode(), content_type='text/csv')
+        return self.client.post(reverse('bom_import', args=[self.bom.bom_id]), {'file': file, **data})
+
+    def lines(self):
+        return sorted(BomItems.objects.filter(bom=self.bom).values_list('part_number', 'quantity'))
+
+    def test_import_adds_and_updates_lines(self):
+        response = self.import_csv('Part Number,Quantity,Notes\n'
+                                   'PN1,4,\n'
+                                   'PN2,2.0,\n'
+                                   ' pn2 ,1,\n'
+                                   'PN2,1,\n'
+                                   'Unknown,1,\n'
+                                   'PN0,none,\n'
+                                   ',3,\n')
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual((result.inserted, result.updated, result.unchanged, result.deleted), (1, 1, 0, 0))
+        self.assertEqual(result.unknown, [(4, 'pn2'), (6, 'Unknown')])
+        self.assertEqual(result.errors, [(7, 'Invalid quantity: none'), (8, 'Missing part number')])
+        self.assertEqual(self.lines(), [('PN0', 1), ('PN1', 4), ('PN2', 3)])
+
+    def test_import_reports_quantities_out_of_range(self):
+        response = self.import_csv('Part Number,Quantity\n'
+                                   'PN0,inf\n'
+                                   'PN0,-Infinity\n'
+                                   'PN0,NaN\n'
+                                   'PN0,sNaN\n'
+                                   'PN0,1e30\n'
+                                   'PN0,0\n'
+                                   'PN1,2147483647\n'
+                                   'PN1,1\n')
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual(result.errors, [(2, 'Invalid quantity: inf'), (3, 'Invalid quantity: -Infinity'),
+                                         (4, 'Invalid quantity: NaN'), (5, 'Invalid quantity: sNaN'),
+                                         (6, 'Invalid quantity: 1e30'), (7, 'Invalid quantity: 0'),
+                                         (9, 'Total quantity of PN1 is too large')])
+        self.assertEqual(self.lines(), [('PN0', 1), ('PN1', 2147483647)])
+
+    def test_import_replace_removes_missing_lines(self):
+        response = self.import_csv('Part Number,Quantity\nPN1,1\n', replace='on')
+        result = response.context['result']
+        self.assertEqual((result.inserted, result.updated, result.unchanged, result.deleted), (0, 0, 1, 1))
+        self.assertEqual(self.lines(), [('PN1', 1)])
+
+    def test_import_requires_columns(self):
+        response = self.import_csv('Part,Qty\nPN1,1\n')
+        self.assertFormError(response.context['form'], 'file', 'The file needs Part Number and Quantity columns')
+        self.assertEqual(self.lines(), [('PN0', 1), ('PN1', 1)])
+
+    def test_import_query_count_is_constant(self):
+        def import_queries(lines):
+            Catalogue.objects.bulk_create(Catalogue(part_number=f'{lines}-PN{i}', brand=self.brand)
+                                          for i in range(lines))
+            content = 'Part Number,Quantity\n' + ''.join(f'{lines}-PN{i},1\n' for i in range(lines))
+            with CaptureQueriesContext(connection) as queries:
+                self.import_csv(content)
+            return len(queries)
+
+        # Kept within one insert batch on SQLite, which limits the parameters per query
+        self.assertEqual(import_queries(2), import_queries(150))
+
+    def test_export_streams_csv(self):
+        response = self.client.get(reverse('bom_export', args=[self.bom.bom_id]))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="bom-{self.bom.bom_id}.csv"')
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content, 'Part Number,Quantity,Brand,Description\r\n'
+                                  'PN0,1,Test Brand,Part 0\r\n'
+                                  'PN1,1,Test Brand,Part 1\r\n')
+
+    def test_export_can_be_imported(self):
+        BomItems.objects.filter(part_number='PN1').update(quantity=5)
+        content = b''.join(self.client.get(reverse('bom_export', args=[self.bom.bom_id])).streaming_content)
+        BomItems.objects.filter(bom=self.bom).delete()
+        self.import_csv(content.decode())
+        self.assertEqual(self.lines(), [('PN0', 1), ('PN1', 5)])
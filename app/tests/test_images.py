@@ -0,0 +1,117 @@
+import io
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from app import images
+from app.models import Catalogue, Brand
+from app.views import IMMUTABLE_MAX_AGE
+
+
+def photo(colour='red', size=(400, 200), name='photo.png'):
+    output = io.BytesIO()
+    Image.new('RGB', size, colour).save(output, 'PNG')
+    return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+
+class ImageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i}', brand=self.brand) for i in range(2))
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self, part_number, image):
+        return self.client.post(reverse('catalogue_edit', args=[part_number]),
+                                {'brand': self.brand.brand_id, 'image': image})
+
+    def stored_files(self, directory):
+        return default_storage.listdir(directory)[1]
+
+    def test_identical_uploads_are_stored_once(self):
+        self.upload('PN0', photo(name='first.png'))
+        self.upload('PN1', photo(name='second.PNG'))
+        first, second = Catalogue.objects.order_by('part_number')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^images/parts/[0-9a-f]{64}\.png$')
+        self.assertEqual(len(self.stored_files(images.IMAGE_DIR)), 1)
+        self.assertEqual(len(self.stored_files(images.THUMBNAIL_DIR)), 1)
+
+        self.upload('PN1', photo('blue'))
+        self.assertEqual(len(self.stored_files(images.IMAGE_DIR)), 2)
+
+    def test_thumbnail_is_fixed_size(self):
+        self.upload('PN0', photo(size=(1200, 300)))
+        entry = Catalogue.objects.get(part_number='PN0')
+        with default_storage.open(images.thumbnail_name(entry.image.name)) as file, Image.open(file) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', images.THUMBNAIL_SIZE))
+
+    @override_settings(DEBUG=True)
+    def test_images_are_served_with_immutable_cache_headers(self):
+        self.upload('PN0', photo())
+        entry = Catalogue.objects.get(part_number='PN0')
+        response = self.client.get(entry.thumbnail_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], f'private, max-age={IMMUTABLE_MAX_AGE}, immutable')
+
+        default_storage.save('images/parts/legacy.png', photo())
+        self.assertFalse(self.client.get('/media/images/parts/legacy.png').has_header('Cache-Control'))
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    def test_images_need_login(self):
+        self.upload('PN0', photo())
+        entry = Catalogue.objects.get(part_number='PN0')
+        self.client.logout()
+        for debug in (True, False):
+            with self.subTest(debug=debug), override_settings(DEBUG=debug):
+                response = self.client.get(entry.image.url)
+                self.assertRedirects(response, f'{settings.LOGIN_URL}?next={entry.image.url}',
+                                     fetch_redirect_response=False)
+
+    def test_images_are_sent_by_the_proxy_without_debug(self):
+        self.upload('PN0', photo())
+        entry = Catalogue.objects.get(part_number='PN0')
+        self.assertEqual(self.client.get(entry.image.url).status_code, 404)
+
+        with override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/'):
+            response = self.client.get(entry.image.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{entry.image.name}')
+        self.assertEqual(response['Cache-Control'], f'private, max-age={IMMUTABLE_MAX_AGE}, immutable')
+        self.assertFalse(response.has_header('Content-Type'))
+        self.assertEqual(response.content, b'')
+
+    def test_tables_only_load_thumbnails(self):
+        self.upload('PN0', photo())
+        entry = Catalogue.objects.get(part_number='PN0')
+        response = self.client.get(reverse('catalogue_entry', args=['PN0']))
+        self.assertContains(response, f'<img src="{entry.thumbnail_url}"')
+        self.assertNotContains(response, f'<img src="{entry.image.url}"')
+        self.assertContains(self.client.get(reverse('catalogue')), f'<img src="{entry.thumbnail_url}"')
+
+    def test_process_images_renames_legacy_images(self):
+        legacy = default_storage.save('images/parts/legacy.png', ContentFile(photo().read()))
+        Catalogue.objects.update(image=legacy)
+        call_command('process_images', workers=2, stdout=io.StringIO())
+        names = set(Catalogue.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertRegex(name, images.CONTENT_ADDRESSED)
+        self.assertTrue(default_storage.exists(images.thumbnail_name(name)))
@@ -0,0 +1,70 @@
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from app.models import Catalogue, Brand, Location, Stock
+
+HEADER = 'Part Number,Brand,Category,Common description,Vendor Description,Purchasing Unit Price,Sale Unit Price,' \
+         'Notes,URL\n'
+
+
+class ImportCatalogueTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="APC")
+        self.catalogue_item = Catalogue.objects.create(part_number="AP9565", brand=self.brand, description="Old")
+        self.location = Location.objects.create(location_name="Test Location")
+        self.stock = Stock.objects.create(part_number=self.catalogue_item, location=self.location, quantity=10)
+
+    def import_csv(self, rows, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(HEADER + rows)
+        self.addCleanup(os.remove, file.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalogue', file.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_inserts_and_updates(self):
+        out, _ = self.import_csv(
+            'AP9565,APC,PDU,"Rack PDU, Basic",,165.26,236.09,,\n'
+            'SCL500,Schneider,UPS,UPS,,"1,184.59",Price on Request,,https://example.com\n'
+        )
+        self.assertIn('1 inserted, 1 updated, 0 failed', out)
+        updated = Catalogue.objects.get(part_number='AP9565')
+        self.assertEqual(updated.description, 'Rack PDU, Basic')
+        self.assertEqual(updated.purchase_unit_cost_eur, Decimal('165.26'))
+        created = Catalogue.objects.get(part_number='SCL500')
+        self.assertEqual(created.brand.name, 'Schneider')
+        self.assertEqual(created.purchase_unit_cost_eur, Decimal('1184.59'))
+        self.assertIsNone(created.sale_unit_cost_eur)
+
+    def test_import_keeps_stock(self):
+        self.import_csv('AP9565,APC,,New,,,,,\n')
+        self.assertTrue(Stock.objects.filter(pk=self.stock.pk).exists())
+
+    def test_import_reuses_brands(self):
+        self.import_csv(''.join(f'PN{i},APC,,,,,,,\n' for i in range(5)) + 'PN5,Sick,,,,,,,\n', '--chunk-size', '2')
+        self.assertEqual(sorted(Brand.objects.values_list('name', flat=True)), ['APC', 'Sick'])
+
+    def test_import_reports_failures(self):
+        out, err = self.import_csv(',APC,,,,,,,\n' + f'{"x" * 100},APC,,,,,,,\n' + 'PN1,APC,,,,,,,\n')
+        self.assertIn('1 inserted, 0 updated, 2 failed', out)
+        self.assertIn('Row 2: Missing part number', err)
+        self.assertIn('Row 3: Part Number is longer than 63 characters', err)
+
+    def test_sync_only_writes_changed_rows(self):
+        Catalogue.objects.create(part_number="ORPHAN", brand=self.brand)
+        self.import_csv('AP9565,APC,,Old,,1.50,,,\n')
+        modified = Catalogue.objects.get(part_number='AP9565').last_modified
+        out, _ = self.import_csv('AP9565,APC,,Old,,1.5,,,\n' + 'PN1,APC,,Changed,,,,,\n', '--sync')
+        self.assertIn('1 inserted, 0 updated, 1 unchanged, 1 orphaned, 0 failed', out)
+        self.assertEqual(Catalogue.objects.get(part_number='AP9565').last_modified, modified)
+
+        out, _ = self.import_csv('AP9565,APC,,Old,,2.00,,,\n' + 'PN1,APC,,Changed,,,,,\n', '--sync')
+        self.assertIn('0 inserted, 1 updated, 1 unchanged, 1 orphaned, 0 failed', out)
+        updated = Catalogue.objects.get(part_number='AP9565')
+        self.assertEqual(updated.purchase_unit_cost_eur, Decimal('2.00'))
+        self.assertGreater(updated.last_modified, modified)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import time
+from contextlib import suppress
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, AsyncClient, Client
+from django.urls import reverse
+
+from app import live, services
+from app.models import Catalogue, Bom, Location, Brand, BomChecklist
+
+
+class LiveUpdateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='password')
+        brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=brand)
+        self.location = Location.objects.create(location_name="Test Location")
+        self.bom = Bom.objects.create(name="Bom 1")
+        BomChecklist.objects.create(bom=self.bom, part_number=self.part, quantity_remaining=2)
+
+    def scan(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            services.scan_checklist(self.bom.bom_id, '123')
+
+    def receive(self, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            services.receive_stock(self.part, self.location, quantity)
+
+    async def test_changes_are_sent_to_subscribers_once_committed(self):
+        async with live.layer.subscribe(live.bom_group(self.bom.bom_id), live.STOCK_GROUP) as subscription:
+            await sync_to_async(self.scan)()
+            self.assertEqual(await subscription.get(1),
+                             {'type': 'checklist', 'part_number': '123', 'quantity_remaining': 1})
+            await sync_to_async(self.receive)(3)
+            await sync_to_async(self.receive)(2)
+            for total in (3, 5):
+                self.assertEqual(await subscription.get(1), {'type': 'stock', 'quantities_in_stock': {'123': total}})
+
+            # Nothing is sent for changes that haven't been committed
+            await sync_to_async(services.scan_checklist)(self.bom.bom_id, '123')
+            self.assertIsNone(await subscription.get(0.01))
+        self.assertFalse(live.layer.has_subscribers(live.STOCK_GROUP))
+
+    async def test_other_boms_are_not_sent_checklist_changes(self):
+        async with live.layer.subscribe(live.bom_group(self.bom.bom_id + 1)) as subscription:
+            await sync_to_async(self.scan)()
+            self.assertIsNone(await subscription.get(0.01))
+
+    async def test_slow_subscriber_is_told_to_reload(self):
+        async with live.layer.subscribe('test') as subscription:
+            for i in range(live.SUBSCRIPTION_SIZE + 1):
+                live.layer.send('test', {'type': 'test', 'number': i})
+            await asyncio.sleep(0)
+            self.assertEqual(await subscription.get(1), {'type': 'reload'})
+            self.assertIsNone(await subscription.get(0.01))
+
+    def test_stock_totals_are_only_read_when_watched(self):
+        with self.assertNumQueries(0):
+            live.stock_changed(['123'])
+
+    async def test_stock_totals_are_sent_together(self):
+        part_numbers = [f'PN{i}' for i in range(live.STOCK_MESSAGE_PARTS + 1)]
+        async with live.layer.subscribe(live.STOCK_GROUP) as subscription:
+            await sync_to_async(live.stock_changed)(['123', *part_numbers])
+            first, second = await subscription.get(1), await subscription.get(1)
+        self.assertEqual(len(first['quantities_in_stock']), live.STOCK_MESSAGE_PARTS)
+        self.assertEqual(dict(first['quantities_in_stock'], **second['quantities_in_stock']),
+                         dict.fromkeys(['123', *part_numbers], 0))
+
+    async def test_events_stream(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        self.assertContains(await client.get(reverse('bom', args=[self.bom.bom_id])), 'live_checklist.js')
+        response = await client.get(reverse('bom_events', args=[self.bom.bom_id]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        self.assertEqual(await anext(content), b'event: subscribed\ndata: {"type": "subscribed"}\n\n')
+
+        await sync_to_async(self.scan)()
+        event = (await anext(content)).decode()
+        self.assertTrue(event.startswith('event: checklist\ndata: '))
+        self.assertEqual(json.loads(event.split('data: ')[1])['quantity_remaining'], 1)
+
+        # The server cancels the response when the page is closed, which ends the subscription
+        waiting = asyncio.ensure_future(anext(content))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with suppress(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(live.layer.has_subscribers(live.bom_group(self.bom.bom_id)))
+
+    def test_events_need_asgi(self):
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('bom_events', args=[self.bom.bom_id]))
+        self.assertEqual(response.status_code, 501)
+        self.assertNotContains(client.get(reverse('bom', args=[self.bom.bom_id])), 'live_checklist.js')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL')
+class PostgresLayerTests(TransactionTestCase):
+    """Two layers stand in for two server processes."""
+
+    def setUp(self):
+        self.layers = [live.PostgresLayer(), live.PostgresLayer()]
+
+    def tearDown(self):
+        for layer in self.layers:
+            layer.close()
+
+    async def test_messages_reach_subscribers_of_every_process(self):
+        subscriber, sender = self.layers
+        async with subscriber.subscribe('test') as subscription, sender.subscribe('other') as other:
+            await sync_to_async(sender.send)('test', {'type': 'test', 'number': 1})
+            self.assertEqual(await subscription.get(5), {'type': 'test', 'number': 1})
+            self.assertIsNone(await other.get(0.1))
+
+    async def test_subscribers_of_every_process_are_seen(self):
+        subscriber, sender = self.layers
+        has_subscribers = sync_to_async(sender.has_subscribers)
+        self.assertFalse(await has_subscribers('test'))
+        async with subscriber.subscribe('test'):
+            self.assertTrue(await has_subscribers('test'))
+            self.assertFalse(await has_subscribers('other'))
+            async with subscriber.subscribe('test'):
+                pass
+            self.assertTrue(await has_subscribers('test'))
+        await sync_to_async(self.wait_until)(lambda: not sender.has_subscribers('test'))
+
+    async def test_subscribers_reload_when_the_listener_reconnects(self):
+        async with self.layers[0].subscribe('test') as subscription:
+            await sync_to_async(self.terminate_listeners)()
+            self.assertEqual(await subscription.get(5), {'type': 'reload'})
+            # Once listening again, the process holds its presence locks again
+            await sync_to_async(self.wait_until)(lambda: self.layers[1].has_subscribers('test'))
+
+    @staticmethod
+    def terminate_listeners():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_locks WHERE locktype = 'advisory' AND classid = %s",
+                           [live.PostgresLayer.PRESENCE_LOCK])
+
+    @staticmethod
+    def wait_until(condition, timeout=live.LISTEN_RETRY_INTERVAL * 2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise AssertionError('Timed out')
+            time.sleep(0.05)
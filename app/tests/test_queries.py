@@ -0,0 +1,301 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from app import lookups
+from app.models import Catalogue, Bom, Location, Brand, BomChecklist, Stock, BomItems
+from app.tables import BomChecklistTable
+from app.views import Util
+
+
+class QueryCountTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.location = Location.objects.create(location_name="Test Location")
+        self.other_location = Location.objects.create(location_name="Other Location")
+        self.bom = Bom.objects.create(name="Test BOM")
+
+    def add_checklist_items(self, count, start=0):
+        parts = Catalogue.objects.bulk_create(
+            Catalogue(part_number=f'PN{i}', brand=self.brand) for i in range(start, start + count)
+        )
+        BomChecklist.objects.bulk_create(BomChecklist(bom=self.bom, part_number=part, quantity_remaining=1)
+                                         for part in parts)
+        Stock.objects.bulk_create(Stock(part_number=part, location=self.location, quantity=2) for part in parts)
+        Stock.objects.bulk_create(Stock(part_number=part, location=self.other_location, quantity=3) for part in parts)
+
+    def in_stock_column_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            table = BomChecklistTable(BomChecklist.objects.filter(bom=self.bom))
+            totals = [row.get_cell_value('quantity_in_stock') for row in table.rows]
+        return len(queries), totals
+
+    def test_bom_checklist_in_stock_totals(self):
+        self.add_checklist_items(3)
+        empty = Catalogue.objects.create(part_number='Empty', brand=self.brand)
+        BomChecklist.objects.create(bom=self.bom, part_number=empty, quantity_remaining=1)
+        _, totals = self.in_stock_column_queries()
+        self.assertEqual(sorted(totals), [0, 5, 5, 5])
+
+    def test_bom_checklist_in_stock_query_count_is_constant(self):
+        self.add_checklist_items(1)
+        small_bom_queries, _ = self.in_stock_column_queries()
+        self.add_checklist_items(400, start=1)
+        large_bom_queries, totals = self.in_stock_column_queries()
+        self.assertEqual(len(totals), 401)
+        self.assertEqual(small_bom_queries, large_bom_queries)
+
+    def generate_checklist_queries(self, items):
+        parts = Catalogue.objects.bulk_create(
+            Catalogue(part_number=f'PN{i}', brand=self.brand) for i in range(items)
+        )
+        bom = Bom.objects.create(name=f"BOM with {items} items")
+        BomItems.objects.bulk_create(BomItems(bom=bom, part_number=part, quantity=2) for part in parts)
+        stale = Catalogue.objects.create(part_number=f'Stale {items}', brand=self.brand)
+        BomChecklist.objects.create(bom=bom, part_number=stale, quantity_remaining=1)
+        with CaptureQueriesContext(connection) as queries:
+            Util.generate_bom_checklist(bom.bom_id)
+        self.assertEqual(sorted(BomChecklist.objects.filter(bom=bom).values_list('part_number', 'quantity_remaining')),
+                         sorted((part.part_number, 2) for part in parts))
+        Catalogue.objects.all().delete()
+        return len(queries)
+
+    def test_generate_bom_checklist_query_count_is_constant(self):
+        # Stays within one insert batch on SQLite, which limits the parameters per query
+        self.assertEqual(self.generate_checklist_queries(2), self.generate_checklist_queries(300))
+
+
+class ListPageQueryTests(TestCase):
+    """Each list page should cost the same number of queries however many rows it shows."""
+    rows = 1000
+
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.location = Location.objects.create(location_name="Test Location")
+        self.bom = Bom.objects.create(name="Test BOM")
+        self.part = Catalogue.objects.create(part_number='PN', brand=self.brand)
+        self.next_part = 0
+
+    def add_parts(self, count):
+        """Create `count` catalogue entries, each with its own brand, location, stock, BOM line and checklist line."""
+        ids = range(self.next_part, self.next_part + count)
+        self.next_part += count
+        brands = Brand.objects.bulk_create(Brand(name=f'Brand {i}') for i in ids)
+        locations = Location.objects.bulk_create(Location(location_name=f'Location {i}') for i in ids)
+        parts = Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i}', brand=brand)
+                                              for i, brand in zip(ids, brands))
+        Stock.objects.bulk_create(Stock(part_number=part, location=location, quantity=1)
+                                  for part, location in zip(parts, locations))
+        BomItems.objects.bulk_create(BomItems(bom=self.bom, part_number=part, quantity=1) for part in parts)
+        BomChecklist.objects.bulk_create(BomChecklist(bom=self.bom, part_number=part, quantity_remaining=1)
+                                         for part in parts)
+        # Rows that only show up on the single brand, location and part pages
+        Catalogue.objects.bulk_create(Catalogue(part_number=f'Brand PN{i}', brand=self.brand) for i in ids)
+        Stock.objects.bulk_create(Stock(part_number=self.part, location=location, quantity=1) for location in locations)
+        Stock.objects.bulk_create(Stock(part_number=part, location=self.location, quantity=1) for part in parts)
+
+    def count_queries(self, url):
+        # Bulk inserts don't send the signals that clear cached choices
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_parts(2)
+        small = self.count_queries(url)
+        self.add_parts(self.rows)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+
+    def test_stock_queries(self):
+        self.assertConstantQueries(reverse('stock'))
+
+    def test_location_queries(self):
+        self.assertConstantQueries(reverse('location', args=[self.location.id]))
+
+    def test_catalogue_queries(self):
+        self.assertConstantQueries(reverse('catalogue'))
+
+    def test_brand_queries(self):
+        self.assertConstantQueries(reverse('brand', args=[self.brand.brand_id]))
+
+    def test_catalogue_entry_queries(self):
+        self.assertConstantQueries(reverse('catalogue_entry', args=[self.part.part_number]))
+
+    def test_bom_queries(self):
+        self.assertConstantQueries(reverse('bom', args=[self.bom.bom_id]))
+
+
+class StockPageQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number='123', brand=brand)
+        self.location = Location.objects.create(location_name="Test Location")
+        self.other_location = Location.objects.create(location_name="Other Location")
+        for location in (self.location, self.other_location):
+            Stock.objects.create(part_number=self.part, location=location, quantity=1)
+
+    def test_filter_choices_are_distinct(self):
+        choices = lookups.stock_filter_choices()
+        self.assertEqual(choices['part_number'], [('123', '123')])
+        self.assertEqual(choices['location'], [(self.other_location.id, 'Other Location'),
+                                               (self.location.id, 'Test Location')])
+
+    def test_filter_choices_are_cached_until_stock_changes(self):
+        lookups.stock_filter_choices()
+        with self.assertNumQueries(0):
+            lookups.stock_filter_choices()
+        part = Catalogue.objects.create(part_number='456', brand=self.part.brand)
+        Stock.objects.create(part_number=part, location=self.location, quantity=1)
+        self.assertEqual(len(lookups.stock_filter_choices()['part_number']), 2)
+        Stock.objects.filter(part_number=part).get().delete()
+        self.assertEqual(len(lookups.stock_filter_choices()['part_number']), 1)
+
+    def test_filter_choices_are_cleared_again_on_commit(self):
+        part = Catalogue.objects.create(part_number='456', brand=self.part.brand)
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.create(part_number=part, location=self.location, quantity=1)
+            # Cached by another request before the new entry commits
+            cache.set(lookups.STOCK_FILTER_CHOICES_KEY, {'part_number': [], 'location': []})
+        self.assertEqual(len(lookups.stock_filter_choices()['part_number']), 2)
+
+    def test_stock_page_query_budget(self):
+        self.client.get(reverse('stock'))
+        # Session, user, location choices for the scan form, current stock and past stock
+        with self.assertNumQueries(5):
+            self.client.get(reverse('stock'))
+
+    def test_scan_looks_up_part_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('stock'), {
+                'part_number': ' 123 ',
+                'location': self.location.id,
+                'quantity': 5,
+                'submit-stock': 'submit-stock'
+            })
+        part_lookups = [query for query in queries if 'FROM "app_catalogue"' in query['sql']]
+        self.assertEqual(len(part_lookups), 1)
+
+
+def bom_edit_data(items, quantity=None):
+    """The bom_edit formset as posted, with every line's quantity set to `quantity`, or increased by one."""
+    data = {
+        'bomitems_set-TOTAL_FORMS': str(len(items)),
+        'bomitems_set-INITIAL_FORMS': str(len(items)),
+    }
+    for i, item in enumerate(items):
+        data[f'bomitems_set-{i}-id'] = str(item.id)
+        data[f'bomitems_set-{i}-part_number'] = item.part_number_id
+        data[f'bomitems_set-{i}-quantity'] = str(item.quantity + 1 if quantity is None else quantity)
+    return data
+
+
+class CatalogueLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.bom = Bom.objects.create(name="Test BOM")
+
+    def test_bom_edit_looks_up_part_numbers_once(self):
+        parts = Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i}', brand=self.brand) for i in range(300))
+        items = BomItems.objects.bulk_create(BomItems(bom=self.bom, part_number=part, quantity=1) for part in parts)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bom_edit', args=[self.bom.bom_id]), bom_edit_data(items))
+        self.assertEqual(response.status_code, 302)
+        catalogue_queries = [query for query in queries if 'FROM "app_catalogue"' in query['sql']]
+        self.assertEqual(len(catalogue_queries), 1)
+        self.assertEqual(set(BomItems.objects.values_list('quantity', flat=True)), {2})
+
+    def test_lookups_are_memoised(self):
+        Catalogue.objects.create(part_number='123', brand=self.brand)
+        with lookups.memoise():
+            lookups.get_many(['123', '456'])
+            with self.assertNumQueries(0):
+                self.assertEqual(lookups.get('123').part_number, '123')
+                self.assertIsNone(lookups.get('456'))
+            # Saving an entry drops what was memoised for it
+            Catalogue.objects.create(part_number='456', brand=self.brand)
+            self.assertEqual(lookups.get('456').part_number, '456')
+        with self.assertNumQueries(1):
+            lookups.get('123')
+
+    @override_settings(CATALOGUE_CACHE_TIMEOUT=60)
+    def test_shared_cache(self):
+        part = Catalogue.objects.create(part_number='123', brand=self.brand, description='Old')
+        lookups.get('123')
+        with self.assertNumQueries(0):
+            self.assertEqual(lookups.get('123').description, 'Old')
+        part.description = 'New'
+        part.save()
+        self.assertEqual(lookups.get('123').description, 'New')
+        part.delete()
+        self.assertIsNone(lookups.get('123'))
+
+
+class BomEditQueryTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        self.client.login(username='testuser', password='password')
+        self.brand = Brand.objects.create(name="Test Brand")
+
+    def edit_queries(self, lines):
+        """Count the queries to change one line of a BOM with `lines` lines."""
+        bom = Bom.objects.create(name=f"BOM with {lines} lines")
+        parts = Catalogue.objects.bulk_create(Catalogue(part_number=f'{lines}-PN{i}', brand=self.brand)
+                                              for i in range(lines))
+        items = BomItems.objects.bulk_create(BomItems(bom=bom, part_number=part, quantity=1) for part in parts)
+        data = bom_edit_data(items, quantity=1)
+        data['bomitems_set-0-quantity'] = '5'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('bom_edit', args=[bom.bom_id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(BomItems.objects.filter(bom=bom).values_list('quantity', flat=True)),
+                         [1] * (lines - 1) + [5])
+        return len(queries)
+
+    def test_bom_edit_query_count_is_constant(self):
+        self.assertEqual(self.edit_queries(3), self.edit_queries(300))
+
+    def test_bom_edit_inserts_updates_and_deletes(self):
+        bom = Bom.objects.create(name="Test BOM")
+        parts = Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i}', brand=self.brand) for i in range(4))
+        items = BomItems.objects.bulk_create(BomItems(bom=bom, part_number=part, quantity=1) for part in parts[:3])
+        data = bom_edit_data(items, quantity=1)
+        data.update({
+            'bomitems_set-TOTAL_FORMS': '4',
+            'bomitems_set-1-quantity': '7',
+            'bomitems_set-2-DELETE': 'on',
+            'bomitems_set-3-part_number': 'PN3',
+            'bomitems_set-3-quantity': '2',
+        })
+        response = self.client.post(reverse('bom_edit', args=[bom.bom_id]), data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(sorted(BomItems.objects.filter(bom=bom).values_list('part_number', 'quantity')),
+                         [('PN0', 1), ('PN1', 7), ('PN3', 2)])
+
+    def test_bom_edit_rejects_lines_from_other_boms(self):
+        bom = Bom.objects.create(name="Test BOM")
+        other = Bom.objects.create(name="Other BOM")
+        part = Catalogue.objects.create(part_number='PN', brand=self.brand)
+        BomItems.objects.create(bom=bom, part_number=part, quantity=1)
+        other_item = BomItems.objects.create(bom=other, part_number=part, quantity=1)
+        response = self.client.post(reverse('bom_edit', args=[bom.bom_id]), bom_edit_data([other_item]))
+        self.assertEqual(response.status_code, 200)
+        other_item.refresh_from_db()
+        self.assertEqual(other_item.quantity, 1)
@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, Client
+from django.urls import reverse
+
+from app import reports, services
+from app.forms import BomAvailabilityForm
+from app.models import Catalogue, Bom, Location, Brand, Stock, BomItems
+
+
+class BomAvailabilityTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Test Brand")
+        self.location = Location.objects.create(location_name="Test Location")
+        self.other_location = Location.objects.create(location_name="Other Location")
+        self.bom = Bom.objects.create(name="Test BOM")
+        self.other_bom = Bom.objects.create(name="Other BOM")
+        self.parts = Catalogue.objects.bulk_create([
+            Catalogue(part_number='PN0', brand=brand, purchase_unit_cost_eur=Decimal('2.50')),
+            Catalogue(part_number='PN1', brand=brand, purchase_unit_cost_eur=Decimal('10.00')),
+            Catalogue(part_number='PN2', brand=brand),
+        ])
+        Stock.objects.create(part_number=self.parts[0], location=self.location, quantity=5)
+        Stock.objects.create(part_number=self.parts[0], location=self.other_location, quantity=3)
+        Stock.objects.create(part_number=self.parts[1], location=self.location, quantity=1)
+        for part, quantity in zip(self.parts, [2, 1, 1]):
+            BomItems.objects.create(bom=self.bom, part_number=part, quantity=quantity)
+        BomItems.objects.create(bom=self.other_bom, part_number=self.parts[0], quantity=4)
+
+    def test_lines(self):
+        lines = reports.bom_availability(builds=3, boms=[self.bom])
+        self.assertEqual([(line.part_number_id, line.on_hand, line.required, line.shortfall, line.shortfall_cost)
+                          for line in lines],
+                         [('PN0', 8, 6, 0, Decimal('0.00')),
+                          ('PN1', 1, 3, 2, Decimal('20.00')),
+                          ('PN2', 0, 3, 3, None)])
+
+    def test_lines_of_large_quantities(self):
+        BomItems.objects.filter(bom=self.bom, part_number='PN1').update(quantity=2147483647)
+        builds = BomAvailabilityForm.base_fields['builds'].max_value
+        line = reports.bom_availability(builds=builds, boms=[self.bom]).get(part_number='PN1')
+        self.assertEqual((line.required, line.shortfall), (2147483647 * builds, 2147483647 * builds - 1))
+        # SQLite multiplies decimals as floats, which can't hold every digit of the cost
+        self.assertAlmostEqual(line.shortfall_cost, (2147483647 * builds - 1) * Decimal('10.00'), delta=100)
+
+    def test_summaries_of_every_bom_in_one_query(self):
+        with self.assertNumQueries(1):
+            summaries = reports.summarise(reports.bom_availability(builds=2))
+        self.assertEqual([(summary['bom'], summary['lines'], summary['short'], summary['buildable'],
+                           summary['shortfall_cost'], summary['unpriced']) for summary in summaries],
+                         [(self.other_bom, 1, 0, 2, 0, 0),
+                          (self.bom, 3, 2, 0, Decimal('10.00'), 1)])
+
+    def test_views(self):
+        client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        client.login(username='testuser', password='password')
+        response = client.get(reverse('bom_availability', args=[self.bom.bom_id]), {'builds': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['summary']['short'], 2)
+        self.assertContains(response, '20.00')
+
+        response = client.get(reverse('bom_availability_all'), {'builds': 'many'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['builds'], 1)
+        self.assertEqual(len(response.context['table'].rows), 2)
+
+    def test_demand_rollup_in_one_query(self):
+        services.allocate_bom(self.bom)
+        with self.assertNumQueries(1):
+            parts = list(reports.demand_rollup().order_by('part_number'))
+        self.assertEqual([(part.part_number, part.demand, part.boms, part.on_hand, part.reserved, part.available,
+                           part.shortfall) for part in parts],
+                         [('PN0', 6, 2, 8, 2, 6, 0),
+                          ('PN1', 1, 1, 1, 1, 0, 0),
+                          ('PN2', 1, 1, 0, 0, 0, 1)])
+
+    def test_demand_rollup_skips_closed_boms(self):
+        services.close_bom(self.other_bom)
+        self.assertEqual(list(reports.demand_rollup().order_by('part_number').values_list('part_number', 'demand')),
+                         [('PN0', 2), ('PN1', 1), ('PN2', 1)])
+
+    def test_demand_view(self):
+        client = Client()
+        User.objects.create_user(username='testuser', password='password')
+        client.login(username='testuser', password='password')
+        response = client.get(reverse('bom_demand'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row.record.part_number for row in response.context['table'].page.object_list],
+                         ['PN2', 'PN1', 'PN0'])
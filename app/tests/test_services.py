@@ -0,0 +1,256 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connections
+from django.db.models import Sum, ProtectedError
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+
+from app import services
+from app.models import Stock, Catalogue, Location, Brand, CheckedOutStock, StockMovement, StockSnapshot, Bom, \
+    BomItems, Reservation, BomChecklist
+
+
+class StockMovementTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=self.brand)
+        self.location = Location.objects.create(location_name="Test Location")
+
+    def test_receive_creates_entry(self):
+        entry = services.receive_stock(self.part, self.location, 5, username='testuser', comment='New')
+        self.assertEqual((entry.quantity, entry.comment, entry.modified_by), (5, 'New', 'testuser'))
+
+    def test_receive_adds_to_existing_entry(self):
+        services.receive_stock(self.part, self.location, 5)
+        entry = services.receive_stock(self.part, self.location, 3, username='other')
+        self.assertEqual(Stock.objects.count(), 1)
+        self.assertEqual((entry.quantity, entry.modified_by), (8, 'other'))
+
+    def test_checkout_part_of_entry(self):
+        entry = services.receive_stock(self.part, self.location, 5)
+        checked_out = services.checkout_stock(entry.stock_id, 2, username='testuser')
+        entry.refresh_from_db()
+        self.assertEqual(entry.quantity, 3)
+        self.assertEqual((checked_out.quantity, checked_out.part_number_id, checked_out.modified_by),
+                         (2, '123', 'testuser'))
+
+    def test_checkout_whole_entry(self):
+        entry = services.receive_stock(self.part, self.location, 5)
+        checked_out = services.checkout_stock(entry.stock_id)
+        self.assertFalse(Stock.objects.exists())
+        self.assertEqual(checked_out.quantity, 5)
+
+    def test_checkout_missing_entry(self):
+        with self.assertRaises(Stock.DoesNotExist):
+            services.checkout_stock(0, 1)
+
+    def test_transfer_stock(self):
+        other = Location.objects.create(location_name="Other Location")
+        entry = services.receive_stock(self.part, self.location, 5)
+        moved = services.transfer_stock(entry.stock_id, other, 2)
+        entry.refresh_from_db()
+        self.assertEqual((entry.quantity, moved.quantity, moved.location), (3, 2, other))
+        self.assertFalse(CheckedOutStock.objects.exists())
+
+    def test_receive_many(self):
+        other = Location.objects.create(location_name="Other Location")
+        services.receive_stock(self.part, self.location, 5)
+        entries = services.receive_many({('123', self.location.id): 2, ('123', other.id): 3}, username='testuser')
+        self.assertEqual({key: entry.quantity for key, entry in entries.items()},
+                         {('123', self.location.id): 7, ('123', other.id): 3})
+        self.assertEqual(Stock.objects.get(location=self.location).modified_by, 'testuser')
+        self.assertEqual(StockMovement.objects.filter(location=other).get().quantity, 3)
+
+    def test_movements_add_up_to_stock(self):
+        other = Location.objects.create(location_name="Other Location")
+        entry = services.receive_stock(self.part, self.location, 5)
+        services.receive_stock(self.part, self.location, 4)
+        services.checkout_stock(entry.stock_id, 2)
+        services.transfer_stock(entry.stock_id, other, 3)
+        services.receive_stock(self.part, other, 1)
+        kinds = list(StockMovement.objects.order_by('movement_id').values_list('kind', 'quantity'))
+        self.assertEqual(kinds, [('receipt', 5), ('receipt', 4), ('checkout', -2), ('transfer', -3),
+                                 ('transfer', 3), ('receipt', 1)])
+        for stock in Stock.objects.all():
+            ledger = StockMovement.objects.filter(part_number=stock.part_number, location=stock.location)
+            self.assertEqual(ledger.aggregate(total=Sum('quantity'))['total'], stock.quantity)
+
+    def test_movements_are_append_only(self):
+        services.receive_stock(self.part, self.location, 5)
+        movement = StockMovement.objects.get()
+        movement.quantity = 10
+        with self.assertRaises(ValueError):
+            movement.save()
+
+    def backdate_movements(self, days):
+        StockMovement.objects.filter(created__gt=timezone.now() - timedelta(minutes=1)).update(
+            created=timezone.now() - timedelta(days=days))
+
+    def test_balances_at(self):
+        other = Location.objects.create(location_name="Other Location")
+        entry = services.receive_stock(self.part, self.location, 5)
+        services.receive_stock(self.part, other, 7)
+        self.backdate_movements(30)
+        services.checkout_stock(entry.stock_id, 2)
+        self.backdate_movements(10)
+        services.checkout_stock(entry.stock_id)
+
+        self.assertEqual(services.balances_at(timezone.now() - timedelta(days=40)), {})
+        self.assertEqual(services.balances_at(timezone.now() - timedelta(days=20)),
+                         {('123', self.location.id): 5, ('123', other.id): 7})
+        self.assertEqual(services.balances_at(timezone.now() - timedelta(days=5), location=self.location),
+                         {('123', self.location.id): 3})
+        self.assertEqual(services.balances_at(timezone.now()), {('123', other.id): 7})
+
+    def test_balances_at_uses_snapshots(self):
+        entry = services.receive_stock(self.part, self.location, 5)
+        self.backdate_movements(30)
+        snapshot = services.take_snapshot(timezone.now() - timedelta(days=20))
+        self.assertEqual(list(snapshot.lines.values_list('quantity', flat=True)), [5])
+        services.checkout_stock(entry.stock_id, 2)
+        self.backdate_movements(10)
+
+        # Movements before the snapshot are no longer read
+        StockMovement.objects.filter(created__lt=snapshot.taken).delete()
+        self.assertEqual(services.balances_at(timezone.now() - timedelta(days=15)), {('123', self.location.id): 5})
+        self.assertEqual(services.balances_at(timezone.now()), {('123', self.location.id): 3})
+        self.assertEqual(services.take_snapshot(snapshot.taken), snapshot)
+        self.assertEqual(StockSnapshot.objects.count(), 1)
+
+    def test_ledger_protects_catalogue_entries(self):
+        entry = services.receive_stock(self.part, self.location, 5)
+        services.checkout_stock(entry.stock_id)
+        services.take_snapshot(timezone.now())
+        with self.assertRaises(ProtectedError):
+            self.part.delete()
+        self.assertEqual(StockMovement.objects.count(), 2)
+
+    def test_scan_checklist_per_bom(self):
+        bom, other_bom = Bom.objects.create(name="Test BOM"), Bom.objects.create(name="Other BOM")
+        BomChecklist.objects.create(bom=bom, part_number=self.part, quantity_remaining=2)
+        BomChecklist.objects.create(bom=other_bom, part_number=self.part, quantity_remaining=1)
+        self.assertEqual(services.scan_checklist(bom.bom_id, '123'), 1)
+        self.assertIsNone(services.scan_checklist(other_bom.bom_id, '123', quantity=2))
+        self.assertEqual(services.scan_checklist(other_bom.bom_id, '123'), 0)
+        self.assertIsNone(services.scan_checklist(other_bom.bom_id, '123'))
+        self.assertEqual(services.scan_checklist(bom.bom_id, '123'), 0)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=brand)
+        self.location = Location.objects.create(location_name="Test Location")
+        self.other_location = Location.objects.create(location_name="Other Location")
+        self.first = services.receive_stock(self.part, self.location, 5)
+        self.second = services.receive_stock(self.part, self.other_location, 5)
+        self.bom = Bom.objects.create(name="Test BOM")
+        self.other_bom = Bom.objects.create(name="Other BOM")
+        BomItems.objects.create(bom=self.bom, part_number=self.part, quantity=7)
+        BomItems.objects.create(bom=self.other_bom, part_number=self.part, quantity=4)
+
+    def reserved(self):
+        return list(Stock.objects.order_by('stock_id').values_list('reserved', flat=True))
+
+    def test_allocate_takes_oldest_entries_first(self):
+        self.assertEqual(services.allocate_bom(self.bom, username='testuser'), {})
+        self.assertEqual(self.reserved(), [5, 2])
+        self.assertEqual(list(Reservation.objects.order_by('stock').values_list('quantity', 'modified_by')),
+                         [(5, 'testuser'), (2, 'testuser')])
+
+    def test_allocate_skips_stock_reserved_for_other_boms(self):
+        services.allocate_bom(self.bom)
+        self.assertEqual(services.allocate_bom(self.other_bom), {'123': 1})
+        self.assertEqual(self.reserved(), [5, 5])
+        # Allocating again replaces the BOM's reservations rather than adding to them
+        self.assertEqual(services.allocate_bom(self.other_bom), {'123': 1})
+        self.assertEqual(self.reserved(), [5, 5])
+        self.assertEqual(Reservation.objects.filter(bom=self.other_bom).aggregate(Sum('quantity'))['quantity__sum'], 3)
+
+    def test_release_and_close(self):
+        services.allocate_bom(self.bom)
+        services.release_bom(self.bom)
+        self.assertEqual(self.reserved(), [0, 0])
+        services.allocate_bom(self.other_bom)
+        services.close_bom(self.other_bom)
+        self.assertEqual(self.reserved(), [0, 0])
+        self.assertFalse(Reservation.objects.exists())
+        with self.assertRaises(ValueError):
+            services.allocate_bom(self.other_bom)
+
+    def test_deleting_bom_releases_stock(self):
+        services.allocate_bom(self.bom)
+        self.bom.delete()
+        self.assertEqual(self.reserved(), [0, 0])
+
+    def test_checkout_trims_newest_reservations(self):
+        BomItems.objects.filter(bom=self.bom).update(quantity=2)
+        BomItems.objects.filter(bom=self.other_bom).update(quantity=2)
+        services.allocate_bom(self.bom)
+        services.allocate_bom(self.other_bom)
+        services.checkout_stock(self.first.stock_id, 3)
+        self.assertEqual(self.reserved(), [2, 0])
+        self.assertEqual(list(Reservation.objects.order_by('bom').values_list('bom', 'quantity')),
+                         [(self.bom.bom_id, 2)])
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentStockMovementTests(TransactionTestCase):
+    """Scan the same stock from several threads at once.
+    SQLite locks the whole database for writes, so these only run against PostgreSQL."""
+    threads = 8
+    scans_per_thread = 25
+
+    def setUp(self):
+        brand = Brand.objects.create(name="Test Brand")
+        self.part = Catalogue.objects.create(part_number="123", brand=brand)
+        self.location = Location.objects.create(location_name="Test Location")
+
+    def run_concurrently(self, scan):
+        def worker(_):
+            try:
+                for _ in range(self.scans_per_thread):
+                    scan()
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            list(executor.map(worker, range(self.threads)))
+
+    def test_concurrent_receives_preserve_total(self):
+        self.run_concurrently(lambda: services.receive_stock(self.part, self.location, 2))
+        entry = Stock.objects.get()
+        self.assertEqual(entry.quantity, 2 * self.threads * self.scans_per_thread)
+
+    def test_concurrent_batches_preserve_total(self):
+        other = Location.objects.create(location_name="Other Location")
+        self.run_concurrently(lambda: services.receive_many({('123', self.location.id): 1, ('123', other.id): 2}))
+        scans = self.threads * self.scans_per_thread
+        self.assertEqual(Stock.objects.get(location=self.location).quantity, scans)
+        self.assertEqual(Stock.objects.get(location=other).quantity, 2 * scans)
+
+    def test_concurrent_checkouts_preserve_total(self):
+        total = 3 * self.threads * self.scans_per_thread
+        entry = services.receive_stock(self.part, self.location, total)
+        self.run_concurrently(lambda: services.checkout_stock(entry.stock_id, 1))
+        entry.refresh_from_db()
+        self.assertEqual(entry.quantity + sum(CheckedOutStock.objects.values_list('quantity', flat=True)), total)
+        self.assertEqual(entry.quantity, total - self.threads * self.scans_per_thread)
+
+    def test_concurrent_checklist_scans_of_shared_parts(self):
+        boms = [Bom.objects.create(name=f"BOM {i}") for i in range(2)]
+        # One BOM has fewer items than will be scanned, so the conditional update must stop at zero
+        needed = [self.threads * self.scans_per_thread, self.threads * self.scans_per_thread // 2]
+        for bom, quantity in zip(boms, needed):
+            BomChecklist.objects.create(bom=bom, part_number=self.part, quantity_remaining=quantity)
+        ticked = []
+
+        def scan():
+            for bom in boms:
+                ticked.append(services.scan_checklist(bom.bom_id, '123') is not None)
+
+        self.run_concurrently(scan)
+        self.assertEqual(list(BomChecklist.objects.order_by('bom').values_list('quantity_remaining', flat=True)),
+                         [0, 0])
+        self.assertEqual(sum(ticked), sum(needed))
@@ -1,8 +1,14 @@
+import json
+from datetime import timedelta
+
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.test import TestCase, Client, AsyncClient
 from django.urls import reverse
+from django.utils import timezone
 
-from app.models import Stock, Catalogue, Bom, Location, Brand
+from app import services
+from app.models import Stock, Catalogue, Bom, Location, Brand, CheckedOutStock, StockMovement
+from app.views import PAST_STOCK_PAGE_SIZE, CATALOGUE_PAGE_SIZE, EXPORT_CHUNK_SIZE
 
 
 class ViewTests(TestCase):
@@ -26,6 +32,35 @@ class ViewTests(TestCase):
         )
         self.client.login(username='testuser', password='password')
 
+    def test_stock_balances_view(self):
+        other = Location.objects.create(location_name="Other Location")
+        services.receive_stock(self.catalogue_item, self.location, 4)
+        services.receive_stock(self.catalogue_item, other, 2)
+        StockMovement.objects.update(created=timezone.now() - timedelta(days=10))
+        services.checkout_stock(self.stock.stock_id, 3)
+
+        response = self.client.get(reverse('stock_balances'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['table'].rows), 0)
+
+        when = (timezone.now() - timedelta(days=5)).strftime('%Y-%m-%dT%H:%M')
+        response = self.client.get(reverse('stock_balances'), {'at': when})
+        self.assertEqual([(row.record['location'], row.record['quantity']) for row in response.context['table'].rows],
+                         [(self.location, 4), (other, 2)])
+        response = self.client.get(reverse('stock_balances'),
+                                   {'at': when, 'location': other.id, 'part_number': ' 12345 '})
+        self.assertEqual([row.record['quantity'] for row in response.context['table'].rows], [2])
+        response = self.client.get(reverse('stock_balances'), {'at': timezone.now() + timedelta(minutes=1)})
+        self.assertEqual([row.record['quantity'] for row in response.context['table'].rows], [1, 2])
+
+    def test_stock_is_read_only_in_admin(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        response = self.client.get(reverse('admin:app_stock_change', args=[self.stock.stock_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'name="_save"')
+        self.assertEqual(self.client.get(reverse('admin:app_stock_add')).status_code, 403)
+
     def test_default_view_redirect(self):
         response = self.client.get(reverse('default'))
         self.assertEqual(response.status_code, 302)
@@ -64,6 +99,80 @@ class ViewTests(TestCase):
         self.assertContains(response, "12345")
         self.assertContains(response, "Test Location")
 
+    def test_stock_view_pages_past_stock(self):
+        CheckedOutStock.objects.bulk_create(
+            CheckedOutStock(part_number=self.catalogue_item, location=self.location, quantity=1)
+            for _ in range(PAST_STOCK_PAGE_SIZE + 5)
+        )
+        ids = list(CheckedOutStock.objects.order_by('-checked_out_id').values_list('checked_out_id', flat=True))
+        response = self.client.get(reverse('stock'))
+        self.assertEqual(len(response.context['checked_out'].rows), PAST_STOCK_PAGE_SIZE)
+        self.assertEqual(response.context['checked_out_older'], ids[PAST_STOCK_PAGE_SIZE - 1])
+        self.assertContains(response, reverse('stock_history') + f'?before={ids[PAST_STOCK_PAGE_SIZE - 1]}')
+
+    def test_stock_history_view(self):
+        CheckedOutStock.objects.bulk_create(
+            CheckedOutStock(part_number=self.catalogue_item, location=self.location, quantity=1)
+            for _ in range(PAST_STOCK_PAGE_SIZE + 5)
+        )
+        ids = list(CheckedOutStock.objects.order_by('-checked_out_id').values_list('checked_out_id', flat=True))
+        response = self.client.get(reverse('stock_history') + f'?before={ids[PAST_STOCK_PAGE_SIZE - 1]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'history.html')
+        self.assertEqual([row.record.checked_out_id for row in response.context['table'].rows],
+                         ids[PAST_STOCK_PAGE_SIZE:])
+        self.assertIsNone(response.context['older'])
+
+    def test_stock_history_invalid_cursor(self):
+        response = self.client.get(reverse('stock_history') + '?before=abc')
+        self.assertEqual(response.status_code, 400)
+
+    def export(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_stock_export(self):
+        other = Location.objects.create(location_name="Other Location")
+        Stock.objects.create(part_number=self.catalogue_item, location=other, quantity=2)
+        lines = self.export('stock_export')
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('ID,Part Number,Description,Location ID,Location,Quantity'))
+        self.assertIn('12345,Test Part,', lines[1])
+
+        lines = self.export('stock_export', location=other.id, format='jsonl')
+        self.assertEqual(len(lines), 1)
+        row = json.loads(lines[0])
+        self.assertEqual((row['part_number'], row['location__location_name'], row['quantity']),
+                         ('12345', 'Other Location', 2))
+
+    def test_stock_history_export(self):
+        CheckedOutStock.objects.create(part_number=self.catalogue_item, location=self.location, quantity=3)
+        lines = self.export('stock_history_export')
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',12345,Test Part,', lines[1])
+
+    def test_catalogue_export(self):
+        lines = self.export('catalogue_export', format='jsonl')
+        self.assertEqual(json.loads(lines[0])['brand__name'], 'Test Brand')
+
+    async def test_exports_stream_over_asgi(self):
+        await Catalogue.objects.abulk_create(Catalogue(part_number=f'PN{i:05}', brand=self.brand)
+                                             for i in range(EXPORT_CHUNK_SIZE))
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('catalogue_export'))
+        # An async iterator, which Django doesn't read into memory before sending
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(len(b''.join(chunks).decode().splitlines()), EXPORT_CHUNK_SIZE + 2)
+
+    def test_export_unknown_format(self):
+        response = self.client.get(reverse('catalogue_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
     def test_checkout_stock_view(self):
         response = self.client.get(reverse('checkout_stock', args=[self.stock.stock_id]))
         self.assertEqual(response.status_code, 200)
@@ -76,6 +185,44 @@ class ViewTests(TestCase):
         self.assertTemplateUsed(response, 'table.html')
         self.assertContains(response, "Test Part")
 
+    def test_catalogue_view_paginates(self):
+        Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i:03}', brand=self.brand, category=f'{i % 7}')
+                                      for i in range(CATALOGUE_PAGE_SIZE + 10))
+        response = self.client.get(reverse('catalogue'))
+        self.assertEqual(len(response.context['table'].page.object_list), CATALOGUE_PAGE_SIZE)
+        response = self.client.get(reverse('catalogue') + '?page=2')
+        self.assertEqual(len(response.context['table'].page.object_list), 11)
+
+    def test_catalogue_view_sorts_in_database(self):
+        Catalogue.objects.bulk_create(Catalogue(part_number=f'PN{i:03}', brand=self.brand, category=f'{i % 7}')
+                                      for i in range(20))
+        # Databases disagree on where NULLs sort
+        Catalogue.objects.filter(category__isnull=True).update(category='')
+        response = self.client.get(reverse('catalogue') + '?sort=-category')
+        rows = [(row.record.category, row.record.part_number) for row in response.context['table'].page]
+        self.assertEqual(rows, sorted(rows, reverse=True))
+        self.assertIn('ORDER BY "app_catalogue"."category" DESC, "app_catalogue"."part_number" DESC',
+                      str(response.context['table'].data.data.query))
+
+    def test_catalogue_search_view(self):
+        Catalogue.objects.create(part_number="A12345", brand=self.brand, description="Other Part")
+        Catalogue.objects.create(part_number="99999", brand=self.brand, description="Unrelated")
+        response = self.client.get(reverse('catalogue_search') + '?q=12345')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'search.html')
+        self.assertEqual([row.record.part_number for row in response.context['table'].page], ['12345', 'A12345'])
+
+    def test_catalogue_search_by_brand_and_words(self):
+        other_brand = Brand.objects.create(name="Sick")
+        Catalogue.objects.create(part_number="1042033", brand=other_brand, description="Photoelectric sensor")
+        response = self.client.get(reverse('catalogue_search') + '?q=sick photo')
+        self.assertEqual([row.record.part_number for row in response.context['table'].page], ['1042033'])
+
+    def test_catalogue_search_view_without_query(self):
+        response = self.client.get(reverse('catalogue_search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "Test Part")
+
     def test_catalogue_new_view(self):
         response = self.client.get(reverse('catalogue_new'))
         self.assertEqual(response.status_code, 200)
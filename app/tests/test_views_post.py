@@ -2,7 +2,9 @@ from django.contrib.auth.models import User
 from django.test import TestCase, Client
 from django.urls import reverse
 
-from app.models import Stock, Catalogue, Bom, Location, Brand, BomItems
+from app.forms import BomChecklistForm
+from app.models import Stock, Catalogue, Bom, Location, Brand, BomItems, BomChecklist
+from app.views import Util
 
 
 class PostTests(TestCase):
@@ -121,10 +123,112 @@ class PostTests(TestCase):
         response = self.client.post(reverse('bom_edit', args=[self.bom.bom_id]), {
             "bomitems_set-TOTAL_FORMS": "1",
             "bomitems_set-INITIAL_FORMS": "1",
-            "bomitems_set-0-id": "1",
+            "bomitems_set-0-id": str(self.bom_item.pk),
             "bomitems_set-0-part_number": "123",
             "bomitems_set-0-quantity": "10",
         }, follow=True)
         self.assertEqual(response.status_code, 200)
         self.bom_item.refresh_from_db()
         self.assertEqual(self.bom_item.quantity, 10)
+
+    def test_bom_reservations_post(self):
+        response = self.client.post(reverse('bom_allocate', args=[self.bom.bom_id]), follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.reserved, 2)
+        self.assertContains(response, 'Close BOM')
+        self.assertNotContains(response, 'Not enough stock')
+
+        BomItems.objects.create(part_number=self.catalogue_item2, quantity=4, bom=self.bom)
+        response = self.client.post(reverse('bom_allocate', args=[self.bom.bom_id]), follow=True)
+        self.assertContains(response, 'Not enough stock to reserve all of 1 line. Still needed: 456 (1)')
+
+        self.client.post(reverse('bom_close', args=[self.bom.bom_id]))
+        self.bom.refresh_from_db()
+        self.stock.refresh_from_db()
+        self.assertEqual((self.bom.open, self.stock.reserved), (False, 0))
+        self.client.post(reverse('bom_close', args=[self.bom.bom_id]))
+        self.bom.refresh_from_db()
+        self.assertTrue(self.bom.open)
+
+    def test_bom_checklist_scan_post(self):
+        Util.generate_bom_checklist(self.bom.bom_id)
+        other_bom = Bom.objects.create(name="Bom 2")
+        BomItems.objects.create(part_number=self.catalogue_item, quantity=5, bom=other_bom)
+        Util.generate_bom_checklist(other_bom.bom_id)
+        for _ in range(2):
+            response = self.client.post(reverse('bom', args=[self.bom.bom_id]), {'part_number': '123'})
+            self.assertRedirects(response, reverse('bom', args=[self.bom.bom_id]))
+        response = self.client.post(reverse('bom', args=[self.bom.bom_id]), {'part_number': '123'})
+        self.assertFormError(response.context['form'], 'part_number', BomChecklistForm.ALL_SCANNED)
+        self.assertEqual(list(BomChecklist.objects.order_by('bom').values_list('quantity_remaining', flat=True)),
+                         [0, 5])
+
+    def test_stock_create_fragment(self):
+        fragment = {'HX-Request': 'true'}
+        data = {'part_number': '789', 'location': self.location.id, 'quantity': 5, 'submit-stock': 'submit-stock'}
+        response = self.client.post(reverse('stock'), data, headers=fragment)
+        self.assertTemplateUsed(response, 'fragments/stock_scan.html')
+        self.assertTemplateNotUsed(response, 'stock.html')
+        entry = Stock.objects.get(part_number='789')
+        self.assertContains(response, f'id="stock-{entry.stock_id}"')
+        self.assertContains(response, 'data-prepend-to="#current-stock tbody"')
+        self.assertEqual(response.context['form'].initial['location'], self.location)
+
+        # The entry is saved, but isn't shown on a page filtered to other stock
+        response = self.client.post(reverse('stock') + '?part_number=123', data, headers=fragment)
+        self.assertNotContains(response, f'id="stock-{entry.stock_id}"')
+
+        response = self.client.post(reverse('stock'), data | {'part_number': 'NotReal'}, headers=fragment)
+        self.assertContains(response, "Part number does not exist")
+        self.assertNotContains(response, '<tr')
+
+    def test_bom_checklist_scan_fragment(self):
+        Util.generate_bom_checklist(self.bom.bom_id)
+        response = self.client.post(reverse('bom', args=[self.bom.bom_id]), {'part_number': '123'},
+                                    headers={'HX-Request': 'true'})
+        self.assertTemplateUsed(response, 'fragments/checklist_scan.html')
+        self.assertTemplateNotUsed(response, 'bom.html')
+        self.assertEqual([row.record.quantity_remaining for row in response.context['table'].rows], [1])
+        self.assertContains(response, 'id="checklist-123"')
+
+    def test_scans_posted_again_are_applied_once(self):
+        # As when a reply is lost and the page posts the scan again, or queues it to replay
+        data = {'part_number': '123', 'location': self.location.id, 'quantity': 5, 'submit-stock': 'submit-stock',
+                'scan_key': 'stock-scan'}
+        for _ in range(2):
+            response = self.client.post(reverse('stock'), data, headers={'HX-Request': 'true'})
+            self.assertContains(response, f'id="stock-{self.stock.stock_id}"')
+        self.assertRedirects(self.client.post(reverse('stock'), data), reverse('stock'))
+        replayed = self.client.post(reverse('api_replay_scans'), {'scans': [{
+            'key': 'stock-scan', 'kind': 'stock', 'part_number': '123', 'location': self.location.id, 'quantity': 5,
+        }]}, content_type='application/json')
+        self.assertEqual(replayed.json()['results'][0]['stock']['quantity'], 15)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.quantity, 15)
+
+        # The scan ticked off the last one, which doesn't make posting it again fail
+        Util.generate_bom_checklist(self.bom.bom_id)
+        BomChecklist.objects.filter(part_number='123').update(quantity_remaining=1)
+        url = reverse('bom', args=[self.bom.bom_id])
+        for _ in range(2):
+            response = self.client.post(url, {'part_number': '123', 'scan_key': 'checklist-scan'},
+                                        headers={'HX-Request': 'true'})
+            self.assertEqual([row.record.quantity_remaining for row in response.context['table'].rows], [0])
+        response = self.client.post(url, {'part_number': '123', 'scan_key': 'another-scan'})
+        self.assertFormError(response.context['form'], 'part_number', BomChecklistForm.ALL_SCANNED)
+
+    def test_checkout_stock_fragment(self):
+        url = reverse('checkout_stock', args=[self.stock.stock_id])
+        response = self.client.post(url, {'quantity': 4}, headers={'HX-Request': 'true'})
+        self.assertTemplateUsed(response, 'fragments/checkout_done.html')
+        self.assertContains(response, 'Checked out 4 of 123')
+        self.assertEqual(response.context['table'].rows[0].record.quantity, 6)
+
+        response = self.client.post(url, {'quantity': 0}, headers={'HX-Request': 'true'})
+        self.assertTemplateUsed(response, 'fragments/checkout_form.html')
+        self.assertContains(response, 'id="checkout-form"')
+
+        response = self.client.post(url, {'quantity': 6}, headers={'HX-Request': 'true'})
+        self.assertIsNone(response.context['table'])
+        self.assertContains(response, 'None is left in Test Location')
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('', views.default, name='default'),
@@ -10,16 +10,37 @@ urlpatterns = [
     path('accounts/login/', views.login),
     path('logout/', views.logout, name='logout'),
     path('stock', views.stock, name='stock'),
+    path('stock/export', views.stock_export, name='stock_export'),
+    path('stock/history', views.stock_history, name='stock_history'),
+    path('stock/history/export', views.stock_history_export, name='stock_history_export'),
+    path('stock/balances', views.stock_balances, name='stock_balances'),
     path('checkout_stock/<int:stock_id>', views.checkout_stock, name='checkout_stock'),
     path('catalogue', views.catalogue, name='catalogue'),
     path('catalogue/new', views.catalogue_new, name='catalogue_new'),
+    path('catalogue/export', views.catalogue_export, name='catalogue_export'),
+    path('catalogue/search', views.catalogue_search, name='catalogue_search'),
     path('catalogue/<str:part_number>', views.catalogue_entry, name='catalogue_entry'),
     path('catalogue/edit/<str:part_number>', views.catalogue_edit, name='catalogue_edit'),
     path('bom/<int:bom_id>', views.bom, name='bom'),
     path('bom/new', views.bom_new, name='bom_new'),
+    path('bom/availability', views.bom_availability_all, name='bom_availability_all'),
+    path('bom/events/<int:bom_id>', views.bom_events, name='bom_events'),
+    path('bom/demand', views.bom_demand, name='bom_demand'),
+    path('bom/allocate/<int:bom_id>', views.bom_allocate, name='bom_allocate'),
+    path('bom/release/<int:bom_id>', views.bom_release, name='bom_release'),
+    path('bom/close/<int:bom_id>', views.bom_close, name='bom_close'),
+    path('bom/availability/<int:bom_id>', views.bom_availability, name='bom_availability'),
     path('bom/edit/<int:bom_id>', views.bom_edit, name='bom_edit'),
+    path('bom/import/<int:bom_id>', views.bom_import, name='bom_import'),
+    path('bom/export/<int:bom_id>', views.bom_export, name='bom_export'),
     path('generate_bom_checklist/<int:bom_id>', views.generate_bom_checklist, name='generate_bom_checklist'),
     path('location/new', views.location_new, name='location_new'),
     path('location/<int:loc_id>', views.location, name='location'),
     path('brand/<int:brand_id>', views.brand, name='brand'),
+    path('api/stock/receive', api.receive_stock, name='api_receive_stock'),
+    path('api/stock/receive_batch', api.receive_stock_batch, name='api_receive_stock_batch'),
+    path('api/scans/replay', api.replay_scans, name='api_replay_scans'),
+    path('api/stock/<int:stock_id>/checkout', api.checkout_stock, name='api_checkout_stock'),
+    path('api/stock/<int:stock_id>/transfer', api.transfer_stock, name='api_transfer_stock'),
+    path('api/bom/<int:bom_id>/scan', api.scan_checklist, name='api_scan_checklist'),
 ]
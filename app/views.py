@@ -1,17 +1,104 @@
+import csv
+import json
+from itertools import chain, islice
+from urllib.parse import quote
+
 import django.contrib.auth
+from asgiref.sync import sync_to_async
+from django.contrib import messages
 from django.contrib.auth import authenticate
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib.auth.forms import AuthenticationForm
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.db.models import Q, QuerySet
 from django.forms import inlineformset_factory
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, HttpResponseBadRequest, Http404, StreamingHttpResponse, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.defaultfilters import pluralize
+from django.views.decorators.http import require_POST
+from django.views.static import serve
 from django.urls.base import reverse_lazy, reverse
+from django.utils._os import safe_join
+from django_tables2 import RequestConfig, LazyPaginator
 
+from app import services, bom_csv, reports, live, images, api
 from app.forms import StockForm, CatalogueForm, BomItemsForm, LocationForm, BomForm, BomChecklistForm, \
-    StockFilterForm, CatalogueEditForm, UserCreateForm, CheckoutForm, BomItemsFormset
-from app.models import Stock, Catalogue, Bom, BomItems, Location, BomChecklist, CheckedOutStock, Brand
-from app.tables import CatalogueTable, StockTable, BomItemsTable, BomChecklistTable
+    StockFilterForm, CatalogueEditForm, UserCreateForm, CheckoutForm, BomItemsFormset, CatalogueSearchForm, \
+    BomImportForm, BomAvailabilityForm, StockBalanceForm
+from app.models import Stock, Catalogue, Bom, BomItems, Location, BomChecklist, CheckedOutStock, Brand, ProcessedScan
+from app.search import search_catalogue
+from app.tables import CatalogueTable, StockTable, BomItemsTable, BomChecklistTable, CheckedOutStockTable, \
+    BomAvailabilityTable, BomAvailabilitySummaryTable, DemandTable, StockBalanceTable
+
+# Number of checked out entries shown per page of the past stock history
+PAST_STOCK_PAGE_SIZE = 25
+# Number of catalogue entries shown per page of the catalogue tables
+CATALOGUE_PAGE_SIZE = 50
+# Number of parts shown per page of the demand rollup
+DEMAND_PAGE_SIZE = 100
+# Number of balances shown per page of the stock on hand at a point in time
+BALANCES_PAGE_SIZE = 100
+# Seconds browsers may keep files whose names are the hash of their contents
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Number of rows fetched per query while exporting
+EXPORT_CHUNK_SIZE = 2000
+# Columns of the exports, as (field, CSV heading). JSON Lines exports are keyed by field
+STOCK_EXPORT_COLUMNS = [
+    ('stock_id', 'ID'),
+    ('part_number', 'Part Number'),
+    ('part_number__description', 'Description'),
+    ('location', 'Location ID'),
+    ('location__location_name', 'Location'),
+    ('quantity', 'Quantity'),
+    ('comment', 'Comment'),
+    ('created', 'Created'),
+    ('last_modified', 'Last Modified'),
+    ('modified_by', 'Modified By'),
+]
+CATALOGUE_EXPORT_COLUMNS = [
+    ('part_number', 'Part Number'),
+    ('brand__name', 'Brand'),
+    ('category', 'Category'),
+    ('description', 'Common description'),
+    ('vendor_description', 'Vendor Description'),
+    ('purchase_unit_cost_eur', 'Purchasing Unit Price'),
+    ('sale_unit_cost_eur', 'Sale Unit Price'),
+    ('notes', 'Notes'),
+    ('url', 'URL'),
+    ('last_modified', 'Last Modified'),
+    ('modified_by', 'Modified By'),
+]
+CHECKED_OUT_EXPORT_COLUMNS = [
+    ('checked_out_id', 'ID'),
+    ('part_number', 'Part Number'),
+    ('part_number__description', 'Description'),
+    ('location', 'Location ID'),
+    ('location__location_name', 'Location'),
+    ('quantity', 'Quantity'),
+    ('comment', 'Comment'),
+    ('last_modified', 'Checked Out'),
+    ('modified_by', 'Modified By'),
+]
+
+
+class Echo:
+    """A file for csv.writer that hands back each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+async def aiterate_chunks(lines, size):
+    """Join the lines of a sync iterator `size` at a time, reading each chunk in the thread that runs sync code, where
+    the iterator's database cursor was opened."""
+    lines = iter(lines)
+    take = sync_to_async(lambda: ''.join(islice(lines, size)))
+    while chunk := await take():
+        yield chunk
 
 
 class Util:
@@ -37,11 +124,82 @@ class Util:
         return render(request, 'form.html', context)
 
     @staticmethod
+    def wants_fragment(request) -> bool:
+        """Whether the page posted a scan from script, so only wants back what the scan changed.
+        Uses htmx's request header, so forms can also be driven by htmx."""
+        return request.headers.get('HX-Request') == 'true'
+
+    @staticmethod
+    def scan_key(request):
+        """The key scan_queue.js gave the scan being posted, which it also queues the scan with if the post gets no
+        reply. None if there isn't one, or it's too long to record."""
+        key = request.POST.get('scan_key')
+        return key if key and len(key) <= ProcessedScan._meta.get_field('key').max_length else None
+
+    @staticmethod
+    def paginate(request, table, per_page):
+        """Sort and paginate a table in the database from the request's query parameters.
+        The lazy paginator avoids counting the whole table on every page."""
+        RequestConfig(request, paginate={'per_page': per_page, 'paginator_class': LazyPaginator}).configure(table)
+        return table
+
+    @staticmethod
+    def stream(request, lines, content_type, filename):
+        """Send lines as a download, as they are produced rather than building the file in memory.
+        Over ASGI, Django reads a sync iterator into a list before sending any of it, so the lines are instead taken a
+        chunk at a time in the thread that runs sync code, and handed to the server as an async iterator."""
+        if isinstance(request, ASGIRequest):
+            lines = aiterate_chunks(lines, EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @staticmethod
+    def stream_csv(request, rows, filename):
+        """Send rows as a CSV download, writing each row as it is produced."""
+        writer = csv.writer(Echo())
+        return Util.stream(request, (writer.writerow(row) for row in rows), 'text/csv', filename)
+
+    @staticmethod
+    def export(request, queryset, columns, name):
+        """Stream a queryset as CSV, or as JSON Lines if the request asks for format=jsonl.
+        Rows are read a chunk at a time, through a server-side cursor where the database has them,
+        so memory use doesn't grow with the number of rows."""
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in ('csv', 'jsonl'):
+            return HttpResponseBadRequest('Unknown export format')
+        fields = [field for field, _ in columns]
+        rows = queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        if export_format == 'csv':
+            return Util.stream_csv(request, chain([[heading for _, heading in columns]], rows), f'{name}.csv')
+        lines = (json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+        return Util.stream(request, lines, 'application/x-ndjson', f'{name}.jsonl')
+
+    @staticmethod
+    def checked_out_page(before=None, size=PAST_STOCK_PAGE_SIZE):
+        """Return a page of checked out stock, newest first, using the id as a cursor.
+        Only entries older than the `before` id are included.
+        Returns the rows and the cursor for the next page, or None if there are no older entries."""
+        rows = CheckedOutStock.objects.order_by('-checked_out_id')
+        if before is not None:
+            rows = rows.filter(checked_out_id__lt=before)
+        # Fetch one extra row to find out whether an older page exists without counting the table
+        rows = list(CheckedOutStockTable.shape_queryset(rows)[:size + 1])
+        if len(rows) > size:
+            return rows[:size], rows[size - 1].checked_out_id
+        return rows, None
+
+    @staticmethod
+    @transaction.atomic
     def generate_bom_checklist(bom_id):
-        items = BomItems.objects.filter(bom_id=bom_id).all()
+        """Replace the BOM's checklist with one line per BOM item, all or nothing."""
         BomChecklist.objects.filter(bom_id=bom_id).delete()
-        for item in items:
-            BomChecklist(bom=item.bom, part_number=item.part_number, quantity_remaining=item.quantity).save()
+        items = BomItems.objects.filter(bom_id=bom_id).values_list('part_number_id', 'quantity')
+        BomChecklist.objects.bulk_create(
+            BomChecklist(bom_id=bom_id, part_number_id=part_number, quantity_remaining=quantity)
+            for part_number, quantity in items
+        )
+        transaction.on_commit(lambda: live.checklist_replaced(bom_id))
 
 
 def register(request):
@@ -98,16 +256,13 @@ def index(request):
 def handle_stock_form(request, form):
     """Deal with the post request of the stock input form.
     The form must be valid."""
-    try:
-        entry = Stock.objects.get(
-            part_number=form.cleaned_data['part_number'],
-            location=form.cleaned_data['location'],
-        )
-        entry.quantity += form.cleaned_data['quantity']
-    except Stock.DoesNotExist:
-        entry = form.save(commit=False)
-    entry.modified_by = request.user.username
-    entry.save()
+    return services.receive_stock(
+        form.cleaned_data['part_number'],
+        form.cleaned_data['location'],
+        form.cleaned_data['quantity'],
+        username=request.user.username,
+        comment=form.cleaned_data['comment'],
+    )
 
 
 @login_required
@@ -117,12 +272,12 @@ def handle_stock_filter(request, form) -> str:
     Returns the filter url"""
 
     part_number = form.cleaned_data['part_number']
-    location_ = Location.objects.filter(location_name=form.cleaned_data['location']).first()
+    location_ = form.cleaned_data['location']
     url = reverse_lazy('stock') + '?'
-    if part_number is not None:
+    if part_number:
         url += f'part_number={part_number}&'
     if location_:
-        url += f'location={location_.id}&'
+        url += f'location={location_}&'
     # Remove the final &
     return url[:-1]
 
@@ -146,8 +301,18 @@ def stock(request):
             form = StockForm(request.POST)
             filter_form = StockFilterForm()
             if form.is_valid():
-                handle_stock_form(request, form)
+                # Applied once, however many times the page posts it
+                result = api.apply_once(Util.scan_key(request), request.user.username,
+                                        lambda: {'stock': api.stock_json(handle_stock_form(request, form))})
+                if Util.wants_fragment(request):
+                    # The entry's row, unless the page is filtered to other stock, and a form to scan the next part
+                    stock_id = result['stock']['stock_id']
+                    table = StockTable(filter_stock_from_parameters(request).filter(stock_id=stock_id))
+                    form = StockForm(initial={'location': form.cleaned_data['location']})
+                    return render(request, 'fragments/stock_scan.html', {'form': form, 'table': table})
                 return redirect(stock)
+            if Util.wants_fragment(request):
+                return render(request, 'fragments/stock_scan.html', {'form': form})
         elif 'submit-filter' in request.POST:
             filter_form = StockFilterForm(request.POST)
             form = StockForm()
@@ -162,34 +327,88 @@ def stock(request):
         filter_form = StockFilterForm()
     # If the form being posted is not valid, it will fall through here to display errors
     stock_list = filter_stock_from_parameters(request)
+    checked_out, older = Util.checked_out_page()
     # noinspection PyTestUnpassedFixture
     context = {
         'form': form,
         'filter_form': filter_form,
         'table': StockTable(stock_list),
-        'catalogue': Catalogue.objects.all(),
-        'checked_out': CheckedOutStock.objects.all().order_by('checked_out_id').reverse()
+        'checked_out': CheckedOutStockTable(checked_out),
+        'checked_out_older': older,
     }
     return render(request, 'stock.html', context)
 
 
+@login_required
+def stock_history(request):
+    """Page through the checked out stock, newest first.
+    The `before` parameter is the id of the last entry on the previous page."""
+    before = request.GET.get('before')
+    try:
+        before = int(before) if before else None
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor')
+    checked_out, older = Util.checked_out_page(before)
+    context = {
+        'table': CheckedOutStockTable(checked_out),
+        'older': older,
+    }
+    return render(request, 'history.html', context)
+
+
+@login_required
+def stock_balances(request):
+    """The stock on hand at a point in time, from the latest snapshot before it and the ledger since."""
+    form = StockBalanceForm(request.GET if 'at' in request.GET else None)
+    rows = []
+    if form.is_valid():
+        filters = {}
+        if form.cleaned_data['location'] is not None:
+            filters['location'] = form.cleaned_data['location']
+        if form.cleaned_data['part_number']:
+            filters['part_number'] = form.cleaned_data['part_number']
+        balances = services.balances_at(form.cleaned_data['at'], **filters)
+        locations = Location.objects.in_bulk({location for _, location in balances})
+        rows = [{'part_number': part_number, 'location': locations[location], 'quantity': quantity}
+                for (part_number, location), quantity in sorted(balances.items())]
+    table = StockBalanceTable(rows)
+    RequestConfig(request, paginate={'per_page': BALANCES_PAGE_SIZE}).configure(table)
+    return render(request, 'balances.html', {'form': form, 'table': table})
+
+
+@login_required
+def stock_export(request):
+    """Export the current stock, filtered the same way as the stock page."""
+    stock_list = filter_stock_from_parameters(request).order_by('stock_id')
+    return Util.export(request, stock_list, STOCK_EXPORT_COLUMNS, 'stock')
+
+
+@login_required
+def stock_history_export(request):
+    checked_out = CheckedOutStock.objects.order_by('-checked_out_id')
+    return Util.export(request, checked_out, CHECKED_OUT_EXPORT_COLUMNS, 'checked-out-stock')
+
+
 @login_required
 def checkout_stock(request, stock_id):
-    entry = get_object_or_404(Stock, stock_id=stock_id)
+    entry = get_object_or_404(Stock.objects.select_related('part_number', 'location'), stock_id=stock_id)
     if request.method == 'POST':
         form = CheckoutForm(request.POST)
         if form.is_valid():
-            quantity = form.cleaned_data['quantity']
-            checked_out = CheckedOutStock.from_stock(entry)
-            if quantity >= entry.quantity:
-                entry.delete()
-            else:
-                entry.quantity -= quantity
-                entry.save()
-                checked_out.quantity = quantity
-            checked_out.modified_by = request.user.username
-            checked_out.save()
+            try:
+                checked_out = services.checkout_stock(stock_id, form.cleaned_data['quantity'],
+                                                      username=request.user.username)
+            except Stock.DoesNotExist:
+                # Checked out by someone else since the page was loaded
+                checked_out = None
+            if Util.wants_fragment(request):
+                remaining = StockTable.shape_queryset(Stock.objects.filter(stock_id=stock_id)).first()
+                context = {'entry': entry, 'checked_out': checked_out,
+                           'table': StockTable([remaining], exclude=['check_out']) if remaining else None}
+                return render(request, 'fragments/checkout_done.html', context)
             return redirect(stock)
+        if Util.wants_fragment(request):
+            return render(request, 'fragments/checkout_form.html', {'entry': entry, 'form': form})
     else:
         form = CheckoutForm()
     table = StockTable([entry], exclude=['check_out'])
@@ -198,28 +417,48 @@ def checkout_stock(request, stock_id):
 
 @login_required
 def delete_stock(request, stock_id):
-    stock_entry = get_object_or_404(Stock, stock_id=stock_id)
-    checked_out = CheckedOutStock.from_stock(stock_entry)
-    checked_out.save()
-    stock_entry.delete()
+    try:
+        services.checkout_stock(stock_id, username=request.user.username)
+    except Stock.DoesNotExist:
+        raise Http404('Stock entry not found')
     return redirect(request.META.get('HTTP_REFERER'))
 
 
 @login_required
 def catalogue(request):
+    table = CatalogueTable(Catalogue.objects.all(), order_by='brand')
     context = {
-        'table': CatalogueTable(Catalogue.objects.all(), order_by=('brand', 'part_number')),
+        'table': Util.paginate(request, table, CATALOGUE_PAGE_SIZE),
         'button_url': '/catalogue/new',
         'button_text': 'New Item',
         'heading': 'Catalogue',
+        'export_url': reverse('catalogue_export'),
     }
     return render(request, 'table.html', context)
 
 
+@login_required
+def catalogue_export(request):
+    return Util.export(request, Catalogue.objects.order_by('part_number'), CATALOGUE_EXPORT_COLUMNS, 'catalogue')
+
+
+@login_required
+def catalogue_search(request):
+    form = CatalogueSearchForm(request.GET)
+    query = form.cleaned_data['q'] if form.is_valid() else ''
+    table = CatalogueTable(search_catalogue(query))
+    context = {
+        'form': form,
+        'query': query,
+        'table': Util.paginate(request, table, CATALOGUE_PAGE_SIZE),
+    }
+    return render(request, 'search.html', context)
+
+
 @login_required
 def catalogue_new(request):
     if request.method == 'POST':
-        form = CatalogueForm(request.POST, )
+        form = CatalogueForm(request.POST, request.FILES)
         if form.is_valid():
             Util.save_with_user(request, form)
             if form.cleaned_data['scanToStock']:
@@ -240,6 +479,30 @@ def catalogue_new(request):
     return render(request, 'form.html', context)
 
 
+@login_required
+def media_file(request, path):
+    """Serve an uploaded file to a logged in user. In production the proxy in front of the site sends the file, told to
+    by an X-Accel-Redirect header to MEDIA_ACCEL_REDIRECT. Catalogue images and thumbnails are named by their contents,
+    so never change."""
+    try:
+        safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse()
+        # The proxy sets the type of the file it sends
+        del response['Content-Type']
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + quote(path)
+    elif settings.DEBUG:
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    else:
+        raise Http404
+    if images.CONTENT_ADDRESSED.match(path):
+        # Private, so that only the browser of the user who logged in keeps a copy
+        response['Cache-Control'] = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+
 @login_required
 def catalogue_entry(request, part_number):
     entry = get_object_or_404(Catalogue, pk=part_number)
@@ -260,7 +523,7 @@ def catalogue_edit(request, part_number):
     catalogue_item = get_object_or_404(Catalogue, pk=part_number)
 
     if request.method == 'POST':
-        form = CatalogueEditForm(request.POST, instance=catalogue_item)
+        form = CatalogueEditForm(request.POST, request.FILES, instance=catalogue_item)
         if form.is_valid():
             Util.save_with_user(request, form)
             return redirect(catalogue_entry, part_number)
@@ -287,6 +550,7 @@ def location(request, loc_id):
 def brand(request, brand_id):
     brand_ = get_object_or_404(Brand, brand_id=brand_id)
     table = CatalogueTable(Catalogue.objects.filter(brand=brand_).all(), order_by='part_number')
+    Util.paginate(request, table, CATALOGUE_PAGE_SIZE)
     return render(request, 'table.html', {'table': table, 'heading': brand_.name})
 
 
@@ -331,24 +595,50 @@ def bom(request, bom_id):
     checklist_table = BomChecklistTable(BomChecklist.objects.filter(bom=bom_))
     if request.method == 'POST':
         form = BomChecklistForm(request.POST, bom_id=bom_id)
-        if form.is_valid():
-            # The part number has been validated to exist
-            scanned = BomChecklist.objects.get(part_number=form.cleaned_data['part_number'])
-            # The quantity has been validated to be greater than 0
-            scanned.quantity_remaining -= 1
-            scanned.save()
+        # Checked for an earlier post of the same scan before validating, which that post may have made fail
+        result = api.apply_once(Util.scan_key(request), request.user.username,
+                                lambda: api.tick_off_checklist(form)[0])
+        if 'checklist' in result:
+            if Util.wants_fragment(request):
+                part_number = result['checklist']['part_number']
+                table = BomChecklistTable(BomChecklist.objects.filter(bom=bom_, part_number=part_number))
+                context = {'form': BomChecklistForm(bom_id=bom_id), 'bom': bom_, 'table': table}
+                return render(request, 'fragments/checklist_scan.html', context)
             return redirect(bom, bom_id)
+        if form.is_valid():
+            # The form was valid, but another station scanned the last one, or an earlier post of the scan failed
+            for field, errors in result['errors'].items():
+                for error in errors:
+                    form.add_error(None if field == '__all__' else field, error)
+        if Util.wants_fragment(request):
+            return render(request, 'fragments/checklist_scan.html', {'form': form, 'bom': bom_})
     else:
         form = BomChecklistForm(bom_id=bom_id)
     context = {
         'form': form,
         'bom': bom_,
         'bom_table': bom_table,
-        'checklist_table': checklist_table
+        'checklist_table': checklist_table,
+        # Live updates hold a connection open for as long as the page is, so are only offered when served over ASGI
+        'live': isinstance(request, ASGIRequest),
     }
     return render(request, 'bom.html', context)
 
 
+@login_required
+def bom_events(request, bom_id):
+    """Stream changes to a BOM's checklist, and to the stock of every part, as Server-Sent Events."""
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Live updates need the site to be served over ASGI', status=501)
+    get_object_or_404(Bom, bom_id=bom_id)
+    response = StreamingHttpResponse(live.stream(live.bom_group(bom_id), live.STOCK_GROUP),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def bom_edit(request, bom_id):
     bom_ = get_object_or_404(Bom, bom_id=bom_id)
@@ -364,3 +654,109 @@ def bom_edit(request, bom_id):
         formset = MyFormSet(instance=bom_, form_kwargs={'bom_id': bom_id})
     labels = ['Part Number', 'Quantity']
     return render(request, 'bom_edit.html', {'boms': boms, 'my_bom': bom_, 'formset': formset, 'labels': labels})
+
+
+def builds_from_parameters(request) -> tuple:
+    """The availability form and the number of builds it asks for, which is 1 if the form isn't valid."""
+    form = BomAvailabilityForm(request.GET if 'builds' in request.GET else None)
+    return form, form.cleaned_data['builds'] if form.is_valid() else 1
+
+
+@login_required
+def bom_availability(request, bom_id):
+    """What's short to build a BOM a number of times, from the stock in every location."""
+    bom_ = get_object_or_404(Bom, bom_id=bom_id)
+    form, builds = builds_from_parameters(request)
+    lines = list(reports.bom_availability(builds, boms=[bom_]))
+    summary = reports.summarise(lines)
+    context = {
+        'heading': f'{bom_.name} Availability',
+        'bom': bom_,
+        'form': form,
+        'builds': builds,
+        'table': BomAvailabilityTable(lines),
+        'summary': summary[0] if summary else None,
+    }
+    return render(request, 'availability.html', context)
+
+
+@login_required
+def bom_availability_all(request):
+    """The availability of every BOM at once, for planning."""
+    form, builds = builds_from_parameters(request)
+    summaries = reports.summarise(reports.bom_availability(builds))
+    context = {
+        'heading': 'BOM Availability',
+        'form': form,
+        'builds': builds,
+        'table': BomAvailabilitySummaryTable(summaries),
+    }
+    return render(request, 'availability.html', context)
+
+
+@login_required
+@require_POST
+def bom_allocate(request, bom_id):
+    bom_ = get_object_or_404(Bom, bom_id=bom_id)
+    if bom_.open:
+        short = services.allocate_bom(bom_, username=request.user.username)
+        if short:
+            lines = ', '.join(f'{part_number} ({quantity})' for part_number, quantity in sorted(short.items()))
+            messages.warning(request, f'Not enough stock to reserve all of {len(short)} '
+                                      f'line{pluralize(len(short))}. Still needed: {lines}')
+    return redirect(bom, bom_id)
+
+
+@login_required
+@require_POST
+def bom_release(request, bom_id):
+    services.release_bom(get_object_or_404(Bom, bom_id=bom_id))
+    return redirect(bom, bom_id)
+
+
+@login_required
+@require_POST
+def bom_close(request, bom_id):
+    """Close an open BOM, releasing its reservations, or reopen a closed one."""
+    bom_ = get_object_or_404(Bom, bom_id=bom_id)
+    if bom_.open:
+        services.close_bom(bom_)
+    else:
+        bom_.open = True
+        bom_.save(update_fields=['open'])
+    return redirect(bom, bom_id)
+
+
+@login_required
+def bom_demand(request):
+    """The total demand for each part across every open BOM, against the stock of it."""
+    table = DemandTable(reports.demand_rollup(), order_by='-shortfall')
+    context = {
+        'table': Util.paginate(request, table, DEMAND_PAGE_SIZE),
+        'heading': 'Demand for Open BOMs',
+        'button_url': reverse('index'),
+        'button_text': 'View all Boms',
+    }
+    return render(request, 'table.html', context)
+
+
+@login_required
+def bom_import(request, bom_id):
+    bom_ = get_object_or_404(Bom, bom_id=bom_id)
+    result = None
+    if request.method == 'POST':
+        form = BomImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                result = bom_csv.import_bom(bom_, form.cleaned_data['file'], replace=form.cleaned_data['replace'])
+            except (ValueError, UnicodeDecodeError) as e:
+                form.add_error('file', str(e))
+    else:
+        form = BomImportForm()
+    return render(request, 'bom_import.html', {'bom': bom_, 'form': form, 'result': result})
+
+
+@login_required
+def bom_export(request, bom_id):
+    bom_ = get_object_or_404(Bom, bom_id=bom_id)
+    return Util.stream_csv(request, bom_csv.export_rows(bom_), f'bom-{bom_.bom_id}.csv')
@@ -1,4 +1,13 @@
 #!/bin/bash
 
 python manage.py migrate
-python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+if [ "$PRODUCTION" = "1" ]; then
+    python manage.py collectstatic --noinput
+    if [ "$WEB_SERVER" = "asgi" ]; then
+        # Connections can't be reused under ASGI, where each request runs in its own thread
+        export SQL_CONN_MAX_AGE=${SQL_CONN_MAX_AGE:-0}
+    fi
+    exec gunicorn --config gunicorn.conf.py
+else
+    python manage.py runserver 0.0.0.0:8000
+fi
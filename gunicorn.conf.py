@@ -0,0 +1,35 @@
+"""gunicorn settings for production mode, read by `gunicorn --config gunicorn.conf.py`.
+
+WEB_SERVER: wsgi (the default) runs Django's WSGI application in gunicorn's own workers. asgi runs Inventory.asgi in
+    uvicorn workers, which is needed for live updates to BOM pages.
+WEB_WORKERS: the number of worker processes, by default two per CPU plus one. Under ASGI it is 1 unless
+    LIVE_LAYER=postgres, as the in-memory layer only sends live updates to pages served by the worker that made the
+    change.
+WEB_THREADS: the number of threads in each WSGI worker.
+PORT: the port to listen on.
+"""
+import multiprocessing
+import os
+
+server = os.environ.get('WEB_SERVER', 'wsgi')
+if server not in ('wsgi', 'asgi'):
+    raise ValueError(f'WEB_SERVER must be wsgi or asgi, not {server}')
+
+wsgi_app = f'Inventory.{server}:application'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+if server == 'asgi' and os.environ.get('LIVE_LAYER', 'memory') == 'memory':
+    workers = int(os.environ.get('WEB_WORKERS', 1))
+    if workers != 1:
+        raise ValueError('Live updates in memory only reach pages served by the same worker, so WEB_SERVER=asgi '
+                         'needs WEB_WORKERS=1, or LIVE_LAYER=postgres to share them between workers')
+else:
+    workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+if server == 'asgi':
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    # More than one thread switches gunicorn to its threaded worker. Each thread keeps its own database connection
+    threads = int(os.environ.get('WEB_THREADS', 1))
+# Restart workers now and then, so that a slow leak can't grow without bound
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = '-'
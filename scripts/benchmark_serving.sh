@@ -0,0 +1,39 @@
+#!/bin/bash
+# Compare runserver with production mode under the same load, against the database the app is configured for.
+# Extra arguments are passed to the benchmark_serving command, for example --requests 2000 --concurrency 32
+#
+# The benchmark logs in as a user made for this run, with a random password, which is deleted again when the script
+# exits, however it exits.
+set -e
+export BENCHMARK_USERNAME=benchmark-$(python -c 'import secrets; print(secrets.token_hex(4))')
+export BENCHMARK_PASSWORD=$(python -c 'import secrets; print(secrets.token_urlsafe(24))')
+SERVER=
+
+cleanup() {
+    if [ -n "$SERVER" ]; then
+        kill $SERVER 2> /dev/null || :
+    fi
+    python manage.py shell -c "import os; from django.contrib.auth.models import User
+User.objects.filter(username=os.environ['BENCHMARK_USERNAME']).delete()"
+}
+
+python manage.py migrate
+trap cleanup EXIT
+python manage.py shell -c "import os; from django.contrib.auth.models import User
+User.objects.create_user(os.environ['BENCHMARK_USERNAME'], password=os.environ['BENCHMARK_PASSWORD'])"
+
+echo "runserver"
+python manage.py runserver 127.0.0.1:8100 --noreload > /dev/null 2>&1 &
+SERVER=$!
+python manage.py benchmark_serving --url http://127.0.0.1:8100 --username "$BENCHMARK_USERNAME" \
+    --password "$BENCHMARK_PASSWORD" "$@"
+kill $SERVER
+SERVER=
+
+echo "Production mode"
+export PRODUCTION=1
+python manage.py collectstatic --noinput > /dev/null
+PORT=8101 gunicorn --config gunicorn.conf.py > /dev/null 2>&1 &
+SERVER=$!
+python manage.py benchmark_serving --url http://127.0.0.1:8101 --username "$BENCHMARK_USERNAME" \
+    --password "$BENCHMARK_PASSWORD" "$@"
@@ -11,7 +11,7 @@ python manage.py makemigrations
 echo "Migrating models"
 python manage.py migrate
 echo Populating Catalogue
-python manage.py shell < populate/catalogue.py
+python manage.py import_catalogue populate/catalogue.csv
 echo Creating Admin Account
 python manage.py createsuperuser
 echo Done
@@ -3,7 +3,7 @@ python manage.py flush
 echo Migrating DB
 python manage.py migrate
 echo Populating Catalogue
-python manage.py shell < populate/catalogue.py
+python manage.py import_catalogue populate/catalogue.csv
 echo Creating Admin Account
 python manage.py createsuperuser
 echo Done
\ No newline at end of file